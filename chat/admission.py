@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Share of the limits each priority may use. Lower priorities are turned away
+# first, which leaves headroom for the workspaces that matter most.
+PRIORITY_HEADROOM = {"high": 1.0, "normal": 0.8, "low": 0.5}
+
+admission_decisions = registry.counter(
+    "slackbot_admission_total",
+    "Admission decisions for mentions: admitted, deferred, admitted after deferral, shed.",
+    ("priority", "decision")
+)
+
+
+class RecentSamples:
+    """
+    Values observed in the last `window` seconds. Old samples age out even when
+    nothing new arrives, so a signal recovers once the load it measured is gone.
+    """
+
+    def __init__(self, window=30.0, min_samples=5):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = deque()
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self._samples.append((time.monotonic(), value))
+
+    def percentile(self, pct):
+        """
+        Returns the percentile of the recent values, or None when there are too few.
+        """
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            values = sorted(value for _, value in self._samples)
+        if len(values) < self.min_samples:
+            return None
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class AdmissionController:
+    """
+    Decides whether a mention is answered now. Load is the highest of three
+    ratios, each against its limit (0 turns a limit off): mentions in flight,
+    p95 queue delay (how old mentions are when handling starts) and p95 LLM
+    latency, both over the last `window` seconds. A mention is admitted while
+    the load is below its workspace's share of the limits.
+
+    A mention that is turned away is deferred: it is queued again and retried
+    every `defer_interval` seconds until it is admitted or `defer_timeout`
+    seconds have passed since it was first deferred. The controller only keeps
+    the time of the first deferral, in the event itself, so a deferred mention
+    can be retried by another worker or process.
+    """
+
+    def __init__(self, max_in_flight=0, max_queue_delay=0.0, max_llm_latency=0.0, window=30.0,
+                 defer_interval=1.0, defer_timeout=30.0, priorities=None, default_priority="normal"):
+        if default_priority not in PRIORITY_HEADROOM:
+            logger.error(f"Unknown default admission priority {default_priority!r}, using 'normal'")
+            default_priority = "normal"
+        self.max_in_flight = max_in_flight
+        self.max_queue_delay = max_queue_delay
+        self.max_llm_latency = max_llm_latency
+        self.defer_interval = defer_interval
+        self.defer_timeout = defer_timeout
+        self.priorities = priorities or {}
+        self.default_priority = default_priority
+        self.queue_delays = RecentSamples(window)
+        self.llm_latencies = RecentSamples(window)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.max_in_flight or self.max_queue_delay or self.max_llm_latency)
+
+    def priority(self, team_id):
+        return self.priorities.get(team_id, self.default_priority)
+
+    def load(self):
+        """
+        Returns the current load as a fraction of the limits; 1.0 means at the limit.
+        """
+        ratios = [0.0]
+        if self.max_in_flight:
+            ratios.append(self.in_flight / self.max_in_flight)
+        if self.max_queue_delay:
+            ratios.append((self.queue_delays.percentile(95) or 0.0) / self.max_queue_delay)
+        if self.max_llm_latency:
+            ratios.append((self.llm_latencies.percentile(95) or 0.0) / self.max_llm_latency)
+        return max(ratios)
+
+    def try_admit(self, team_id, queue_delay=None):
+        """
+        Admits a mention if the load allows it for the team's priority. Every
+        admitted mention must be released.
+        """
+        if queue_delay is not None:
+            self.queue_delays.add(queue_delay)
+        headroom = PRIORITY_HEADROOM[self.priority(team_id)]
+        with self._lock:
+            if self.load() >= headroom:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def observe_llm(self, seconds):
+        self.llm_latencies.add(seconds)
+
+    def defer_expired(self, deferred_at):
+        """
+        Whether a mention first deferred at `deferred_at` (epoch seconds) has
+        waited long enough to be turned away for good.
+        """
+        return time.time() - deferred_at >= self.defer_timeout
+
+    def stats(self):
+        return {
+            "load": self.load(),
+            "in_flight": self.in_flight,
+            "queue_delay_p95": self.queue_delays.percentile(95),
+            "llm_latency_p95": self.llm_latencies.percentile(95),
+        }
+
+
+def priority_errors(default_priority, priorities):
+    """
+    Returns a message for every unknown priority name in the settings.
+    """
+    errors = []
+    if default_priority not in PRIORITY_HEADROOM:
+        errors.append(f"ADMISSION_DEFAULT_PRIORITY {default_priority!r} is not one of {sorted(PRIORITY_HEADROOM)}")
+    for item in filter(None, priorities.split(",")):
+        team_id, _, priority = item.partition("=")
+        if priority.strip() not in PRIORITY_HEADROOM:
+            errors.append(f"ADMISSION_PRIORITIES gives team {team_id.strip()} the unknown priority {priority.strip()!r}")
+    return errors
+
+
+def _parse_priorities(value):
+    priorities = {}
+    for item in filter(None, value.split(",")):
+        team_id, _, priority = item.partition("=")
+        priority = priority.strip()
+        if priority not in PRIORITY_HEADROOM:
+            logger.error(f"Unknown admission priority {priority!r} for team {team_id.strip()}, ignoring it")
+            continue
+        priorities[team_id.strip()] = priority
+    return priorities
+
+
+admission = AdmissionController(
+    max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+    max_queue_delay=settings.ADMISSION_MAX_QUEUE_DELAY,
+    max_llm_latency=settings.ADMISSION_MAX_LLM_LATENCY,
+    window=settings.ADMISSION_WINDOW,
+    defer_interval=settings.ADMISSION_DEFER_INTERVAL,
+    defer_timeout=settings.ADMISSION_DEFER_TIMEOUT,
+    priorities=_parse_priorities(settings.ADMISSION_PRIORITIES),
+    default_priority=settings.ADMISSION_DEFAULT_PRIORITY
+)
+
+registry.register_collector(
+    "slackbot_admission_load", "Load as a fraction of the admission limits.",
+    lambda: [({}, admission.load())]
+)
+registry.register_collector(
+    "slackbot_admission_mentions", "Mentions admitted and in flight.",
+    lambda: [({"state": "in_flight"}, admission.in_flight)]
+)
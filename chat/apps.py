@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .models import WorkspaceToken
+        from .workspace_cache import invalidate_workspace
+        from . import checks  # noqa: F401  (registers the system checks)
+
+        post_save.connect(invalidate_workspace, sender=WorkspaceToken, dispatch_uid='workspace_cache_save')
+        post_delete.connect(invalidate_workspace, sender=WorkspaceToken, dispatch_uid='workspace_cache_delete')
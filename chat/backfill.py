@@ -0,0 +1,113 @@
+import logging
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from .context import count_tokens
+from .models import Conversation, Message
+from .rate_limit import RateLimitTimeout
+from .write_buffer import message_writes
+
+logger = logging.getLogger(__name__)
+
+# A user mention in message text: "<@U123>" or "<@U123|name>".
+USER_MENTION = re.compile(r"<@([A-Z0-9]+)(?:\|[^>]*)?>")
+
+
+def mentioned_users(texts):
+    return {user_id for text in texts for user_id in USER_MENTION.findall(text)}
+
+
+async def backfill_thread(client, conversation, latest, bot_user_id, page_size=200, max_pages=5):
+    """
+    Stores thread replies the bot was not mentioned in, so they are part of the
+    conversation history. Only replies after the conversation's cursor (the ts
+    of the last reply seen) and up to `latest` are fetched, a page at a time,
+    and each page is inserted in one statement before the next is requested.
+
+    Replies that mention `bot_user_id` are never stored here, since they are
+    stored (and answered) by their own events, which may not have been handled
+    yet. Replies newer than `latest` are left for a later call, and bot
+    messages are skipped, since the bot's own replies are already stored.
+    After `max_pages` pages, or when the rate limiter turns a page away
+    (RateLimitTimeout), the cursor is saved where it stopped and the rest is
+    fetched on the next mention.
+
+    Returns the number of replies inserted. Replies already stored are left as
+    they are and not counted.
+    """
+    cursor = conversation.replies_cursor
+    # Page cursors belong to the original query, so `oldest` stays fixed while paging.
+    oldest = cursor or conversation.thread_ts
+    newest = Decimal(latest)
+    stored = 0
+    page_cursor = None
+    for _ in range(max_pages):
+        try:
+            response = await client.conversations_replies(
+                channel=conversation.channel_id,
+                ts=conversation.thread_ts,
+                oldest=oldest,
+                latest=latest,
+                inclusive=True,
+                limit=page_size,
+                cursor=page_cursor
+            )
+        except RateLimitTimeout:
+            logger.info(f"Rate limit reached, leaving the backfill of thread {conversation.thread_ts} for later")
+            break
+        messages = []
+        for reply in response.get("messages", []):
+            ts = reply.get("ts")
+            if not ts or (cursor and Decimal(ts) <= Decimal(cursor)) or Decimal(ts) > newest:
+                continue
+            cursor = ts
+            message = _to_message(conversation, reply, bot_user_id)
+            if message is not None:
+                messages.append(message)
+        if messages:
+            existing = {
+                message_id async for message_id in Message.objects.filter(
+                    message_id__in=[message.message_id for message in messages]
+                ).values_list("message_id", flat=True)
+            }
+            messages = [message for message in messages if message.message_id not in existing]
+            # A reply stored concurrently by its own event is still skipped by the unique index.
+            await Message.objects.abulk_create(messages, ignore_conflicts=True)
+            stored += len(messages)
+
+        page_cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not response.get("has_more") or not page_cursor:
+            break
+
+    if cursor and cursor != conversation.replies_cursor:
+        conversation.replies_cursor = cursor
+        await Conversation.objects.filter(pk=conversation.pk).aupdate(replies_cursor=cursor)
+    return stored
+
+
+def _to_message(conversation, reply, bot_user_id):
+    if reply.get("bot_id") or not reply.get("user") or not reply.get("text"):
+        return None
+    if bot_user_id in mentioned_users([reply["text"]]):
+        return None
+    message_id = f"slack_{reply['ts']}"
+    if message_writes.enabled and message_writes.contains(message_id):
+        return None
+    return Message(
+        conversation=conversation,
+        content=reply["text"],
+        user_id=reply["user"],
+        is_bot=False,
+        message_id=message_id,
+        # Nothing to answer: mentions of the bot were skipped above.
+        processed=True,
+        token_count=count_tokens(reply["text"]),
+        timestamp=_ts_to_datetime(reply["ts"])
+    )
+
+
+def _ts_to_datetime(ts):
+    # Slack timestamps are "<seconds>.<microseconds>"; a float would round the microseconds.
+    seconds, _, micros = ts.partition(".")
+    return datetime.fromtimestamp(int(seconds), tz=dt_timezone.utc) + timedelta(microseconds=int(micros[:6].ljust(6, "0")))
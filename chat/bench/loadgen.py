@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+import aiohttp
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers, or None when it is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize_latencies(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def sign_request(signing_secret, timestamp, body):
+    """
+    Computes the X-Slack-Signature header for a request body.
+    """
+    base = f"v0:{timestamp}:{body}".encode("utf-8")
+    digest = hmac.new(signing_secret.encode("utf-8"), base, hashlib.sha256).hexdigest()
+    return f"v0={digest}"
+
+
+def mention_envelope(team_id, channel_id, thread_ts, text, user_id="UBENCH", bot_user_id="UBOT"):
+    """
+    Builds an app_mention event_callback envelope the way Slack sends it.
+    """
+    ts = f"{time.time():.6f}"
+    return {
+        "type": "event_callback",
+        "team_id": team_id,
+        "event_id": f"Ev{uuid.uuid4().hex[:10].upper()}",
+        "event_time": int(time.time()),
+        "authorizations": [{"team_id": team_id, "user_id": bot_user_id, "is_bot": True}],
+        "event": {
+            "type": "app_mention",
+            "team": team_id,
+            "channel": channel_id,
+            "user": user_id,
+            "text": text,
+            "ts": ts,
+            "event_ts": ts,
+            "thread_ts": thread_ts or ts,
+        },
+    }
+
+
+class LoadGenerator:
+    """
+    Open-loop load generator that POSTs signed app_mention events at a target
+    rate and records the ack latency of every request.
+
+    `threads` controls how many distinct Slack threads the mentions are spread
+    over; 0 starts a new thread for every mention.
+    """
+
+    def __init__(self, url, team_id, signing_secret="", rate=10.0, duration=10.0,
+                 threads=0, channel_id="CBENCH", text="<@UBOT> hello"):
+        self.url = url
+        self.team_id = team_id
+        self.signing_secret = signing_secret
+        self.rate = rate
+        self.duration = duration
+        self.threads = threads
+        self.channel_id = channel_id
+        self.text = text
+        self.sent_at = {}
+        self.ack_latencies = []
+        self.statuses = {}
+
+    async def run(self):
+        """
+        Sends mentions until `duration` has elapsed and waits for all acks.
+        """
+        interval = 1.0 / self.rate
+        tasks = []
+        started = time.monotonic()
+        thread_roots = [f"{time.time():.6f}{i}" for i in range(self.threads)]
+
+        async with aiohttp.ClientSession() as session:
+            sent = 0
+            while True:
+                due = started + sent * interval
+                if due - started >= self.duration:
+                    break
+                now = time.monotonic()
+                if due > now:
+                    await asyncio.sleep(due - now)
+                thread_ts = thread_roots[sent % self.threads] if self.threads else None
+                tasks.append(asyncio.create_task(self._send(session, thread_ts)))
+                sent += 1
+            await asyncio.gather(*tasks)
+        return time.monotonic() - started
+
+    async def _send(self, session, thread_ts):
+        envelope = mention_envelope(self.team_id, self.channel_id, thread_ts, self.text)
+        event = envelope["event"]
+        body = json.dumps(envelope)
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            "X-Slack-Request-Timestamp": timestamp,
+            "X-Slack-Signature": sign_request(self.signing_secret, timestamp, body),
+        }
+
+        sent_at = time.monotonic()
+        # Replies are matched on the thread they are posted to.
+        self.sent_at.setdefault(event["thread_ts"], sent_at)
+        try:
+            async with session.post(self.url, data=body, headers=headers) as response:
+                await response.read()
+                status = response.status
+        except aiohttp.ClientError:
+            status = "connection_error"
+        self.ack_latencies.append(time.monotonic() - sent_at)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def build_report(generator, elapsed, replied_at, first_token_at, slack_stub=None, openai_stub=None):
+    """
+    Combines the load generator's acks with the replies seen by the Slack stub
+    into a throughput and latency report. Reply latency runs until the complete
+    reply is in the thread; time to first token until its first text (not the
+    streaming placeholder) is.
+    """
+    reply_latencies = _latencies(generator.sent_at, replied_at)
+    report = {
+        "elapsed": elapsed,
+        "requests": len(generator.ack_latencies),
+        "throughput": len(generator.ack_latencies) / elapsed if elapsed else 0.0,
+        "statuses": {str(status): count for status, count in generator.statuses.items()},
+        "ack_latency": summarize_latencies(generator.ack_latencies),
+        "first_token_latency": summarize_latencies(_latencies(generator.sent_at, first_token_at)),
+        "reply_latency": summarize_latencies(reply_latencies),
+        "threads_answered": len(reply_latencies),
+        "threads_sent": len(generator.sent_at),
+    }
+    if slack_stub:
+        report["slack_calls"] = dict(slack_stub.calls)
+        report["slack_injected_errors"] = slack_stub.errors
+    if openai_stub:
+        report["openai_calls"] = openai_stub.calls
+        report["openai_injected_errors"] = openai_stub.errors
+    return report
+
+
+def _latencies(sent_at, seen_at):
+    return [seen_at[thread_ts] - sent for thread_ts, sent in sent_at.items() if thread_ts in seen_at]
+
+
+def format_report(report):
+    """
+    Renders a benchmark report as human-readable lines.
+    """
+    lines = [
+        f"Requests: {report['requests']} in {report['elapsed']:.1f}s "
+        f"({report['throughput']:.1f} req/s), statuses {report['statuses']}",
+        f"Threads answered: {report['threads_answered']}/{report['threads_sent']}",
+    ]
+    for name in ('ack_latency', 'first_token_latency', 'reply_latency'):
+        stats = report[name]
+        if not stats['count']:
+            lines.append(f"{name}: no samples")
+            continue
+        lines.append(
+            f"{name}: p50={stats['p50'] * 1000:.1f}ms p95={stats['p95'] * 1000:.1f}ms "
+            f"p99={stats['p99'] * 1000:.1f}ms max={stats['max'] * 1000:.1f}ms"
+        )
+    lines.append(f"Stub calls: slack={report.get('slack_calls')} openai={report.get('openai_calls')}")
+    return lines
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import time
+import uuid
+from decimal import Decimal
+
+import aiohttp
+
+from .loadgen import sign_request
+
+MICROSECOND = Decimal("0.000001")
+
+
+def rebase_envelope(body, offset, run_id):
+    """
+    Parses a captured envelope and shifts its Slack timestamps by `offset`
+    seconds, so a trace can be replayed against a database that already holds
+    it. Event ids get a per-run suffix; retries of one event keep sharing theirs.
+    """
+    envelope = json.loads(body)
+    if envelope.get("event_id"):
+        envelope["event_id"] = f"{envelope['event_id']}-{run_id}"
+    event = envelope.get("event") or {}
+    # Slack timestamps have more digits than a float keeps.
+    shift = Decimal(str(offset))
+    for key in ("ts", "thread_ts", "event_ts"):
+        if key in event:
+            event[key] = str((Decimal(event[key]) + shift).quantize(MICROSECOND))
+    return envelope
+
+
+class TraceReplayer:
+    """
+    Replays captured event envelopes with their original spacing divided by
+    `speed` (0 sends them back to back). Envelopes are POSTed, re-signed and
+    with their retry headers, to `url`, or, without a url, mentions are passed
+    straight to `handler(event)` and retries are skipped.
+
+    Exposes the same `sent_at`, `ack_latencies` and `statuses` as the load
+    generator, so `build_report` works for both; in direct mode the ack latency
+    is the handler's run time.
+    """
+
+    def __init__(self, records, speed=1.0, url=None, signing_secret="", handler=None):
+        self.records = records
+        self.speed = speed
+        self.url = url
+        self.signing_secret = signing_secret
+        self.handler = handler
+        self.sent_at = {}
+        self.ack_latencies = []
+        self.statuses = {}
+
+    async def run(self):
+        """
+        Replays every record and waits for all deliveries; returns the elapsed time.
+        """
+        if not self.records:
+            return 0.0
+        first = self.records[0]["t"]
+        offset = Decimal(f"{time.time() - first:.6f}")
+        run_id = uuid.uuid4().hex[:6]
+        started = time.monotonic()
+        tasks = []
+
+        async with aiohttp.ClientSession() as session:
+            for record in self.records:
+                if self.speed:
+                    delay = started + (record["t"] - first) / self.speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                envelope = rebase_envelope(record["body"], offset, run_id)
+                tasks.append(asyncio.create_task(self._deliver(session, envelope, record.get("headers", {}))))
+            await asyncio.gather(*tasks)
+        return time.monotonic() - started
+
+    async def _deliver(self, session, envelope, headers):
+        event = envelope.get("event") or {}
+        retry = "X-Slack-Retry-Num" in headers
+        if event.get("type") == "app_mention" and not retry:
+            self.sent_at.setdefault(event.get("thread_ts", event.get("ts")), time.monotonic())
+
+        started = time.monotonic()
+        if self.url:
+            status = await self._post(session, envelope, headers)
+        elif event.get("type") == "app_mention" and not retry:
+            try:
+                await self.handler(event)
+                status = "handled"
+            except Exception:
+                status = "handler_error"
+        else:
+            return
+        self.ack_latencies.append(time.monotonic() - started)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    async def _post(self, session, envelope, headers):
+        body = json.dumps(envelope)
+        timestamp = str(int(time.time()))
+        request_headers = {
+            **headers,
+            "Content-Type": "application/json",
+            "X-Slack-Request-Timestamp": timestamp,
+            "X-Slack-Signature": sign_request(self.signing_secret, timestamp, body),
+        }
+        try:
+            async with session.post(self.url, data=body, headers=request_headers) as response:
+                await response.read()
+                return response.status
+        except aiohttp.ClientError:
+            return "connection_error"
+
+
+COMPARED_METRICS = (
+    ("throughput", ("throughput",)),
+    ("threads answered", ("threads_answered",)),
+    ("ack p50", ("ack_latency", "p50")),
+    ("ack p95", ("ack_latency", "p95")),
+    ("ack p99", ("ack_latency", "p99")),
+    ("first token p50", ("first_token_latency", "p50")),
+    ("first token p95", ("first_token_latency", "p95")),
+    ("reply p50", ("reply_latency", "p50")),
+    ("reply p95", ("reply_latency", "p95")),
+    ("reply p99", ("reply_latency", "p99")),
+)
+
+
+def compare_reports(baseline, report):
+    """
+    Returns (metric, baseline value, new value, relative change) rows for two
+    benchmark reports; the change is None when it cannot be computed.
+    """
+    rows = []
+    for name, path in COMPARED_METRICS:
+        before, after = baseline, report
+        for key in path:
+            before = (before or {}).get(key)
+            after = (after or {}).get(key)
+        change = (after - before) / before if before and after is not None else None
+        rows.append((name, before, after, change))
+    return rows
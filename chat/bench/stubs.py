@@ -0,0 +1,302 @@
+import asyncio
+import json
+import random
+import time
+from decimal import Decimal
+
+from aiohttp import web
+
+from chat.streaming import PLACEHOLDER
+
+
+class StubBehaviour:
+    """
+    Latency and error injection shared by the stub servers. Each call sleeps
+    `latency` seconds plus up to `jitter` more, and fails with a 429 or 500
+    with probability `error_rate`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+
+    async def delay(self):
+        seconds = self.latency + random.uniform(0, self.jitter)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def fault(self):
+        """
+        Returns the status code of an injected failure, or None.
+        """
+        if self.error_rate and random.random() < self.error_rate:
+            return random.choice((429, 500))
+        return None
+
+
+async def _read_payload(request):
+    if request.content_type == "application/json":
+        return await request.json()
+    return dict(await request.post())
+
+
+class SlackStub:
+    """
+    Emulates chat.postMessage, chat.update, conversations.replies, auth.test
+    and oauth.v2.access. Posted messages are kept per thread, edited by
+    chat.update, and served back, paginated, by conversations.replies.
+
+    For each thread it records when the first reply text other than the
+    streaming placeholder arrives (`first_token_at`) and when the complete
+    reply does (`replied_at`), by chat.postMessage or by the chat.update that
+    finishes a streamed message. A reply is complete once its text is
+    `reply_text`, the OpenAI stub's answer, or, when that is not given, as soon
+    as it has any text.
+    """
+
+    def __init__(self, behaviour, bot_user_id="UBOT", reply_text=None):
+        self.behaviour = behaviour
+        self.bot_user_id = bot_user_id
+        self.reply_text = reply_text
+        self.first_token_at = {}
+        self.replied_at = {}
+        self.threads = {}
+        self._messages = {}
+        self.calls = {"chat.postMessage": 0, "chat.update": 0, "conversations.replies": 0, "auth.test": 0,
+                      "oauth.v2.access": 0}
+        self.errors = 0
+        self._ts = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/api/chat.postMessage", self.post_message)
+        app.router.add_post("/api/chat.update", self.update)
+        app.router.add_get("/api/conversations.replies", self.replies)
+        app.router.add_post("/api/auth.test", self.auth_test)
+        app.router.add_post("/api/oauth.v2.access", self.oauth_access)
+        return app
+
+    async def post_message(self, request):
+        failure = await self._begin("chat.postMessage")
+        if failure:
+            return failure
+        payload = await _read_payload(request)
+        thread_ts = payload.get("thread_ts")
+        ts = self._next_ts()
+        if thread_ts:
+            message = {"type": "message", "ts": ts, "bot_id": "BBENCH", "text": payload.get("text", "")}
+            self.threads.setdefault((payload.get("channel"), thread_ts), []).append(message)
+            self._messages[(payload.get("channel"), ts)] = (thread_ts, message)
+            self._record(thread_ts, message["text"])
+        return web.json_response({"ok": True, "channel": payload.get("channel"), "ts": ts})
+
+    async def update(self, request):
+        failure = await self._begin("chat.update")
+        if failure:
+            return failure
+        payload = await _read_payload(request)
+        posted = self._messages.get((payload.get("channel"), payload.get("ts")))
+        if posted:
+            thread_ts, message = posted
+            message["text"] = payload.get("text", "")
+            self._record(thread_ts, message["text"])
+        return web.json_response({"ok": True, "channel": payload.get("channel"), "ts": payload.get("ts")})
+
+    async def replies(self, request):
+        failure = await self._begin("conversations.replies")
+        if failure:
+            return failure
+        query = request.query
+        # Slack timestamps have more digits than a float keeps.
+        oldest = Decimal(query.get("oldest") or 0)
+        latest = Decimal(query.get("latest") or "Infinity")
+        messages = [
+            message for message in self.threads.get((query.get("channel"), query.get("ts")), [])
+            if oldest <= Decimal(message["ts"]) <= latest
+        ]
+        start = int(query.get("cursor") or 0)
+        end = start + int(query.get("limit") or 1000)
+        has_more = end < len(messages)
+        return web.json_response({
+            "ok": True,
+            "messages": messages[start:end],
+            "has_more": has_more,
+            "response_metadata": {"next_cursor": str(end) if has_more else ""},
+        })
+
+    async def auth_test(self, request):
+        failure = await self._begin("auth.test")
+        if failure:
+            return failure
+        return web.json_response({"ok": True, "team_id": "TBENCH", "user_id": self.bot_user_id, "bot_id": "BBENCH"})
+
+    async def oauth_access(self, request):
+        failure = await self._begin("oauth.v2.access")
+        if failure:
+            return failure
+        return web.json_response({
+            "ok": True,
+            "access_token": "xoxb-bench",
+            "team": {"id": "TBENCH", "name": "Bench"},
+        })
+
+    async def _begin(self, method):
+        self.calls[method] += 1
+        await self.behaviour.delay()
+        status = self.behaviour.fault()
+        if status is None:
+            return None
+        self.errors += 1
+        if status == 429:
+            return web.json_response(
+                {"ok": False, "error": "ratelimited"},
+                status=429,
+                headers={"Retry-After": str(self.behaviour.retry_after)}
+            )
+        return web.json_response({"ok": False, "error": "internal_error"}, status=500)
+
+    def _record(self, thread_ts, text):
+        if not text or text == PLACEHOLDER:
+            return
+        now = time.monotonic()
+        self.first_token_at.setdefault(thread_ts, now)
+        if self.reply_text is None or text.strip() == self.reply_text:
+            self.replied_at.setdefault(thread_ts, now)
+
+    def _next_ts(self):
+        self._ts += 1
+        return f"{int(time.time())}.{self._ts:06d}"
+
+
+class OpenAIStub:
+    """
+    Emulates the chat completions endpoint, streaming and non-streaming. The
+    reply is `reply_tokens` words; streamed words are spaced `token_interval`
+    seconds apart.
+    """
+
+    def __init__(self, behaviour, reply_tokens=50, token_interval=0.0):
+        self.behaviour = behaviour
+        self.reply_tokens = reply_tokens
+        self.token_interval = token_interval
+        self.calls = 0
+        self.errors = 0
+
+    @property
+    def reply_text(self):
+        return " ".join(self._words())
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.completions)
+        return app
+
+    async def completions(self, request):
+        self.calls += 1
+        payload = await request.json()
+        await self.behaviour.delay()
+
+        status = self.behaviour.fault()
+        if status:
+            self.errors += 1
+            headers = {"Retry-After": str(self.behaviour.retry_after)} if status == 429 else {}
+            return web.json_response(
+                {"error": {"message": "injected failure", "type": "server_error", "code": None}},
+                status=status,
+                headers=headers
+            )
+
+        words = self._words()
+        prompt_tokens = sum(len(str(message.get("content", ""))) // 4 + 1 for message in payload["messages"])
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": payload["model"]}
+
+        if not payload.get("stream"):
+            return web.json_response({
+                **base,
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words),
+                },
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for index, word in enumerate(words):
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": word if index == 0 else f" {word}"}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+        done = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        await response.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    def _words(self):
+        return [f"token{i}" for i in range(self.reply_tokens)]
+
+
+async def start_stub(app, host, port):
+    """
+    Starts an aiohttp app on host:port and returns its runner for cleanup.
+    """
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def add_stub_arguments(parser):
+    """
+    Adds the stub server options shared by the benchmark commands.
+    """
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--slack-port', type=int, default=9001)
+    parser.add_argument('--openai-port', type=int, default=9002)
+    parser.add_argument('--slack-latency', type=float, default=0.05)
+    parser.add_argument('--openai-latency', type=float, default=0.5)
+    parser.add_argument('--jitter', type=float, default=0.1, help='Extra random latency added to every stub call')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of stub calls that fail with 429/500')
+    parser.add_argument('--reply-tokens', type=int, default=50)
+    parser.add_argument('--token-interval', type=float, default=0.01, help='Delay between streamed tokens')
+
+
+async def start_stubs(options):
+    """
+    Starts the Slack and OpenAI stubs from parsed command options. Returns
+    (slack_stub, openai_stub, runners).
+    """
+    openai_stub = OpenAIStub(
+        StubBehaviour(
+            latency=options['openai_latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate']
+        ),
+        reply_tokens=options['reply_tokens'],
+        token_interval=options['token_interval']
+    )
+    slack_stub = SlackStub(
+        StubBehaviour(
+            latency=options['slack_latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate']
+        ),
+        reply_text=openai_stub.reply_text or None
+    )
+    runners = [
+        await start_stub(slack_stub.app(), options['host'], options['slack_port']),
+        await start_stub(openai_stub.app(), options['host'], options['openai_port']),
+    ]
+    return slack_stub, openai_stub, runners
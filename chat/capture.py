@@ -0,0 +1,92 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Request headers kept with each captured envelope, so replays reproduce retries.
+CAPTURED_HEADERS = ("X-Slack-Retry-Num", "X-Slack-Retry-Reason")
+
+
+class TraceWriter:
+    """
+    Appends raw Slack event envelopes with their arrival time to gzip-compressed
+    JSONL files in `directory`. A file is rotated once `max_bytes` of
+    uncompressed records were written to it, and only the newest `max_files`
+    files are kept. Each process writes its own files.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_files=10):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.records = 0
+        self._file = None
+        self._written = 0
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, request):
+        record = {
+            "t": time.time(),
+            "headers": {name: request.headers[name] for name in CAPTURED_HEADERS if name in request.headers},
+            "body": request.body.decode("utf-8"),
+        }
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self._lock:
+            if self._file is None or self._written >= self.max_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._written += len(line)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"events-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{time.monotonic_ns() % 10**6}.jsonl.gz"
+        self._file = gzip.open(self.directory / name, "ab")
+        self._written = 0
+        for stale in sorted(self.directory.glob("events-*.jsonl.gz"), key=os.path.getmtime)[:-self.max_files]:
+            stale.unlink(missing_ok=True)
+
+
+def read_trace(paths):
+    """
+    Yields the records of one or more trace files (or directories of them) in
+    arrival order.
+    """
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("events-*.jsonl.gz")) if path.is_dir() else [path])
+    records = []
+    for path in files:
+        with gzip.open(path, "rt", encoding="utf-8") as handle:
+            try:
+                for line in handle:
+                    records.append(json.loads(line))
+            except (EOFError, json.JSONDecodeError):
+                # Files of a process that did not shut down cleanly end mid-record.
+                logger.warning(f"{path} is truncated, using the records before the cut")
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+trace_writer = TraceWriter(
+    settings.SLACK_CAPTURE_DIR,
+    max_bytes=settings.SLACK_CAPTURE_MAX_BYTES,
+    max_files=settings.SLACK_CAPTURE_MAX_FILES
+) if settings.SLACK_CAPTURE_DIR else None
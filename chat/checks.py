@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.checks import Error, Info, Warning, register
+from django.db import connection
+
+from .admission import priority_errors
+
+
+def describe_database():
+    """
+    Describes the active database profile and its effective connection settings.
+    """
+    options = settings.DATABASES['default']
+    if settings.DATABASE_PROFILE == 'postgres':
+        pool = options.get('OPTIONS', {}).get('pool')
+        if pool:
+            return f"postgres at {options['HOST']} (pool {pool['min_size']}-{pool['max_size']} connections)"
+        return f"postgres at {options['HOST']} (persistent connections, CONN_MAX_AGE={options['CONN_MAX_AGE']})"
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+        cursor.execute('PRAGMA synchronous')
+        synchronous = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}.get(cursor.fetchone()[0])
+        cursor.execute('PRAGMA mmap_size')
+        # In-memory databases, and builds without mmap support, return no row.
+        row = cursor.fetchone()
+        mmap_size = row[0] if row else 'off'
+    return f"sqlite (journal_mode={journal_mode}, synchronous={synchronous}, mmap_size={mmap_size})"
+
+
+@register('database_profile', deploy=True)
+def check_database_profile(app_configs, **kwargs):
+    """
+    Reports which database profile is active.
+    """
+    try:
+        description = describe_database()
+    except Exception as e:
+        return [Warning(f"Could not inspect the {settings.DATABASE_PROFILE} database: {e}", id='chat.W001')]
+
+    messages = [Info(f"Database profile: {description}", id='chat.I001')]
+    if settings.DATABASE_PROFILE == 'sqlite' and not settings.DEBUG:
+        messages.append(Warning(
+            "SQLite allows a single writer at a time.",
+            hint="Set DATABASE_URL to a Postgres database for multi-worker deployments.",
+            id='chat.W002'
+        ))
+    return messages
+
+
+@register('database_pool')
+def check_database_pool(app_configs, **kwargs):
+    """
+    Django's connection pool needs psycopg 3 with psycopg_pool; without them
+    every query would fail once the server is up.
+    """
+    if not settings.DATABASES['default'].get('OPTIONS', {}).get('pool'):
+        return []
+    try:
+        import psycopg  # noqa: F401
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        return [Error(
+            "DB_POOL_MAX_SIZE is set but psycopg 3 with its pool package is not installed.",
+            hint="Install psycopg[binary,pool] or unset DB_POOL_MAX_SIZE.",
+            id='chat.E002'
+        )]
+    return []
+
+
+@register('admission')
+def check_admission_priorities(app_configs, **kwargs):
+    """
+    Rejects admission priorities that do not exist; at runtime they fall back
+    to normal priority or are ignored.
+    """
+    return [
+        Error(message, hint="Use high, normal or low.", id='chat.E001')
+        for message in priority_errors(settings.ADMISSION_DEFAULT_PRIORITY, settings.ADMISSION_PRIORITIES)
+    ]
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def thread_key(event):
+    return (event.get("channel"), event.get("thread_ts", event.get("ts")))
+
+
+class ThreadCoalescer:
+    """
+    Batches bursts of mentions in the same thread. The first mention of a
+    thread opens a batch; mentions that arrive during the debounce window or
+    while that batch's completion is in flight are held as pending and then
+    answered together by one follow-up completion.
+    """
+
+    def __init__(self, window=0.0):
+        self.window = window
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def add(self, event):
+        """
+        Adds a mention to its thread's batch. Returns True when the caller opened
+        the batch and must run it; False when a running batch will pick it up.
+        """
+        key = thread_key(event)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending.append(event)
+                self.coalesced += 1
+                return False
+            self._pending[key] = [event]
+            return True
+
+    def abandon(self, key):
+        """
+        Drops a batch that could not be scheduled.
+        """
+        with self._lock:
+            self._pending.pop(key, None)
+
+    async def run(self, key, handler):
+        """
+        Answers the thread's pending mentions with `handler(events)` until no new
+        ones arrived during the last completion, then closes the batch and
+        returns the last outcome. A "deferred" batch is put back and stays open,
+        so mentions arriving meanwhile join it; the caller schedules the next run.
+        """
+        while True:
+            with self._lock:
+                batch = self._pending[key]
+                self._pending[key] = []
+                self.batches += 1
+            try:
+                outcome = await handler(batch)
+            except Exception as e:
+                logger.error(f"Error handling coalesced mentions: {str(e)}")
+                outcome = "error"
+            with self._lock:
+                if outcome == "deferred":
+                    self._pending[key] = batch + self._pending[key]
+                    return outcome
+                if not self._pending[key]:
+                    del self._pending[key]
+                    return outcome
+
+    async def submit(self, event, handler):
+        """
+        Inline entry point: opens or joins the thread's batch and, for the mention
+        that opened it, waits out the debounce window, runs it and returns the
+        outcome. Returns None for a mention that joined another batch.
+        """
+        if not self.add(event):
+            return None
+        await asyncio.sleep(self.window)
+        return await self.run(thread_key(event), handler)
+
+
+coalescer = ThreadCoalescer(window=settings.MENTION_COALESCE_WINDOW)
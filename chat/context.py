@@ -0,0 +1,108 @@
+import logging
+
+from django.conf import settings
+
+from .llm import llm_backend
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Counts the tokens of a piece of text. Uses tiktoken when it is installed and
+    falls back to the usual ~4 characters per token estimate otherwise.
+    """
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.encoding_for_model(settings.OPENAI_MODEL)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def message_tokens(message):
+    """
+    Returns the stored token count of a message, counting it for older rows
+    that were saved before token counts existed.
+    """
+    if message.token_count is None:
+        message.token_count = count_tokens(message.content)
+    return message.token_count
+
+
+def pack_history(history, budget):
+    """
+    Splits chronological history into (older, recent), where recent is the
+    newest run of messages that fits in the token budget. The newest message
+    is always kept, even if it alone exceeds the budget.
+    """
+    used = 0
+    start = len(history)
+    for index in range(len(history) - 1, -1, -1):
+        used += message_tokens(history[index])
+        if used > budget and index < len(history) - 1:
+            break
+        start = index
+    return history[:start], history[start:]
+
+
+def build_messages(system_prompt, summary, recent, related=()):
+    """
+    Formats the system prompt, related messages from other threads, the rolling
+    thread summary and the recent messages for the chat completions API.
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    if related:
+        excerpts = "\n".join(
+            f"- {'Assistant' if message.is_bot else 'User'}: {message.content}" for message in related
+        )
+        messages.append({
+            "role": "system",
+            "content": f"Possibly relevant messages from earlier threads in this channel:\n{excerpts}"
+        })
+    if summary:
+        messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation in this thread: {summary}"
+        })
+    for message in recent:
+        messages.append({
+            "role": "assistant" if message.is_bot else "user",
+            "content": message.content
+        })
+    return messages
+
+
+async def summarize(previous_summary, messages):
+    """
+    Folds messages into the previous summary of a thread and returns the new
+    summary, or None if the LLM call fails.
+    """
+    transcript = "\n".join(
+        f"{'Assistant' if message.is_bot else 'User'}: {message.content}" for message in messages
+    )
+    prompt = [
+        {"role": "system", "content": """You maintain a running summary of a Slack thread between
+            users and an assistant. Update the summary with the new messages. Keep names, decisions,
+            facts and open questions, and answer with the summary only."""},
+        {"role": "user", "content": f"Current summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"}
+    ]
+    try:
+        return await llm_backend.complete(
+            prompt,
+            temperature=0.2,
+            max_tokens=settings.CONTEXT_SUMMARY_MAX_TOKENS
+        )
+    except Exception as e:
+        logger.error(f"Failed to update conversation summary: {str(e)}")
+        return None
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class SeenSet:
+    """
+    Bounded set of recently seen keys with time-based expiry, used to drop
+    Slack retries and duplicate deliveries before they reach the database.
+    """
+
+    def __init__(self, ttl=600, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def add(self, key):
+        """
+        Records a key. Returns False if it was already seen and has not expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._keys:
+                self.duplicates += 1
+                return False
+            self._keys[key] = now + self.ttl
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+            return True
+
+    def record_duplicate(self):
+        """
+        Counts a duplicate that was detected without a key, such as a Slack retry.
+        """
+        with self._lock:
+            self.duplicates += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _expire(self, now):
+        # Keys are inserted in expiry order, so expired ones sit at the front.
+        while self._keys:
+            key, expires_at = next(iter(self._keys.items()))
+            if expires_at > now:
+                break
+            del self._keys[key]
+
+
+seen_events = SeenSet(ttl=settings.SLACK_DEDUP_TTL, max_size=settings.SLACK_DEDUP_SIZE)
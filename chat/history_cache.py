@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+# Rough per-message overhead of a cached Message instance, on top of its text.
+MESSAGE_OVERHEAD_BYTES = 400
+
+
+class _Thread:
+    __slots__ = ("messages", "size", "expires_at", "version")
+
+    def __init__(self, messages, max_messages, expires_at, version):
+        self.messages = deque(messages, maxlen=max_messages)
+        self.size = sum(_message_size(message) for message in self.messages)
+        self.expires_at = expires_at
+        self.version = version
+
+
+def _message_size(message):
+    return len(message.content.encode("utf-8")) + MESSAGE_OVERHEAD_BYTES
+
+
+class ThreadHistoryCache:
+    """
+    Bounded in-memory cache of the most recent messages of each thread, keyed by
+    (channel_id, thread_ts).
+
+    Threads are evicted least-recently-used first once the estimated size of all
+    cached messages exceeds `max_bytes`, and expire after `ttl` seconds.
+
+    Each entry carries the version of the thread it was loaded from: the
+    (message count, newest message pk) pair read from the database. A reader
+    passes the current version to `get`, so a thread written by another worker
+    process (or pruned) is reloaded instead of served stale.
+    """
+
+    def __init__(self, max_messages=50, max_bytes=8 * 1024 * 1024, ttl=120):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._threads = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.max_messages > 0
+
+    def get(self, key, limit, version=None):
+        """
+        Returns up to `limit` most recent messages in chronological order, or
+        None when the thread is not cached or was cached at another `version`.
+        """
+        with self._lock:
+            thread = self._threads.get(key)
+            if thread is not None and version is not None and thread.version != version:
+                self._remove(key)
+                self.stale += 1
+                thread = None
+            if thread is None or thread.expires_at <= time.monotonic():
+                if thread is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._threads.move_to_end(key)
+            self.hits += 1
+            return list(thread.messages)[-limit:] if limit else []
+
+    def put(self, key, messages, version=None):
+        """
+        Caches a thread's recent messages, given in chronological order.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remove(key)
+            thread = _Thread(messages, self.max_messages, time.monotonic() + self.ttl, version)
+            self._threads[key] = thread
+            self._bytes += thread.size
+            self._evict()
+
+    def append(self, key, message):
+        """
+        Writes a newly stored message through to a cached thread. Threads that are
+        not cached are left alone, since their older history is unknown. A
+        message that is already in the database moves the thread's version on;
+        one still waiting in the write-behind buffer does not, so the thread is
+        reloaded once the buffer is flushed.
+        """
+        with self._lock:
+            thread = self._threads.get(key)
+            if thread is None:
+                return
+            if thread.version is not None and message.pk is not None:
+                count, newest = thread.version
+                thread.version = (count + 1, max(newest or 0, message.pk))
+            if len(thread.messages) == thread.messages.maxlen:
+                dropped = thread.messages[0]
+                thread.size -= _message_size(dropped)
+                self._bytes -= _message_size(dropped)
+            thread.messages.append(message)
+            size = _message_size(message)
+            thread.size += size
+            self._bytes += size
+            self._threads.move_to_end(key)
+            self._evict()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._threads.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threads": len(self._threads),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        thread = self._threads.pop(key, None)
+        if thread is not None:
+            self._bytes -= thread.size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._threads:
+            _, thread = self._threads.popitem(last=False)
+            self._bytes -= thread.size
+            self.evictions += 1
+
+
+history_cache = ThreadHistoryCache(
+    max_messages=settings.HISTORY_CACHE_MESSAGES,
+    max_bytes=settings.HISTORY_CACHE_BYTES,
+    ttl=settings.HISTORY_CACHE_TTL
+)
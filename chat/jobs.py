@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .coalesce import thread_key
+from .models import MentionJob
+
+logger = logging.getLogger(__name__)
+
+
+async def enqueue_mention(event, delay=0):
+    """
+    Stores a mention as a job for any `process_mentions` worker to pick up,
+    optionally only after `delay` seconds.
+    """
+    channel_id, thread_ts = thread_key(event)
+    await MentionJob.objects.acreate(
+        team_id=event["team"],
+        channel_id=channel_id,
+        thread_ts=thread_ts,
+        event=event,
+        available_at=timezone.now() + timedelta(seconds=delay)
+    )
+
+
+def claim_jobs(owner, limit, lease=None, max_attempts=None):
+    """
+    Leases up to `limit` due jobs to `owner`. Jobs whose lease expired are
+    claimable again, so work of a dead worker is retried; jobs that already
+    used up `max_attempts` are marked failed instead. Threads with a live lease
+    are skipped, which keeps each thread on one worker at a time.
+
+    Two workers can pick different jobs of the same idle thread at once. On
+    PostgreSQL each claimed thread is therefore locked for the transaction and
+    checked for a lease again; other backends serialize writes anyway.
+    """
+    lease = settings.MENTION_JOB_LEASE if lease is None else lease
+    max_attempts = settings.MENTION_JOB_MAX_ATTEMPTS if max_attempts is None else max_attempts
+    now = timezone.now()
+
+    busy_thread = MentionJob.objects.filter(
+        channel_id=OuterRef('channel_id'),
+        thread_ts=OuterRef('thread_ts'),
+        failed=False,
+        leased_until__gt=now
+    )
+    due = MentionJob.objects.filter(failed=False, available_at__lte=now).filter(
+        Q(leased_until__isnull=True) | Q(leased_until__lte=now)
+    ).exclude(Exists(busy_thread)).order_by('available_at', 'id')
+
+    lease_fields = {'leased_until': now + timedelta(seconds=lease), 'lease_owner': owner}
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = list(due.select_for_update(skip_locked=True)[:limit])
+            exhausted = [job for job in jobs if job.attempts >= max_attempts]
+            claimed = [job for job in jobs if job.attempts < max_attempts]
+            if connection.vendor == 'postgresql':
+                claimed = _lock_threads(claimed, now)
+            MentionJob.objects.filter(pk__in=[job.pk for job in claimed]).update(
+                attempts=F('attempts') + 1, **lease_fields
+            )
+        else:
+            # Without SKIP LOCKED (SQLite) each row is taken with a compare-and-set
+            # on its previous lease, so concurrent workers never claim the same job.
+            exhausted, claimed = [], []
+            for job in due[:limit]:
+                if job.attempts >= max_attempts:
+                    exhausted.append(job)
+                elif MentionJob.objects.filter(pk=job.pk, leased_until=job.leased_until).update(
+                    attempts=F('attempts') + 1, **lease_fields
+                ):
+                    claimed.append(job)
+        if exhausted:
+            MentionJob.objects.filter(pk__in=[job.pk for job in exhausted]).update(failed=True)
+
+    for job in exhausted:
+        logger.error(f"Mention job {job.pk} failed after {job.attempts} attempts, giving up")
+    return claimed
+
+
+def _lock_threads(jobs, now):
+    """
+    Takes a transaction-scoped advisory lock per thread and keeps the jobs of
+    the threads that are locked and still have no live lease. A thread whose
+    lock is held is being claimed by another worker right now.
+    """
+    threads = {}
+    for job in jobs:
+        threads.setdefault((job.channel_id, job.thread_ts), []).append(job)
+
+    claimable = []
+    with connection.cursor() as cursor:
+        for (channel_id, thread_ts), thread_jobs in threads.items():
+            cursor.execute(
+                "SELECT pg_try_advisory_xact_lock(hashtext(%s))",
+                [f"mention_job:{channel_id}:{thread_ts}"]
+            )
+            if not cursor.fetchone()[0]:
+                continue
+            if MentionJob.objects.filter(
+                channel_id=channel_id, thread_ts=thread_ts, failed=False, leased_until__gt=now
+            ).exists():
+                continue
+            claimable.extend(thread_jobs)
+    return claimable
+
+
+def complete_jobs(job_ids):
+    MentionJob.objects.filter(pk__in=job_ids).delete()
+
+
+def defer_jobs(jobs, delay):
+    """
+    Puts jobs back in the queue for another try in `delay` seconds without
+    counting the attempt, keeping whatever the handler recorded in their events.
+    """
+    available_at = timezone.now() + timedelta(seconds=delay)
+    with transaction.atomic():
+        for job in jobs:
+            MentionJob.objects.filter(pk=job.pk).update(
+                event=job.event, available_at=available_at, leased_until=None, lease_owner='',
+                attempts=F('attempts') - 1
+            )
+
+
+def retry_jobs(job_ids, delay):
+    """
+    Releases the lease on failed jobs so they are retried after `delay` seconds
+    instead of when the lease runs out.
+    """
+    MentionJob.objects.filter(pk__in=job_ids).update(
+        leased_until=None, lease_owner='', available_at=timezone.now() + timedelta(seconds=delay)
+    )
+
+
+class MentionJobWorker:
+    """
+    Processes mention jobs from the database with up to `concurrency` threads
+    in flight. Jobs of the same thread that are claimed together are answered
+    with one `handler(events, last_attempt)` call, which returns the outcome.
+    The jobs are deleted once the handler is done with them; an "error"
+    outcome or an exception retries them after `retry_delay` seconds, until
+    they run out of attempts and are marked failed. "deferred" jobs (turned
+    away by admission control) are tried again after `defer_delay` seconds.
+    """
+
+    def __init__(self, handler, concurrency=4, poll_interval=1.0, retry_delay=None, max_attempts=None,
+                 defer_delay=None):
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.retry_delay = settings.MENTION_JOB_RETRY_DELAY if retry_delay is None else retry_delay
+        self.defer_delay = settings.ADMISSION_DEFER_INTERVAL if defer_delay is None else defer_delay
+        self.max_attempts = settings.MENTION_JOB_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.processed = 0
+        self._stopping = None
+
+    async def run(self):
+        """
+        Claims and processes jobs until `stop()` is called, then waits for the
+        jobs in flight.
+        """
+        self._stopping = asyncio.Event()
+        tasks = set()
+        while not self._stopping.is_set():
+            free = self.concurrency - len(tasks)
+            jobs = []
+            if free > 0:
+                try:
+                    jobs = await sync_to_async(claim_jobs)(self.owner, free)
+                except Exception as e:
+                    logger.error(f"Error claiming mention jobs: {str(e)}")
+
+            batches = {}
+            for job in jobs:
+                batches.setdefault((job.channel_id, job.thread_ts), []).append(job)
+            for batch in batches.values():
+                task = asyncio.create_task(self._process(batch))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if free <= 0:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            elif not jobs:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def _process(self, jobs):
+        job_ids = [job.pk for job in jobs]
+        # `attempts` was read before the claim counted this attempt.
+        last_attempt = all(job.attempts + 1 >= self.max_attempts for job in jobs)
+        try:
+            outcome = await self.handler([job.event for job in jobs], last_attempt)
+        except Exception as e:
+            logger.error(f"Error processing mention jobs {job_ids}: {str(e)}")
+            outcome = "error"
+
+        if outcome == "deferred":
+            try:
+                await sync_to_async(defer_jobs)(jobs, self.defer_delay)
+            except Exception as e:
+                logger.error(f"Error deferring mention jobs {job_ids}: {str(e)}")
+            return
+        if outcome == "error":
+            logger.warning(f"Mention jobs {job_ids} failed, retrying in {self.retry_delay}s")
+            try:
+                await sync_to_async(retry_jobs)(job_ids, self.retry_delay)
+            except Exception as e:
+                # The lease runs out and another attempt picks the jobs up.
+                logger.error(f"Error releasing mention jobs {job_ids}: {str(e)}")
+            return
+        await sync_to_async(complete_jobs)(job_ids)
+        self.processed += len(jobs)
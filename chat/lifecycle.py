@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.urls import get_resolver
+
+from .checks import describe_database
+from .llm import llm_backend
+from .routing import llm_router
+from .models import WorkspaceToken
+from .workspace_cache import workspace_clients
+from .write_buffer import message_writes
+
+logger = logging.getLogger(__name__)
+
+# The ASGI server's event loop, set by the lifespan startup hook. Clients cached
+# for it live until shutdown; any other loop that serves a request (one per
+# request under WSGI) has its clients closed when the request ends.
+_server_loop = None
+
+
+async def close_loop_clients():
+    """
+    Closes the shared Slack and OpenAI clients of the running event loop.
+    """
+    await workspace_clients.aclose()
+    await llm_router.aclose()
+
+
+async def close_request_clients():
+    """
+    Closes the clients a request created, unless it runs on the ASGI server's
+    long-lived loop where they are reused.
+    """
+    if asyncio.get_running_loop() is not _server_loop:
+        await close_loop_clients()
+
+
+async def startup():
+    """
+    Warms the process before it takes traffic: imports the URLconf (and with it
+    the Slack bot), starts the mention worker pool in queue mode, creates the
+    LLM client and preloads workspace tokens into the cache. With LAZY_STARTUP
+    the client and the tokens are left to the first mention instead.
+    """
+    global _server_loop
+    _server_loop = asyncio.get_running_loop()
+    get_resolver().url_patterns
+    logger.info(f"Database profile: {await sync_to_async(describe_database)()}")
+    from .slack_bot import mention_pool
+
+    if settings.SLACK_EVENT_MODE == "queue":
+        mention_pool.start()
+
+    if settings.LAZY_STARTUP:
+        logger.info("Startup complete, clients are created on first use")
+        return
+
+    llm_backend.client()
+
+    loaded = 0
+    async for team_id, bot_token in WorkspaceToken.objects.order_by('-installed_at').values_list(
+        'team_id', 'bot_token'
+    )[:workspace_clients.max_size]:
+        workspace_clients.put(team_id, bot_token)
+        loaded += 1
+    logger.info(f"Startup complete, {loaded} workspace tokens preloaded")
+
+
+def stop_background_work():
+    """
+    Drains the mention worker pool (which closes its own loop's clients) and
+    flushes buffered message writes. Runs from the ASGI shutdown hook and, for
+    WSGI workers that have no lifespan, from gunicorn's worker_exit hook.
+    """
+    from .slack_bot import mention_pool
+
+    mention_pool.stop()
+    message_writes.stop()
+
+
+async def shutdown():
+    """
+    Stops the background work and closes the shared HTTP clients.
+    """
+    await asyncio.to_thread(stop_background_work)
+    await close_loop_clients()
+    logger.info("Shutdown complete")
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+
+from .metrics import record_usage
+
+logger = logging.getLogger(__name__)
+
+
+class LLMBackend:
+    """
+    Async chat-completions backend built on AsyncOpenAI.
+
+    Each event loop gets one client with a shared, bounded httpx connection pool,
+    so many in-flight completions run concurrently on the loop instead of each
+    holding an executor thread. The owner of a loop must call `aclose` on it
+    before the loop closes. Timeouts and retries (exponential backoff that
+    honours Retry-After) are handled by the OpenAI client itself. The openai
+    package is only imported when the first client is created, which keeps it
+    out of worker start-up.
+    """
+
+    def __init__(self, api_key, base_url=None, model="gpt-3.5-turbo", timeout=30.0,
+                 connect_timeout=5.0, max_retries=2, max_connections=200,
+                 max_keepalive_connections=50):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self):
+        """
+        Returns the AsyncOpenAI client bound to the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for stale in [l for l in self._clients if l.is_closed()]:
+                del self._clients[stale]
+                logger.warning("Dropping an OpenAI client whose event loop closed before the client")
+            client = self._clients.get(loop)
+            if client is None:
+                client = self._clients[loop] = self._create_client()
+            return client
+
+    def _create_client(self):
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        timeout = httpx.Timeout(self.timeout, connect=self.connect_timeout)
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections
+        )
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            timeout=timeout,
+            max_retries=self.max_retries,
+            http_client=DefaultAsyncHttpxClient(limits=limits, timeout=timeout)
+        )
+
+    async def complete(self, messages, model=None, temperature=0.7, max_tokens=500):
+        """
+        Runs a chat completion and returns the reply text.
+        """
+        response = await self.client().chat.completions.create(
+            model=model or self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        record_usage(response.model, response.usage)
+        return response.choices[0].message.content
+
+    async def stream(self, messages, model=None, temperature=0.7, max_tokens=500):
+        """
+        Runs a streaming chat completion and yields the reply text as it arrives.
+        """
+        stream = await self.client().chat.completions.create(
+            model=model or self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async with stream:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    record_usage(chunk.model, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def aclose(self):
+        """
+        Closes the client and connection pool of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.close()
+
+
+llm_backend = LLMBackend(
+    api_key=settings.OPENAI_API_KEY,
+    base_url=settings.OPENAI_BASE_URL,
+    model=settings.OPENAI_MODEL,
+    timeout=settings.OPENAI_TIMEOUT,
+    connect_timeout=settings.OPENAI_CONNECT_TIMEOUT,
+    max_retries=settings.OPENAI_MAX_RETRIES,
+    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS
+)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.bench.loadgen import LoadGenerator, build_report, format_report
+from chat.bench.stubs import add_stub_arguments, start_stubs
+from chat.models import WorkspaceToken
+
+class Command(BaseCommand):
+    help = (
+        'Runs local Slack and OpenAI stand-ins and drives signed app_mention events '
+        'at /slack/events, reporting throughput and ack/reply latency. Start the app '
+        'with SLACK_API_URL=http://<host>:<slack-port>/api/ and '
+        'OPENAI_BASE_URL=http://<host>:<openai-port>/v1 so it talks to the stubs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/slack/events')
+        parser.add_argument('--rate', type=float, default=10.0, help='Mentions per second')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to send load for')
+        parser.add_argument('--drain', type=float, default=10.0, help='Seconds to wait for replies after the load stops')
+        parser.add_argument('--threads', type=int, default=0, help='Spread mentions over this many threads (0: one thread each)')
+        parser.add_argument('--team-id', default='TBENCH')
+        add_stub_arguments(parser)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        WorkspaceToken.objects.update_or_create(
+            team_id=options['team_id'],
+            defaults={'bot_token': 'xoxb-bench'}
+        )
+        report = asyncio.run(self._run(options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        for line in format_report(report):
+            self.stdout.write(line)
+
+    async def _run(self, options):
+        slack_stub, openai_stub, runners = await start_stubs(options)
+
+        generator = LoadGenerator(
+            url=options['url'],
+            team_id=options['team_id'],
+            signing_secret=settings.SLACK_SIGNING_SECRET or '',
+            rate=options['rate'],
+            duration=options['duration'],
+            threads=options['threads']
+        )
+        try:
+            elapsed = await generator.run()
+            await self._wait_for_replies(generator, slack_stub, options['drain'])
+        finally:
+            for runner in runners:
+                await runner.cleanup()
+
+        return build_report(
+            generator, elapsed, slack_stub.replied_at, slack_stub.first_token_at, slack_stub, openai_stub
+        )
+
+    async def _wait_for_replies(self, generator, slack_stub, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            if all(thread_ts in slack_stub.replied_at for thread_ts in generator.sent_at):
+                return
+            await asyncio.sleep(0.1)
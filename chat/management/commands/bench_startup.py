@@ -0,0 +1,67 @@
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter: loads the ASGI application (settings, app registry,
+# middleware) and the URLconf, which pulls in the views and the Slack bot.
+COLD_START = (
+    "from slackbot.asgi import application\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns\n"
+)
+
+# "import time: <self us> | <cumulative us> | <nested module name>"
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)")
+
+class Command(BaseCommand):
+    help = (
+        'Measures worker cold start: starts fresh interpreters that load the ASGI '
+        'application and the URLconf, reports median and p95 wall time, and fails '
+        'when the median exceeds the budget. --imports breaks import time down by package.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=10)
+        parser.add_argument('--budget', type=float, default=settings.STARTUP_BUDGET, help='Seconds')
+        parser.add_argument('--imports', type=int, default=0, help='Show the N packages that take longest to import')
+
+    def handle(self, *args, **options):
+        timings = [self._cold_start() for _ in range(options['runs'])]
+        timings.sort()
+        median = statistics.median(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f"Cold start over {len(timings)} runs: median {median:.3f}s, p95 {p95:.3f}s, "
+            f"budget {options['budget']:.3f}s"
+        )
+
+        if options['imports']:
+            self.stdout.write('Import time by package:')
+            for name, seconds in self._slowest_imports(options['imports']):
+                self.stdout.write(f"  {seconds:.3f}s  {name}")
+
+        if median > options['budget']:
+            raise CommandError(f"Median cold start {median:.3f}s is over the {options['budget']:.3f}s budget")
+
+    def _cold_start(self):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', COLD_START], capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if result.returncode:
+            raise CommandError(f"Cold start failed:\n{result.stderr}")
+        return elapsed
+
+    def _slowest_imports(self, count):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', COLD_START], capture_output=True, text=True)
+        totals = Counter()
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME.match(line)
+            if match:
+                totals[match.group(2).split('.')[0]] += int(match.group(1)) / 1e6
+        return totals.most_common(count)
@@ -0,0 +1,54 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.lifecycle import close_loop_clients
+from chat.models import Conversation, Message
+from chat.retrieval import retriever
+
+class Command(BaseCommand):
+    help = (
+        'Adds stored messages that are not indexed yet to the per-channel long-term '
+        'memory indexes. Safe to re-run; new messages are indexed as they are answered.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', action='append', help='Only index this channel (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=256, help='Messages embedded per call')
+
+    def handle(self, *args, **options):
+        if retriever is None:
+            raise CommandError('Retrieval is disabled; set RETRIEVAL_EMBEDDER and install NumPy')
+
+        channels = options['channel'] or list(
+            Conversation.objects.values_list('channel_id', flat=True).distinct().order_by('channel_id')
+        )
+        for channel_id in channels:
+            added = asyncio.run(self._index_channel(channel_id, options['batch_size']))
+            self.stdout.write(f'{channel_id}: {added} messages indexed')
+        self.stdout.write(self.style.SUCCESS(f'Indexed {len(channels)} channels'))
+
+    async def _index_channel(self, channel_id, batch_size):
+        try:
+            return await self._index_batches(channel_id, batch_size)
+        finally:
+            # Each channel runs on its own event loop; the OpenAI embedder's client is bound to it.
+            await close_loop_clients()
+
+    async def _index_batches(self, channel_id, batch_size):
+        index = retriever.index(channel_id)
+        messages = Message.objects.filter(conversation__channel_id=channel_id).order_by('pk')
+        added = 0
+        last_id = 0
+        while True:
+            # Ids are checked against the index a block at a time, so memory
+            # does not grow with the channel.
+            ids = [pk async for pk in messages.filter(pk__gt=last_id).values_list('pk', flat=True)[:index.BLOCK]]
+            if not ids:
+                return added
+            last_id = ids[-1]
+            pending = await asyncio.to_thread(index.missing, ids)
+            for start in range(0, len(pending), batch_size):
+                batch = [message async for message in messages.filter(pk__in=pending[start:start + batch_size])]
+                await retriever.add(channel_id, batch)
+                added += len(batch)
@@ -0,0 +1,39 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from chat.jobs import MentionJobWorker
+from chat.lifecycle import close_loop_clients
+from chat.slack_bot import run_mention_jobs
+from chat.write_buffer import message_writes
+
+class Command(BaseCommand):
+    help = (
+        'Processes mention jobs stored by the events endpoint in SLACK_EVENT_MODE=jobs. '
+        'Any number of these workers can run on any number of hosts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Threads answered at the same time')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls when idle')
+
+    def handle(self, *args, **options):
+        worker = MentionJobWorker(
+            run_mention_jobs,
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval']
+        )
+        self.stdout.write(f'Processing mention jobs as {worker.owner}')
+        asyncio.run(self._run(worker))
+        self.stdout.write(self.style.SUCCESS(f'Stopped after processing {worker.processed} jobs'))
+
+    async def _run(self, worker):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, worker.stop)
+        try:
+            await worker.run()
+        finally:
+            await asyncio.to_thread(message_writes.stop)
+            await close_loop_clients()
@@ -0,0 +1,158 @@
+import gzip
+import json
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from chat.models import Conversation, Message
+
+# Rough per-row storage overhead (row header, indexes) used for the dry-run estimate.
+ROW_OVERHEAD_BYTES = 200
+
+class Command(BaseCommand):
+    help = (
+        'Deletes conversations with no messages newer than a cutoff, optionally '
+        'archiving them to gzip-compressed JSONL first. Works in keyset-paginated '
+        'chunks with one short transaction per delete batch, so it can run while '
+        'the bot is live.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, required=True, help='Cutoff in days since the last message')
+        parser.add_argument('--archive-dir', help='Write archived rows to JSONL.gz files in this directory before deleting')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Conversations per chunk and rows per delete batch')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between delete batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be reclaimed')
+
+    def handle(self, *args, **options):
+        if options['older_than'] < 1:
+            raise CommandError('--older-than must be at least 1 day')
+
+        self.chunk_size = options['chunk_size']
+        self.pause = options['pause']
+        self.cutoff = timezone.now() - timedelta(days=options['older_than'])
+        self.dry_run = options['dry_run']
+        self.totals = {'conversations': 0, 'messages': 0, 'bytes': 0}
+
+        archive = None
+        if options['archive_dir'] and not self.dry_run:
+            archive = self._open_archive(Path(options['archive_dir']))
+
+        try:
+            last_id = 0
+            while True:
+                ids = list(
+                    Conversation.objects.filter(id__gt=last_id)
+                    .order_by('id')
+                    .values_list('id', flat=True)[:self.chunk_size]
+                )
+                if not ids:
+                    break
+                last_id = ids[-1]
+
+                expired = self._expired(ids)
+                if expired:
+                    self._process(expired, archive)
+        finally:
+            if archive:
+                for handle in archive.values():
+                    handle.close()
+
+        verb = 'Would reclaim' if self.dry_run else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {self.totals['conversations']} conversations and {self.totals['messages']} messages "
+            f"(~{self.totals['bytes'] / 1024 / 1024:.1f} MiB) older than {self.cutoff:%Y-%m-%d %H:%M}"
+        ))
+
+    def _expired(self, ids):
+        """
+        Returns the ids in a chunk whose newest message (or creation, for empty
+        conversations) is older than the cutoff.
+        """
+        last_activity = dict(
+            Message.objects.filter(conversation_id__in=ids)
+            .values('conversation_id')
+            .annotate(last=Max('timestamp'))
+            .values_list('conversation_id', 'last')
+        )
+        created = dict(Conversation.objects.filter(id__in=ids).values_list('id', 'created_at'))
+        return [
+            conversation_id for conversation_id in ids
+            if last_activity.get(conversation_id, created.get(conversation_id)) < self.cutoff
+        ]
+
+    def _process(self, conversation_ids, archive):
+        stats = Message.objects.filter(
+            conversation_id__in=conversation_ids, timestamp__lt=self.cutoff
+        ).aggregate(rows=Count('id'), content=Sum(Length('content')))
+        self.totals['conversations'] += len(conversation_ids)
+        self.totals['messages'] += stats['rows']
+        self.totals['bytes'] += (stats['content'] or 0) + (stats['rows'] + len(conversation_ids)) * ROW_OVERHEAD_BYTES
+
+        if self.dry_run:
+            return
+
+        if archive:
+            self._archive(conversation_ids, archive)
+
+        last_id = 0
+        while True:
+            batch = list(
+                Message.objects.filter(
+                    conversation_id__in=conversation_ids, timestamp__lt=self.cutoff, id__gt=last_id
+                ).order_by('id').values_list('id', flat=True)[:self.chunk_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1]
+            # A conversation that received a message since the chunk was
+            # checked keeps its history; the check and the delete are one statement.
+            with transaction.atomic():
+                Message.objects.filter(id__in=batch).exclude(
+                    conversation__messages__timestamp__gte=self.cutoff
+                ).delete()
+            if self.pause:
+                time.sleep(self.pause)
+
+        # ...and is kept itself.
+        with transaction.atomic():
+            Conversation.objects.filter(id__in=conversation_ids).exclude(
+                messages__timestamp__gte=self.cutoff
+            ).delete()
+
+    def _open_archive(self, directory):
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+        return {
+            'conversations': gzip.open(directory / f'conversations-{stamp}.jsonl.gz', 'at', encoding='utf-8'),
+            'messages': gzip.open(directory / f'messages-{stamp}.jsonl.gz', 'at', encoding='utf-8'),
+        }
+
+    def _archive(self, conversation_ids, archive):
+        """
+        Streams the chunk's rows to the archive files and flushes them before
+        anything is deleted.
+        """
+        conversations = Conversation.objects.filter(id__in=conversation_ids).order_by('id').values(
+            'id', 'channel_id', 'thread_ts', 'created_at', 'summary', 'summarized_until', 'replies_cursor'
+        )
+        for row in conversations.iterator(chunk_size=self.chunk_size):
+            archive['conversations'].write(json.dumps(row, default=str) + '\n')
+
+        messages = Message.objects.filter(
+            conversation_id__in=conversation_ids, timestamp__lt=self.cutoff
+        ).order_by('id').values(
+            'id', 'conversation_id', 'message_id', 'user_id', 'is_bot', 'processed',
+            'timestamp', 'token_count', 'content'
+        )
+        for row in messages.iterator(chunk_size=self.chunk_size):
+            archive['messages'].write(json.dumps(row, default=str) + '\n')
+
+        for handle in archive.values():
+            handle.flush()
@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.bench.loadgen import build_report, format_report
+from chat.bench.replay import TraceReplayer, compare_reports
+from chat.bench.stubs import add_stub_arguments, start_stubs
+from chat.capture import read_trace
+from chat.models import WorkspaceToken
+
+class Command(BaseCommand):
+    help = (
+        'Replays Slack events captured with SLACK_CAPTURE_DIR against local Slack and '
+        'OpenAI stand-ins, at the original pacing or faster, and reports throughput and '
+        'latency. Events go to /slack/events (--mode http, app started with SLACK_API_URL '
+        'and OPENAI_BASE_URL pointing at the stubs) or straight to SlackBot.handle_mention '
+        'in this process (--mode direct, same settings required here). Save a report with '
+        '--output and pass it as --baseline on the next run to compare code versions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace', nargs='+', help='Trace files or capture directories')
+        parser.add_argument('--mode', choices=('http', 'direct'), default='http')
+        parser.add_argument('--url', default='http://127.0.0.1:8000/slack/events')
+        parser.add_argument('--speed', type=float, default=1.0, help='Replay speed-up; 0 sends events back to back')
+        parser.add_argument('--limit', type=int, help='Only replay the first N events')
+        parser.add_argument('--drain', type=float, default=10.0, help='Seconds to wait for replies after the replay')
+        add_stub_arguments(parser)
+        parser.add_argument('--output', help='Write the report as JSON to this file')
+        parser.add_argument('--baseline', help='Compare with a report written by an earlier --output')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        records = read_trace(options['trace'])[:options['limit']]
+        if not records:
+            raise CommandError('The trace has no events')
+        if options['mode'] == 'direct':
+            self._check_stub_settings(options)
+
+        teams = {json.loads(record['body']).get('team_id') for record in records} - {None}
+        for team_id in teams:
+            WorkspaceToken.objects.get_or_create(team_id=team_id, defaults={'bot_token': 'xoxb-bench'})
+
+        report = asyncio.run(self._run(records, options))
+
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"Replayed {len(records)} events at {options['speed']}x")
+            for line in format_report(report):
+                self.stdout.write(line)
+
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)
+            self.stdout.write('Compared with baseline:')
+            for name, before, after, change in compare_reports(baseline, report):
+                delta = f"{change:+.1%}" if change is not None else "n/a"
+                self.stdout.write(f"  {name}: {_format(before)} -> {_format(after)} ({delta})")
+
+    def _check_stub_settings(self, options):
+        # Replayed traces carry real channels and users; never send them to the real APIs.
+        slack = f"http://{options['host']}:{options['slack_port']}/"
+        openai = f"http://{options['host']}:{options['openai_port']}/"
+        if not settings.SLACK_API_URL.startswith(slack) or not (settings.OPENAI_BASE_URL or '').startswith(openai):
+            raise CommandError(
+                f'Direct mode needs SLACK_API_URL={slack}api/ and OPENAI_BASE_URL={openai}v1 '
+                'in the environment of this command'
+            )
+
+    async def _run(self, records, options):
+        slack_stub, openai_stub, runners = await start_stubs(options)
+
+        handler = None
+        if options['mode'] == 'direct':
+            from chat.slack_bot import SlackBot
+
+            async def handler(event):
+                await SlackBot.handle_mention(event, None)
+
+        replayer = TraceReplayer(
+            records,
+            speed=options['speed'],
+            url=options['url'] if options['mode'] == 'http' else None,
+            signing_secret=settings.SLACK_SIGNING_SECRET or '',
+            handler=handler
+        )
+        try:
+            elapsed = await replayer.run()
+            await self._wait_for_replies(replayer, slack_stub, options['drain'])
+        finally:
+            if options['mode'] == 'direct':
+                await self._close_direct_clients()
+            for runner in runners:
+                await runner.cleanup()
+
+        return build_report(
+            replayer, elapsed, slack_stub.replied_at, slack_stub.first_token_at, slack_stub, openai_stub
+        )
+
+    async def _close_direct_clients(self):
+        from chat.lifecycle import close_loop_clients
+        from chat.write_buffer import message_writes
+
+        await asyncio.to_thread(message_writes.stop)
+        await close_loop_clients()
+
+    async def _wait_for_replies(self, replayer, slack_stub, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            if all(thread_ts in slack_stub.replied_at for thread_ts in replayer.sent_at):
+                return
+            await asyncio.sleep(0.1)
+
+
+def _format(value):
+    if value is None:
+        return "-"
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
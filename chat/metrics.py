@@ -0,0 +1,176 @@
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(key + (("le", repr(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    In-process metrics registry rendered in the Prometheus text format. Gauges
+    are read from collector callbacks at scrape time, so components such as the
+    worker pool and the caches only keep their own counters.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, name, documentation, collect, kind="gauge"):
+        """
+        Registers a metric family read at scrape time. `collect` returns a list
+        of (labels dict, value).
+        """
+        self._collectors.append((name, documentation, collect, kind))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, documentation, collect, kind in self._collectors:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in collect():
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_latency = registry.histogram(
+    "slackbot_stage_duration_seconds",
+    "Time spent in each stage of handling a mention.",
+    ("stage", "team", "outcome")
+)
+mention_latency = registry.histogram(
+    "slackbot_mention_duration_seconds",
+    "End-to-end time to handle a mention.",
+    ("team", "outcome")
+)
+openai_tokens = registry.counter(
+    "slackbot_openai_tokens_total",
+    "Tokens reported by the OpenAI API.",
+    ("model", "kind")
+)
+errors = registry.counter(
+    "slackbot_errors_total",
+    "Errors while handling mentions.",
+    ("stage",)
+)
+duplicates = registry.counter(
+    "slackbot_duplicates_total",
+    "Duplicate Slack deliveries that were skipped.",
+    ("source",)
+)
+
+
+class stage_timer:
+    """
+    Context manager that records how long a stage took, labelled with the
+    team and whether the stage raised.
+    """
+
+    def __init__(self, stage, team):
+        self.stage = stage
+        self.team = team
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = "error" if exc_type else "ok"
+        stage_latency.observe(
+            time.perf_counter() - self.started,
+            stage=self.stage,
+            team=self.team or "",
+            outcome=outcome
+        )
+        if exc_type:
+            errors.inc(stage=self.stage)
+        return False
+
+
+def record_usage(model, usage):
+    """
+    Counts prompt and completion tokens from an OpenAI usage object.
+    """
+    if usage is None:
+        return
+    openai_tokens.inc(usage.prompt_tokens, model=model, kind="prompt")
+    openai_tokens.inc(usage.completion_tokens, model=model, kind="completion")
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+
+class WebhookExemptMixin:
+    """
+    Skips the middleware for the machine-to-machine URLs in WEBHOOK_PATHS. Slack
+    and the metrics scraper never send cookies or render pages, so sessions,
+    auth, messages, CSRF and frame options are pure per-request overhead there.
+    """
+
+    def __call__(self, request):
+        if request.path_info in settings.WEBHOOK_PATHS:
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class WebhookExemptSessionMiddleware(WebhookExemptMixin, SessionMiddleware):
+    pass
+
+
+class WebhookExemptCsrfViewMiddleware(WebhookExemptMixin, CsrfViewMiddleware):
+    pass
+
+
+class WebhookExemptAuthenticationMiddleware(WebhookExemptMixin, AuthenticationMiddleware):
+    pass
+
+
+class WebhookExemptMessageMiddleware(WebhookExemptMixin, MessageMiddleware):
+    pass
+
+
+class WebhookExemptXFrameOptionsMiddleware(WebhookExemptMixin, XFrameOptionsMiddleware):
+    pass
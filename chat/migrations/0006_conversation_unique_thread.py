@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:35
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_conversations(apps, schema_editor):
+    """
+    Folds conversations that share a (channel_id, thread_ts) into the oldest one,
+    so the unique constraint can be added.
+    """
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+
+    duplicates = (
+        Conversation.objects.values('channel_id', 'thread_ts')
+        .annotate(keep_id=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates:
+        others = Conversation.objects.filter(
+            channel_id=duplicate['channel_id'],
+            thread_ts=duplicate['thread_ts']
+        ).exclude(id=duplicate['keep_id'])
+        Message.objects.filter(conversation__in=others).update(conversation_id=duplicate['keep_id'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_workspacetoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_conversations, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='conversation',
+            name='chat_conver_channel_529590_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('channel_id', 'thread_ts'), name='unique_conversation_thread'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_cachedresponse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MentionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('team_id', models.CharField(max_length=100)),
+                ('channel_id', models.CharField(max_length=100)),
+                ('thread_ts', models.CharField(max_length=100)),
+                ('event', models.JSONField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('leased_until', models.DateTimeField(blank=True, null=True)),
+                ('lease_owner', models.CharField(blank=True, default='', max_length=100)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('failed', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('failed', False)), fields=['available_at', 'id'], name='mention_job_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_mentionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='replies_cursor',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -6,10 +6,14 @@ class Conversation(models.Model):
     channel_id = models.CharField(max_length=100)
     thread_ts = models.CharField(max_length=100)
     created_at = models.DateTimeField(default=timezone.now)
+    summary = models.TextField(blank=True, default='')
+    summarized_until = models.DateTimeField(null=True, blank=True)
+    # ts of the last thread reply fetched by the backfill; empty until the first one.
+    replies_cursor = models.CharField(max_length=32, blank=True, default='')
 
     class Meta:
-        indexes = [
-            models.Index(fields=['channel_id', 'thread_ts']),
+        constraints = [
+            models.UniqueConstraint(fields=['channel_id', 'thread_ts'], name='unique_conversation_thread'),
         ]
 
 def generate_message_id():
@@ -26,6 +30,7 @@ class Message(models.Model):
     user_id = models.CharField(max_length=100)
     processed = models.BooleanField(default=False)
     message_id = models.CharField(max_length=100, unique=True,default=generate_message_id)
+    token_count = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta:
         ordering = ['-timestamp']
@@ -36,4 +41,31 @@ class Message(models.Model):
 class WorkspaceToken(models.Model):
     team_id = models.CharField(max_length=100, unique=True)
     bot_token = models.CharField(max_length=255)
-    installed_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    installed_at = models.DateTimeField(auto_now_add=True)
+
+class CachedResponse(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    response = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+class MentionJob(models.Model):
+    team_id = models.CharField(max_length=100)
+    channel_id = models.CharField(max_length=100)
+    thread_ts = models.CharField(max_length=100)
+    event = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+    available_at = models.DateTimeField(default=timezone.now)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    lease_owner = models.CharField(max_length=100, blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['available_at', 'id'],
+                condition=models.Q(failed=False),
+                name='mention_job_pending_idx'
+            ),
+        ]
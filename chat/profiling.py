@@ -0,0 +1,289 @@
+import asyncio
+import atexit
+import hmac
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger(__name__)
+
+MAX_DEPTH = 128
+
+# Set on mention events whose request was profiled, so that handling them in
+# the worker pool or a job worker is profiled as well.
+PROFILE_MARK = "profile"
+
+
+class ProfileSession:
+    def __init__(self, label):
+        self.label = label
+        self.samples = Counter()
+        self.started = time.perf_counter()
+        # The session records the work of the thread that opened it and, when
+        # opened inside a coroutine, only that thread's current task.
+        self.thread_id = threading.get_ident()
+        try:
+            self.task = asyncio.current_task()
+        except RuntimeError:
+            self.task = None
+
+
+class StackSampler:
+    """
+    Wall-clock sampling profiler. While at least one session is open, a
+    background thread samples the stacks of the process every `interval`
+    seconds. A session keeps the full stack of the thread (or task) that owns
+    it, including where a suspended task is waiting; every other thread only
+    counts as "other;<thread>", so concurrent requests do not show up in each
+    other's profiles. Stacks are kept in the collapsed format of flamegraph.pl
+    and speedscope ("thread;module:function;... count").
+
+    Each finished session is written to its own file under `directory/requests`
+    (keeping the newest `keep`), and added to a per-process aggregate in
+    `directory/worker-<pid>.folded` that is rewritten at most every
+    `flush_interval` seconds and at exit. The files are written by the sampler
+    thread, so closing a session on an event loop never blocks it on disk I/O.
+    """
+
+    def __init__(self, directory, interval=0.005, keep=200, flush_interval=10.0):
+        self.directory = Path(directory)
+        self.interval = interval
+        self.keep = keep
+        self.flush_interval = flush_interval
+        self.totals = Counter()
+        self._sessions = set()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._ids = itertools.count(1)
+        self._flushed_at = time.monotonic()
+        atexit.register(self.write_aggregate)
+
+    def start(self, label):
+        session = ProfileSession(label)
+        with self._lock:
+            self._sessions.add(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        return session
+
+    def stop(self, session):
+        """
+        Closes a session and returns the name of its profile file, which the
+        sampler thread writes shortly after.
+        """
+        name = f"{os.getpid()}-{next(self._ids)}-{session.label}.folded"
+        with self._lock:
+            self._sessions.discard(session)
+            self.totals.update(session.samples)
+            # The session kept the thread alive, so it is still there to write the file.
+            self._pending.append((name, session.samples))
+        return name
+
+    def write_aggregate(self):
+        with self._lock:
+            totals = Counter(self.totals)
+            self._flushed_at = time.monotonic()
+        if totals:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            _write_folded(self.directory / f"worker-{os.getpid()}.folded", totals)
+
+    def _write(self, name, samples):
+        try:
+            requests_dir = self.directory / "requests"
+            requests_dir.mkdir(parents=True, exist_ok=True)
+            _write_folded(requests_dir / name, samples)
+            for stale in sorted(requests_dir.glob("*.folded"), key=os.path.getmtime)[:-self.keep]:
+                stale.unlink(missing_ok=True)
+            if time.monotonic() - self._flushed_at >= self.flush_interval:
+                self.write_aggregate()
+        except OSError as e:
+            logger.error(f"Could not write profile {name}: {str(e)}")
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                if not self._sessions and not pending:
+                    self._thread = None
+                    return
+                sessions = list(self._sessions)
+            for name, samples in pending:
+                self._write(name, samples)
+            if not sessions:
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            frames.pop(me, None)
+            for session in sessions:
+                session.samples.update(_session_stacks(session, frames, names))
+            time.sleep(self.interval)
+
+
+def _session_stacks(session, frames, names):
+    stacks = []
+    task = session.task if session.task is not None and not session.task.done() else None
+    task_running = False
+    for ident, frame in frames.items():
+        name = _thread_label(names.get(ident, str(ident)))
+        owned = ident == session.thread_id and (
+            session.task is None or (task is not None and _runs_task(frame, task))
+        )
+        if owned:
+            task_running = task is not None
+            stacks.append(_collapse(frame, name))
+        else:
+            stacks.append(f"other;{name}")
+    if task is not None and not task_running:
+        stacks.append(_collapse_task(task, _thread_label(names.get(session.thread_id, str(session.thread_id)))))
+    return stacks
+
+
+def _runs_task(frame, task):
+    outer = getattr(task.get_coro(), "cr_frame", None)
+    while frame is not None:
+        if frame is outer:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def _collapse_task(task, thread_name):
+    # A suspended task has no thread stack; follow its chain of awaited coroutines instead.
+    parts = [thread_name]
+    awaitable = task.get_coro()
+    while awaitable is not None and len(parts) <= MAX_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None)
+        if frame is None:
+            break
+        parts.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "ag_await", None)
+    return ";".join(parts)
+
+
+def _collapse(frame, thread_name):
+    parts = []
+    while frame is not None and len(parts) < MAX_DEPTH:
+        parts.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    parts.append(thread_name)
+    return ";".join(reversed(parts))
+
+
+def _thread_label(thread_name):
+    return thread_name.replace(";", "_").replace(" ", "_")
+
+
+def _write_folded(path, samples):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as handle:
+        for stack, count in samples.most_common():
+            handle.write(f"{stack} {count}\n")
+    os.replace(tmp, path)
+
+
+class SamplingProfilerMiddleware:
+    """
+    Profiles a PROFILE_SAMPLE_RATE fraction of requests, and every request whose
+    X-Profile-Token header matches PROFILE_TOKEN. The profile file name is
+    returned in the X-Profile-Id response header, and `request.profiled` is set
+    so views can pass the selection on to work they queue. When neither setting
+    is on, Django drops the middleware at startup, so it costs nothing.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_SAMPLE_RATE and not settings.PROFILE_TOKEN:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILE_SAMPLE_RATE
+        self.token = settings.PROFILE_TOKEN
+        self.sampler = _sampler()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._selected(request):
+            return self.get_response(request)
+        request.profiled = True
+        session = self.sampler.start(_label(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            name = self.sampler.stop(session)
+        response["X-Profile-Id"] = name
+        return response
+
+    async def __acall__(self, request):
+        if not self._selected(request):
+            return await self.get_response(request)
+        request.profiled = True
+        session = self.sampler.start(_label(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            name = self.sampler.stop(session)
+        response["X-Profile-Id"] = name
+        return response
+
+    def _selected(self, request):
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        provided = request.headers.get("X-Profile-Token")
+        return bool(self.token and provided and hmac.compare_digest(provided, self.token))
+
+
+@asynccontextmanager
+async def profile_mentions(events, label):
+    """
+    Profiles the handling of queued mentions when any of them carries
+    PROFILE_MARK, and logs the profile's file name.
+    """
+    if not any(event.get(PROFILE_MARK) for event in events):
+        yield
+        return
+    sampler = _sampler()
+    session = sampler.start(label)
+    try:
+        yield
+    finally:
+        name = sampler.stop(session)
+        logger.info(f"Profiled {label} of mentions {[event.get('event_ts') for event in events]}: {name}")
+
+
+def _label(request):
+    return re.sub(r"[^A-Za-z0-9]+", "_", f"{request.method}{request.path}").strip("_")[:80]
+
+
+_shared_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def _sampler():
+    global _shared_sampler
+    with _sampler_lock:
+        if _shared_sampler is None:
+            _shared_sampler = StackSampler(
+                settings.PROFILE_DIR,
+                interval=settings.PROFILE_INTERVAL,
+                keep=settings.PROFILE_KEEP
+            )
+        return _shared_sampler
@@ -0,0 +1,298 @@
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from slack_sdk.http_retry.builtin_async_handlers import (
+    AsyncConnectionErrorRetryHandler,
+    AsyncRateLimitErrorRetryHandler,
+)
+from slack_sdk.web.async_client import AsyncWebClient
+
+logger = logging.getLogger(__name__)
+
+# How long Slack calls of the current task may wait for a token; see slack_wait_limit.
+_slack_max_wait = contextvars.ContextVar("slack_max_wait", default=None)
+
+
+class RateLimitTimeout(Exception):
+    """
+    Raised when a rate limit would make a call wait longer than allowed.
+    """
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations: a caller that finds the bucket
+    empty is told how long to wait for its token instead of polling, so
+    callers are served in arrival order from any thread or event loop.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now, max_wait=None):
+        """
+        Takes a token and returns how long to wait for it. When that would be
+        longer than `max_wait`, no token is taken and None is returned.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = max(-self.tokens / self.rate if self.tokens < 0 else 0.0, self.blocked_until - now)
+        if max_wait is not None and wait > max_wait:
+            self.tokens += 1
+            return None
+        return wait
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class RateLimiter:
+    """
+    Keyed token buckets, e.g. one per (team, Slack method). Idle buckets are
+    dropped least-recently-used first beyond `max_buckets`. A call that would
+    wait more than `max_wait` seconds (0 means no limit) raises
+    RateLimitTimeout instead of queueing behind a backlog it cannot clear.
+    """
+
+    def __init__(self, max_buckets=10000, max_wait=0):
+        self.max_buckets = max_buckets
+        self.max_wait = max_wait
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.timed_out = 0
+
+    async def acquire(self, key, rate, burst, max_wait=None):
+        """
+        Waits for a token. `max_wait` overrides the limiter's own limit for
+        this call; 0 raises RateLimitTimeout rather than waiting at all.
+        """
+        if max_wait is None:
+            max_wait = self.max_wait or None
+        with self._lock:
+            wait = self._bucket(key, rate, burst).reserve(time.monotonic(), max_wait)
+            if wait is None:
+                self.timed_out += 1
+            elif wait > 0:
+                self.throttled += 1
+        if wait is None:
+            raise RateLimitTimeout(f"Rate limit for {key} would delay the call more than {max_wait}s")
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, key, seconds):
+        """
+        Blocks a bucket for `seconds`, e.g. after a 429 with Retry-After.
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.block(time.monotonic() + seconds)
+
+    def _bucket(self, key, rate, burst):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket
+
+
+class FairConcurrencyLimiter:
+    """
+    Caps in-flight work across all teams. When the cap is reached, waiters are
+    queued per team and freed slots are handed out round-robin between teams,
+    so one busy workspace cannot starve the others. Works across event loops.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._waiters = OrderedDict()
+        self._lock = threading.Lock()
+        self._cooldown_until = 0.0
+
+    async def acquire(self, team):
+        cooldown = self._cooldown_until - time.monotonic()
+        if cooldown > 0:
+            await asyncio.sleep(cooldown)
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.setdefault(team, deque()).append(waiter)
+
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                queue = self._waiters.get(team)
+                queued = queue is not None and waiter in queue
+                if queued:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiters[team]
+            if not queued and waiter[1].done() and not waiter[1].cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                team, queue = self._waiters.popitem(last=False)
+                loop, future = queue.popleft()
+                if queue:
+                    # The team goes to the back of the rotation.
+                    self._waiters[team] = queue
+                if not future.done():
+                    # The slot passes straight to the waiter; in_flight is unchanged.
+                    loop.call_soon_threadsafe(self._grant, future)
+                    return
+            self.in_flight -= 1
+
+    def penalize(self, seconds):
+        """
+        Holds back new work for `seconds`, e.g. after the upstream returned 429.
+        """
+        self._cooldown_until = max(self._cooldown_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": {team: len(queue) for team, queue in self._waiters.items()},
+            }
+
+    def _grant(self, future):
+        if future.done():
+            # The waiter was cancelled after the slot was handed over.
+            self.release()
+        else:
+            future.set_result(True)
+
+
+def retry_after_seconds(headers, default=1.0):
+    """
+    Reads Retry-After (or OpenAI's retry-after-ms) and adds up to 50% jitter,
+    so throttled callers do not all come back at the same moment.
+    """
+    seconds = default
+    try:
+        if headers.get("retry-after-ms"):
+            seconds = float(headers["retry-after-ms"]) / 1000
+        elif headers.get("retry-after"):
+            seconds = float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return seconds + random.uniform(0, seconds / 2)
+
+
+def _parse_method_rates(value):
+    rates = {}
+    for item in filter(None, value.split(",")):
+        method, _, limits = item.partition("=")
+        rate, _, burst = limits.partition("/")
+        rates[method.strip()] = (float(rate), int(burst or 1))
+    return rates
+
+
+slack_method_rates = _parse_method_rates(settings.SLACK_METHOD_RATES)
+slack_limiter = RateLimiter(max_wait=settings.SLACK_RATE_MAX_WAIT)
+llm_team_limiter = RateLimiter(max_wait=settings.LLM_TEAM_MAX_WAIT)
+llm_concurrency = FairConcurrencyLimiter(settings.LLM_MAX_IN_FLIGHT)
+
+
+@contextmanager
+def slack_wait_limit(seconds):
+    """
+    Caps how long Slack calls made inside the block wait for their token or
+    for a 429's Retry-After. With 0 they raise RateLimitTimeout (or the 429)
+    instead of waiting.
+    """
+    token = _slack_max_wait.set(seconds)
+    try:
+        yield
+    finally:
+        _slack_max_wait.reset(token)
+
+
+class SlackRetryHandler(AsyncRateLimitErrorRetryHandler):
+    """
+    Retries Slack 429s after Retry-After (plus jitter) and blocks the team's
+    bucket for that method, so queued calls wait out the limit too.
+    """
+
+    def __init__(self, team_id, max_retry_count=2):
+        super().__init__(max_retry_count=max_retry_count)
+        self.team_id = team_id
+
+    async def _can_retry_async(self, *, state, request, response=None, error=None):
+        if not await super()._can_retry_async(state=state, request=request, response=response, error=error):
+            return False
+        retry_after = float(next(
+            (values[0] for name, values in response.headers.items() if name.lower() == "retry-after"),
+            1
+        ))
+        method = request.url.rstrip("/").rsplit("/", 1)[-1]
+        slack_limiter.penalize((self.team_id, method), retry_after)
+        max_wait = _slack_max_wait.get()
+        return max_wait is None or retry_after <= max_wait
+
+
+class RateLimitedWebClient(AsyncWebClient):
+    """
+    AsyncWebClient that takes a token from the team's bucket for each Slack
+    method before calling it.
+    """
+
+    def __init__(self, *args, rate_limit_team=None, **kwargs):
+        kwargs.setdefault("retry_handlers", [
+            AsyncConnectionErrorRetryHandler(),
+            SlackRetryHandler(rate_limit_team),
+        ])
+        super().__init__(*args, **kwargs)
+        self.rate_limit_team = rate_limit_team
+
+    async def api_call(self, api_method, **kwargs):
+        rate = slack_method_rates.get(api_method) or slack_method_rates.get("default")
+        if rate:
+            await slack_limiter.acquire((self.rate_limit_team, api_method), *rate, max_wait=_slack_max_wait.get())
+        return await super().api_call(api_method, **kwargs)
+
+
+@asynccontextmanager
+async def llm_slot(team_id):
+    """
+    Admits one LLM call for a team: waits for the team's token bucket (or raises
+    RateLimitTimeout), then for a fair share of the global in-flight cap. A 429 that survives the client's
+    own retries pauses new LLM calls for its Retry-After.
+    """
+    await llm_team_limiter.acquire(team_id, settings.LLM_TEAM_RATE, settings.LLM_TEAM_BURST)
+    await llm_concurrency.acquire(team_id)
+    try:
+        yield
+    except Exception as e:
+        # openai is imported lazily; by the time a call fails it is loaded.
+        import openai
+
+        if isinstance(e, openai.RateLimitError):
+            llm_concurrency.penalize(retry_after_seconds(e.response.headers))
+        raise
+    finally:
+        llm_concurrency.release()
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import CachedResponse
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(text):
+    return " ".join(text.split()).casefold()
+
+
+def make_key(messages, model, temperature, max_tokens):
+    """
+    Stable hash of the normalized message list and sampling parameters.
+    """
+    payload = {
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "messages": [[message["role"], _normalize(message["content"])] for message in messages],
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class MemoryBackend:
+    """
+    Per-process backend with TTL and LRU eviction bounded by total response size.
+    """
+
+    def __init__(self, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    async def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    async def set(self, key, response):
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (response, time.monotonic() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0].encode("utf-8"))
+
+
+class DatabaseBackend:
+    """
+    Backend on the CachedResponse table, so every worker process shares hits.
+    Expired rows are ignored on read and pruned, together with the oldest rows
+    beyond `max_entries`, every `prune_every` writes.
+    """
+
+    def __init__(self, ttl, max_entries, prune_every=100):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._writes = 0
+
+    async def get(self, key):
+        return await CachedResponse.objects.filter(
+            key=key, expires_at__gt=timezone.now()
+        ).values_list('response', flat=True).afirst()
+
+    async def set(self, key, response):
+        now = timezone.now()
+        await CachedResponse.objects.abulk_create(
+            [CachedResponse(key=key, response=response, created_at=now,
+                            expires_at=now + timedelta(seconds=self.ttl))],
+            update_conflicts=True,
+            unique_fields=['key'],
+            update_fields=['response', 'created_at', 'expires_at']
+        )
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            await self.prune()
+
+    async def prune(self):
+        await CachedResponse.objects.filter(expires_at__lte=timezone.now()).adelete()
+        cutoff = await CachedResponse.objects.order_by('-expires_at').values_list(
+            'expires_at', flat=True
+        )[self.max_entries:self.max_entries + 1].afirst()
+        if cutoff is not None:
+            await CachedResponse.objects.filter(expires_at__lte=cutoff).adelete()
+
+
+class ResponseCache:
+    """
+    Optional exact-match cache in front of the LLM, with per-workspace opt-out
+    and hit-rate stats.
+    """
+
+    def __init__(self, backend=None, excluded_teams=()):
+        self.backend = backend
+        self.excluded_teams = set(excluded_teams)
+        self.hits = 0
+        self.misses = 0
+
+    def enabled_for(self, team_id):
+        return self.backend is not None and team_id not in self.excluded_teams
+
+    async def get(self, key):
+        try:
+            response = await self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Response cache read failed: {str(e)}")
+            response = None
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    async def set(self, key, response):
+        try:
+            await self.backend.set(key, response)
+        except Exception as e:
+            logger.error(f"Response cache write failed: {str(e)}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def _build_backend():
+    if settings.RESPONSE_CACHE_BACKEND == "memory":
+        return MemoryBackend(ttl=settings.RESPONSE_CACHE_TTL, max_bytes=settings.RESPONSE_CACHE_MAX_BYTES)
+    if settings.RESPONSE_CACHE_BACKEND == "database":
+        return DatabaseBackend(ttl=settings.RESPONSE_CACHE_TTL, max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES)
+    return None
+
+
+response_cache = ResponseCache(
+    backend=_build_backend(),
+    excluded_teams=settings.RESPONSE_CACHE_EXCLUDED_TEAMS
+)
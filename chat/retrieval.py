@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .llm import llm_backend
+
+# NumPy takes tens of milliseconds to import, so it is only loaded once
+# retrieval is switched on (see `_load_numpy`).
+np = None
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder: hashes words and word pairs into a fixed
+    number of signed buckets. Needs no network access, which makes it useful
+    offline and in tests; semantic quality is that of a bag of words.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hashing{dim}"
+
+    async def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORD.findall(text.casefold())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dim] += 1.0 if value >> 63 else -1.0
+        return vectors
+
+
+class OpenAIEmbedder:
+    """
+    Embeds texts with the OpenAI embeddings endpoint.
+    """
+
+    def __init__(self, model="text-embedding-3-small", dim=1536):
+        self.model = model
+        self.dim = dim
+        self.name = model
+
+    async def embed(self, texts):
+        response = await llm_backend.client().embeddings.create(model=self.model, input=texts)
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+
+class ChannelIndex:
+    """
+    Append-only vector store for one channel: a flat file of (message id,
+    normalized vector) records that is memory-mapped for search, so memory use
+    does not grow with the channel. Search scans the file in fixed-size blocks
+    with a vectorized dot product and keeps a running top-k. Once the file holds
+    more than `max_vectors` records, the oldest are dropped by rewriting it.
+    Appends and rewrites hold an exclusive lock on a `.lock` file next to the
+    index, so workers and `index_messages` can share one index.
+    """
+
+    BLOCK = 65536
+
+    def __init__(self, path, dim, max_vectors=1000000):
+        _load_numpy()
+        self.path = Path(path)
+        self.dim = dim
+        self.max_vectors = max_vectors
+        self.dtype = np.dtype([("id", "<i8"), ("vec", "<f4", (dim,))])
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        try:
+            return self.path.stat().st_size // self.dtype.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def add(self, ids, vectors):
+        records = np.empty(len(ids), dtype=self.dtype)
+        records["id"] = ids
+        records["vec"] = _normalize(vectors)
+        with self._locked():
+            # One write per batch on an O_APPEND file, so whole records land together.
+            with open(self.path, "ab") as handle:
+                handle.write(records.tobytes())
+            if len(self) > self.max_vectors * 1.25:
+                self._compact()
+
+    def missing(self, ids):
+        """
+        Returns the ids that are not in the index, scanning it block by block.
+        """
+        missing = np.unique(np.asarray(ids, dtype=np.int64))
+        records = self._records()
+        if records is None:
+            return missing.tolist()
+        for start in range(0, len(records), self.BLOCK):
+            if not missing.size:
+                break
+            missing = missing[~np.isin(missing, records[start:start + self.BLOCK]["id"])]
+        return missing.tolist()
+
+    def search(self, vector, k=5, exclude=()):
+        """
+        Returns up to `k` (message id, cosine similarity) pairs, best first.
+        """
+        records = self._records()
+        if records is None:
+            return []
+        count = len(records)
+        query = _normalize(vector.reshape(1, -1))[0]
+        excluded = np.fromiter(exclude, dtype=np.int64)
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, count, self.BLOCK):
+            block = records[start:start + self.BLOCK]
+            scores = block["vec"] @ query
+            ids = block["id"]
+            if excluded.size:
+                keep = ~np.isin(ids, excluded)
+                scores, ids = scores[keep], ids[keep]
+            best_ids = np.concatenate([best_ids, ids])
+            best_scores = np.concatenate([best_scores, scores])
+            if best_scores.size > k:
+                top = np.argpartition(-best_scores, k)[:k]
+                best_ids, best_scores = best_ids[top], best_scores[top]
+        order = np.argsort(-best_scores)
+        return [(int(best_ids[i]), float(best_scores[i])) for i in order]
+
+    def _records(self):
+        # The size is taken from the open file: a compaction may replace the path
+        # with a shorter file at any time.
+        try:
+            with open(self.path, "rb") as handle:
+                count = os.fstat(handle.fileno()).st_size // self.dtype.itemsize
+                if not count:
+                    return None
+                return np.memmap(handle, dtype=self.dtype, mode="r", shape=(count,))
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path.with_suffix(".lock"), "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                yield
+
+    def _compact(self):
+        count = len(self)
+        records = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(count,))
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "wb") as handle:
+            handle.write(records[count - self.max_vectors:].tobytes())
+        del records
+        os.replace(tmp, self.path)
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        import numpy
+
+        np = numpy
+    return np
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class MessageRetriever:
+    """
+    Long-term memory across the threads of a channel. Stored messages are
+    embedded and appended to the channel's index; at prompt time the newest
+    mention is embedded and the most similar messages from other threads are
+    returned.
+    """
+
+    def __init__(self, embedder, directory, top_k=5, min_score=0.15, max_vectors=1000000):
+        _load_numpy()
+        self.embedder = embedder
+        self.directory = Path(directory)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_vectors = max_vectors
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index(self, channel_id):
+        with self._lock:
+            index = self._indexes.get(channel_id)
+            if index is None:
+                safe = re.sub(r"[^A-Za-z0-9_-]", "_", channel_id)
+                index = self._indexes[channel_id] = ChannelIndex(
+                    self.directory / f"{safe}.{self.embedder.name}.vec",
+                    self.embedder.dim,
+                    self.max_vectors
+                )
+            return index
+
+    async def add(self, channel_id, messages):
+        """
+        Embeds messages and appends them to the channel's index.
+        """
+        messages = [message for message in messages if message.pk and message.content.strip()]
+        if not messages:
+            return
+        vectors = await self.embedder.embed([message.content for message in messages])
+        await asyncio.to_thread(self.index(channel_id).add, [message.pk for message in messages], vectors)
+
+    async def search(self, channel_id, text, limit=None, exclude=()):
+        """
+        Returns the ids of the channel's messages most similar to `text`, best first.
+        """
+        vectors = await self.embedder.embed([text])
+        hits = await asyncio.to_thread(
+            self.index(channel_id).search, vectors[0], limit or self.top_k, exclude
+        )
+        return list(dict.fromkeys(message_id for message_id, score in hits if score >= self.min_score))
+
+
+def _build_retriever():
+    if not settings.RETRIEVAL_EMBEDDER:
+        return None
+    try:
+        _load_numpy()
+    except ImportError:
+        logger.warning("RETRIEVAL_EMBEDDER is set but NumPy is not installed, retrieval is disabled")
+        return None
+    if settings.RETRIEVAL_EMBEDDER == "hashing":
+        embedder = HashingEmbedder()
+    elif settings.RETRIEVAL_EMBEDDER == "openai":
+        embedder = OpenAIEmbedder()
+    else:
+        embedder = import_string(settings.RETRIEVAL_EMBEDDER)()
+    return MessageRetriever(
+        embedder,
+        settings.RETRIEVAL_DIR,
+        top_k=settings.RETRIEVAL_TOP_K,
+        min_score=settings.RETRIEVAL_MIN_SCORE,
+        max_vectors=settings.RETRIEVAL_MAX_VECTORS
+    )
+
+
+retriever = _build_retriever()
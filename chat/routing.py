@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .context import count_tokens
+from .llm import LLMBackend, llm_backend
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+routing_events = registry.counter(
+    "slackbot_llm_routing_total",
+    "LLM routing decisions: small-model picks, hedges, hedge wins and fallbacks.",
+    ("route", "event")
+)
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the last `window` successful calls and the outcome
+    of the last `window` calls per route.
+    """
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies = {}
+        self._outcomes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, seconds=None):
+        """
+        Records a call; `seconds` is None for a failed one.
+        """
+        with self._lock:
+            outcomes = self._outcomes.setdefault(route, deque(maxlen=self.window))
+            outcomes.append(seconds is not None)
+            if seconds is not None:
+                self._latencies.setdefault(route, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, route, pct):
+        """
+        Returns the route's latency percentile, or None until enough calls were seen.
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(route, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def error_rate(self, route):
+        with self._lock:
+            outcomes = self._outcomes.get(route, ())
+            if len(outcomes) < self.min_samples:
+                return 0.0
+            return 1 - sum(outcomes) / len(outcomes)
+
+    def stats(self):
+        return {
+            route: {
+                "p50": self.percentile(route, 50),
+                "p95": self.percentile(route, 95),
+                "error_rate": self.error_rate(route),
+            }
+            for route in list(self._outcomes)
+        }
+
+
+class Route:
+    def __init__(self, backend, model):
+        self.backend = backend
+        self.model = model
+
+    @property
+    def name(self):
+        return f"{self.model}@{self.backend.base_url}" if self.backend.base_url else self.model
+
+
+class LLMRouter:
+    """
+    Picks a model for each completion and hedges slow calls.
+
+    Short prompts go to `small` when one is configured. If the chosen route has
+    not answered by its `hedge_percentile` latency, a duplicate request goes to
+    the fallback route (or the same one) and whichever finishes first wins; the
+    other is cancelled. Errors go to the fallback route, which also takes over
+    while the primary's recent error rate is above `max_error_rate`.
+    """
+
+    def __init__(self, primary, fallback=None, small=None, small_prompt_tokens=0,
+                 hedge_percentile=0, hedge_min_delay=0.5, max_error_rate=0.5, tracker=None):
+        self.primary = primary
+        self.fallback = fallback
+        self.small = small
+        self.small_prompt_tokens = small_prompt_tokens
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.max_error_rate = max_error_rate
+        self.tracker = tracker or LatencyTracker()
+
+    def preferred(self, messages):
+        """
+        Returns the route that answers a prompt when every route is healthy.
+        """
+        if self.small and sum(count_tokens(m["content"]) for m in messages) <= self.small_prompt_tokens:
+            return self.small
+        return self.primary
+
+    def choose(self, messages):
+        """
+        Returns (route, alternate) for a prompt.
+        """
+        if self.preferred(messages) is self.small:
+            routing_events.inc(route=self.small.name, event="small")
+            return self.small, self.primary
+        if self.fallback and self.tracker.error_rate(self.primary.name) > self.max_error_rate:
+            return self.fallback, self.primary
+        return self.primary, self.fallback or self.primary
+
+    def hedge_delay(self, route):
+        if not self.hedge_percentile:
+            return None
+        latency = self.tracker.percentile(route.name, self.hedge_percentile)
+        if latency is None:
+            return None
+        return max(latency, self.hedge_min_delay)
+
+    async def complete(self, messages, temperature=0.7, max_tokens=500, on_route=None):
+        """
+        Runs a chat completion through the routing policy and returns the reply
+        text. `on_route`, if given, is called with the route that answered.
+        """
+        route, alternate = self.choose(messages)
+        tasks = {asyncio.create_task(self._call(route, messages, temperature, max_tokens)): route}
+        hedged = fell_back = False
+        delay = self.hedge_delay(route)
+        error = None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=None if hedged or fell_back else delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    routing_events.inc(route=route.name, event="hedged")
+                    tasks[asyncio.create_task(self._call(alternate, messages, temperature, max_tokens))] = alternate
+                    continue
+                for task in done:
+                    finished = tasks.pop(task)
+                    if task.exception() is None:
+                        if hedged and finished is not route:
+                            routing_events.inc(route=finished.name, event="hedge_won")
+                        if on_route:
+                            on_route(finished)
+                        return task.result()
+                    error = task.exception()
+                if not tasks and not hedged and not fell_back and alternate is not route:
+                    fell_back = True
+                    logger.warning(f"LLM call to {route.name} failed, falling back to {alternate.name}: {str(error)}")
+                    routing_events.inc(route=alternate.name, event="fallback")
+                    tasks[asyncio.create_task(self._call(alternate, messages, temperature, max_tokens))] = alternate
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream(self, messages, temperature=0.7, max_tokens=500, on_route=None):
+        """
+        Streams a chat completion from the chosen route. A route that fails before
+        sending any text is replaced by the alternate; streams are not hedged.
+        `on_route`, if given, is called with the route before its first delta.
+        """
+        route, alternate = self.choose(messages)
+        sent = False
+        try:
+            async for delta in route.backend.stream(messages, model=route.model,
+                                                    temperature=temperature, max_tokens=max_tokens):
+                if not sent and on_route:
+                    on_route(route)
+                sent = True
+                yield delta
+            return
+        except Exception as e:
+            if sent or alternate is route:
+                raise
+            logger.warning(f"LLM stream from {route.name} failed, falling back to {alternate.name}: {str(e)}")
+            routing_events.inc(route=alternate.name, event="fallback")
+        if on_route:
+            on_route(alternate)
+        async for delta in alternate.backend.stream(messages, model=alternate.model,
+                                                    temperature=temperature, max_tokens=max_tokens):
+            yield delta
+
+    async def aclose(self):
+        backends = {id(r.backend): r.backend for r in (self.primary, self.fallback, self.small) if r}
+        for backend in backends.values():
+            await backend.aclose()
+
+    async def _call(self, route, messages, temperature, max_tokens):
+        started = time.perf_counter()
+        try:
+            response = await route.backend.complete(
+                messages, model=route.model, temperature=temperature, max_tokens=max_tokens
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.tracker.observe(route.name)
+            raise
+        self.tracker.observe(route.name, time.perf_counter() - started)
+        return response
+
+
+def _build_router():
+    primary = Route(llm_backend, settings.OPENAI_MODEL)
+
+    fallback = None
+    if settings.OPENAI_FALLBACK_MODEL or settings.OPENAI_FALLBACK_BASE_URL:
+        backend = llm_backend
+        if settings.OPENAI_FALLBACK_BASE_URL:
+            backend = LLMBackend(
+                api_key=settings.OPENAI_FALLBACK_API_KEY or settings.OPENAI_API_KEY,
+                base_url=settings.OPENAI_FALLBACK_BASE_URL,
+                timeout=settings.OPENAI_TIMEOUT,
+                connect_timeout=settings.OPENAI_CONNECT_TIMEOUT,
+                max_retries=settings.OPENAI_MAX_RETRIES,
+                max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS
+            )
+        fallback = Route(backend, settings.OPENAI_FALLBACK_MODEL or settings.OPENAI_MODEL)
+
+    small = Route(llm_backend, settings.OPENAI_SMALL_MODEL) if settings.OPENAI_SMALL_MODEL else None
+
+    return LLMRouter(
+        primary,
+        fallback=fallback,
+        small=small,
+        small_prompt_tokens=settings.OPENAI_SMALL_PROMPT_TOKENS,
+        hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+        hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY
+    )
+
+
+llm_router = _build_router()
+
+registry.register_collector(
+    "slackbot_llm_latency_seconds", "Recent LLM latency percentiles by route.",
+    lambda: [
+        ({"route": route, "quantile": quantile}, stats[key])
+        for route, stats in llm_router.tracker.stats().items()
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"))
+        if stats[key] is not None
+    ]
+)
@@ -1,18 +1,42 @@
+import asyncio
+import time
 import uuid
-from slack_bolt.async_app import AsyncApp
-from .models import Conversation, Message, WorkspaceToken
+from .models import Conversation, Message
+from .worker_pool import MentionWorkerPool
+from .workspace_cache import TOKEN_ERRORS, workspace_clients
+from .routing import llm_router
+from .streaming import SlackStreamWriter
+from .history_cache import history_cache
+from .context import build_messages, count_tokens, message_tokens, pack_history, summarize
+from .retrieval import retriever
+from .backfill import backfill_thread
+from .write_buffer import message_writes
+from .response_cache import make_key, response_cache
+from .metrics import duplicates, errors, mention_latency, stage_timer
+from .rate_limit import RateLimitTimeout, llm_slot, slack_wait_limit
+from .coalesce import coalescer, thread_key
+from .lifecycle import close_loop_clients
+from .admission import admission, admission_decisions
+from .profiling import profile_mentions
 from django.conf import settings
-import openai
 import logging
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
 from asgiref.sync import sync_to_async
-from openai import OpenAI
+from slack_sdk.errors import SlackApiError
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
-slack_app = AsyncApp(token=settings.SLACK_BOT_TOKEN)
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+SYSTEM_PROMPT = """You are a helpful assistant in a Slack channel.
+                    Maintain context from the conversation history and be consistent with previous responses.
+                    If you're referring to information from earlier in the conversation, mention that you're 
+                    recalling it from our previous discussion."""
+
+BUSY_FOLLOW_UP = "I'm handling a lot of requests right now. I'll follow up here shortly."
+BUSY_RETRY = "I'm sorry, I'm too busy to answer this right now. Please try again in a few minutes."
+# Set on mention events when admission control first defers them (epoch seconds).
+DEFERRED_AT = "admission_deferred_at"
 
 class SlackBot:
     @staticmethod
@@ -21,197 +45,577 @@ class SlackBot:
         Main handler for Slack mentions. Processes messages, maintains conversation history,
         and generates responses using the OpenAI API.
         """
+        return await SlackBot.handle_mentions([event])
+
+    @staticmethod
+    async def handle_mentions(events, resume=False, apologize=True):
+        """
+        Handles one or more mentions from the same thread with a single completion
+        and a single reply. All answered messages are marked processed together.
+        With `resume`, messages stored by an earlier attempt that never got a reply
+        are answered instead of being skipped as duplicates. Without `apologize` a
+        failure is not reported in the thread, for callers that will retry.
+
+        Returns the outcome: "ok", "duplicate", "no_token", "invalid", "busy",
+        "error" or "deferred". Deferred mentions were not answered yet and the
+        caller must queue them again (see `defer_mention`).
+        """
+        event = events[-1]
+        workspace_client = None
+        admitted = False
+        team_id = event.get("team")
+        outcome = "error"
+        started = time.perf_counter()
         try:
-            team_id = event.get("team")
-            print(f"Received event for team: {team_id}")
-            
+            logger.debug(f"Received event for team: {team_id}")
+
             if not team_id:
-                logger.error("Team ID not found in event data. Full event:", event)
-                return
+                logger.error(f"Team ID not found in event data. Full event: {event}")
+                outcome = "invalid"
+                return outcome
 
-            workspace_token = await SlackBot._get_workspace_token(team_id)
-            if not workspace_token:
+            with stage_timer("token_lookup", team_id):
+                workspace_client = await workspace_clients.get_client(team_id)
+            if not workspace_client:
                 logger.error(f"No token found for team {team_id}")
-                return
-            
-            workspace_client = AsyncApp(token=workspace_token)
+                outcome = "no_token"
+                return outcome
 
             channel_id = event["channel"]
             thread_ts = event.get("thread_ts", event["ts"])
-            user_id = event["user"]
-            message_text = event["text"]
-            event_ts = event["event_ts"]          
-            slack_message_id = f"slack_{event_ts}"
+            event_ts = event["event_ts"]
 
-            conversation = await SlackBot._get_or_create_conversation(
-                channel_id, thread_ts
-            )
+            if admission.enabled:
+                decision = await SlackBot._admit(workspace_client, events)
+                if decision != "admitted":
+                    outcome = decision
+                    return outcome
+                admitted = True
 
-            if await SlackBot._message_exists(slack_message_id):
-                logger.info(f"Message {slack_message_id} already exists, skipping")
-                return
-
-            await SlackBot._store_message(
-                conversation=conversation,
-                content=message_text,
-                user_id=user_id,
-                is_bot=False,
-                message_id=slack_message_id,
-                processed=False
-            )
+            with stage_timer("conversation_upsert", team_id):
+                conversation = await SlackBot._get_or_create_conversation(
+                    channel_id, thread_ts
+                )
 
-            history = await SlackBot._get_conversation_history(conversation)
-            
-            formatted_messages = [
-                {"role": "system", "content": """You are a helpful assistant in a Slack channel.
-                    Maintain context from the conversation history and be consistent with previous responses.
-                    If you're referring to information from earlier in the conversation, mention that you're 
-                    recalling it from our previous discussion."""}
-            ]
+                stored_ids = []
+                for mention in events:
+                    slack_message_id = f"slack_{mention['event_ts']}"
+                    stored = await SlackBot._store_message(
+                        conversation=conversation,
+                        content=mention["text"],
+                        user_id=mention["user"],
+                        is_bot=False,
+                        message_id=slack_message_id,
+                        processed=False
+                    )
+                    if stored:
+                        stored_ids.append(slack_message_id)
+                    elif resume and await Message.objects.filter(
+                        message_id=slack_message_id, processed=False
+                    ).aexists():
+                        stored_ids.append(slack_message_id)
+                    else:
+                        logger.info(f"Message {slack_message_id} already exists, skipping")
+                        duplicates.inc(source="database")
+            if not stored_ids:
+                outcome = "duplicate"
+                return outcome
+
+            if settings.SLACK_BACKFILL:
+                with stage_timer("thread_backfill", team_id):
+                    await SlackBot._backfill_thread(workspace_client, conversation, events)
 
-            for msg in history:
-                role = "assistant" if msg.is_bot else "user"
-                formatted_messages.append({
-                    "role": role,
-                    "content": msg.content
-                })
+            with stage_timer("history_fetch", team_id):
+                history = await SlackBot._get_conversation_history(conversation)
 
-            formatted_messages.append({
-                "role": "user",
-                "content": message_text
-            })
+            if retriever is not None:
+                with stage_timer("retrieval", team_id):
+                    related = await SlackBot._get_related_messages(
+                        conversation, history, " ".join(mention["text"] for mention in events)
+                    )
+            else:
+                related = []
 
-            response = await SlackBot._get_llm_response(formatted_messages)
+            with stage_timer("prompt_build", team_id):
+                budget = settings.CONTEXT_TOKEN_BUDGET - sum(message_tokens(message) for message in related)
+                older, recent = pack_history(history, max(budget, 0))
+                formatted_messages = build_messages(SYSTEM_PROMPT, conversation.summary, recent, related)
 
             bot_message_id = f"bot_{event_ts}_{uuid.uuid4().hex[:8]}"
 
-            await SlackBot._store_message(
-                conversation=conversation,
-                content=response,
-                user_id="BOT",
-                is_bot=True,
-                message_id=bot_message_id,
-                processed=True
-            )
+            if settings.SLACK_RESPONSE_MODE == "stream":
+                # Streaming interleaves the completion with chat.update calls.
+                with stage_timer("llm_stream", team_id) as timer:
+                    response = await SlackBot._stream_llm_response(
+                        workspace_client, channel_id, thread_ts, formatted_messages, team_id
+                    )
+                admission.observe_llm(time.perf_counter() - timer.started)
+            else:
+                with stage_timer("llm_call", team_id) as timer:
+                    response = await SlackBot._get_llm_response(formatted_messages, team_id)
+                admission.observe_llm(time.perf_counter() - timer.started)
+                with stage_timer("slack_post", team_id):
+                    await workspace_client.chat_postMessage(
+                        channel=channel_id,
+                        text=response,
+                        thread_ts=thread_ts
+                    )
 
-            await workspace_client.client.chat_postMessage(
-                channel=channel_id,
-                text=response,
-                thread_ts=thread_ts
-            )
+            with stage_timer("mark_processed", team_id):
+                reply = await SlackBot._store_reply(
+                    conversation=conversation,
+                    content=response,
+                    message_id=bot_message_id,
+                    processed_ids=stored_ids
+                )
+            outcome = "ok"
 
-            await SlackBot._mark_message_processed(conversation, slack_message_id)
+            if retriever is not None:
+                with stage_timer("memory_index", team_id):
+                    await SlackBot._index_messages(
+                        channel_id,
+                        [message for message in history if message.message_id in stored_ids] + [reply]
+                    )
+
+            with stage_timer("summary_update", team_id):
+                await SlackBot._update_summary(conversation, older, team_id)
+            return outcome
 
         except Exception as e:
             logger.error(f"Error in handle_mention: {str(e)}")
+            if outcome == "ok":
+                # The reply was posted; only the bookkeeping after it failed.
+                return outcome
+            if isinstance(e, SlackApiError) and e.response.get("error") in TOKEN_ERRORS:
+                workspace_clients.invalidate(team_id)
+                return outcome
             try:
-                if workspace_client:
-                    await workspace_client.client.chat_postMessage(
+                if workspace_client and apologize:
+                    await workspace_client.chat_postMessage(
                         channel=channel_id,
                         text="I apologize, but I encountered an error processing your request.",
                         thread_ts=thread_ts
                     )
             except Exception as send_error:
                 logger.error(f"Error sending error message: {str(send_error)}")
+            return outcome
+        finally:
+            if admitted:
+                admission.release()
+            mention_latency.observe(time.perf_counter() - started, team=team_id or "", outcome=outcome)
 
     @staticmethod
-    @sync_to_async
-    def _get_workspace_token(team_id):
+    async def _admit(workspace_client, events):
         """
-        Retrieves the bot token for a specific workspace.
+        Asks the admission controller whether the mentions can be answered now
+        and returns "admitted", "deferred" or "busy". The first time mentions are
+        turned away the user is told a reply will follow, and the events are
+        marked with the time so whoever queues them again knows how long they
+        have waited. After ADMISSION_DEFER_TIMEOUT seconds they are dropped with
+        an apology instead.
         """
+        event = events[-1]
+        team_id = event["team"]
+        priority = admission.priority(team_id)
+        deferred_at = min((mention[DEFERRED_AT] for mention in events if DEFERRED_AT in mention), default=None)
+        # Retries of deferred mentions would count their own wait as queue delay.
+        queue_delay = None if deferred_at else max(0.0, time.time() - float(event["event_ts"]))
+        if admission.try_admit(team_id, queue_delay):
+            admission_decisions.inc(
+                priority=priority, decision="admitted_after_deferral" if deferred_at else "admitted"
+            )
+            return "admitted"
+
+        if deferred_at is None:
+            deferred_at = time.time()
+            admission_decisions.inc(priority=priority, decision="deferred")
+            await SlackBot._post_busy_message(workspace_client, event, BUSY_FOLLOW_UP)
+        elif admission.defer_expired(deferred_at):
+            await SlackBot._shed(workspace_client, event)
+            return "busy"
+        for mention in events:
+            mention.setdefault(DEFERRED_AT, deferred_at)
+        return "deferred"
+
+    @staticmethod
+    async def _shed(workspace_client, event):
+        logger.warning(f"Shedding mention {event['event_ts']} of team {event['team']} (load {admission.load():.2f})")
+        admission_decisions.inc(priority=admission.priority(event["team"]), decision="shed")
+        await SlackBot._post_busy_message(workspace_client, event, BUSY_RETRY)
+
+    @staticmethod
+    async def _post_busy_message(workspace_client, event, text):
         try:
-            workspace = WorkspaceToken.objects.get(team_id=team_id)
-            return workspace.bot_token
-        except WorkspaceToken.DoesNotExist:
-            return None
+            await workspace_client.chat_postMessage(
+                channel=event["channel"],
+                text=text,
+                thread_ts=event.get("thread_ts", event["ts"])
+            )
+        except Exception as e:
+            logger.error(f"Error sending busy message: {str(e)}")
 
     @staticmethod
-    @sync_to_async
-    def _message_exists(message_id):
+    async def _get_or_create_conversation(channel_id, thread_ts):
         """
-        Check if a message with this ID already exists in any conversation.
-        This prevents duplicate processing across all conversations.
+        Retrieves the conversation for a thread, upserting it in a single statement
+        when the thread is new.
         """
-        return Message.objects.filter(message_id=message_id).exists()
+        conversation = await Conversation.objects.filter(
+            channel_id=channel_id, thread_ts=thread_ts
+        ).afirst()
+        if conversation is not None:
+            return conversation
+
+        conversations = await Conversation.objects.abulk_create(
+            [Conversation(channel_id=channel_id, thread_ts=thread_ts)],
+            update_conflicts=True,
+            unique_fields=['channel_id', 'thread_ts'],
+            update_fields=['thread_ts']
+        )
+        conversation = conversations[0]
+        if conversation.pk is None:
+            # Backends that cannot return rows from an upsert need one extra read.
+            conversation = await Conversation.objects.aget(channel_id=channel_id, thread_ts=thread_ts)
+        return conversation
+
+    @staticmethod
+    async def _store_message(conversation, content, user_id, is_bot=False, message_id=None, processed=False):
+        """
+        Inserts a message unless one with the same message_id already exists.
+        Returns False for duplicates, so the unique index doubles as the dedup check.
+        With write-behind buffering the insert is deferred and duplicates are
+        checked against the buffer and the table instead.
+        """
+        message = Message(
+            conversation=conversation,
+            content=content,
+            user_id=user_id,
+            is_bot=is_bot,
+            message_id=message_id,
+            processed=processed,
+            token_count=count_tokens(content),
+            timestamp=timezone.now()
+        )
+        if message_writes.enabled:
+            if message_writes.contains(message_id) or await Message.objects.filter(
+                message_id=message_id
+            ).aexists():
+                return False
+            # Checked again under the buffer's lock: another mention may have
+            # buffered the same message while the query above was running.
+            if not message_writes.add(message):
+                return False
+        else:
+            try:
+                await message.asave(force_insert=True)
+            except IntegrityError:
+                return False
+        history_cache.append((conversation.channel_id, conversation.thread_ts), message)
+        return True
 
     @staticmethod
     @sync_to_async
-    def _get_or_create_conversation(channel_id, thread_ts):
+    def _store_reply(conversation, content, message_id, processed_ids):
+        """
+        Stores the bot reply and marks the messages it answers as processed
+        in one transaction, or in the next write-behind flush.
+        """
+        message = Message(
+            conversation=conversation,
+            content=content,
+            user_id="BOT",
+            is_bot=True,
+            message_id=message_id,
+            processed=True,
+            token_count=count_tokens(content),
+            timestamp=timezone.now()
+        )
+        if message_writes.enabled:
+            message_writes.add(message)
+            message_writes.mark_processed(processed_ids)
+        else:
+            with transaction.atomic():
+                message.save(force_insert=True)
+                Message.objects.filter(
+                    conversation=conversation,
+                    message_id__in=processed_ids
+                ).update(processed=True)
+        history_cache.append((conversation.channel_id, conversation.thread_ts), message)
+        return message
+
+    @staticmethod
+    async def _get_conversation_history(conversation):
         """
-        Retrieves existing conversation or creates a new one.
+        Retrieves the most recent messages of the conversation in chronological order,
+        from the thread history cache when the thread is cached and unchanged.
         """
-        with transaction.atomic():
-            conversation, created = Conversation.objects.get_or_create(
-                channel_id=channel_id,
-                thread_ts=thread_ts
+        limit = settings.CONTEXT_MAX_MESSAGES
+        key = (conversation.channel_id, conversation.thread_ts)
+        version = None
+        if history_cache.enabled:
+            # One aggregate tells whether another process wrote to the thread since it was cached.
+            state = await Message.objects.filter(conversation=conversation).aaggregate(
+                count=Count('pk'), newest=Max('pk')
             )
-            return conversation
+            version = (state['count'], state['newest'])
+            cached = history_cache.get(key, limit, version)
+            if cached is not None:
+                return cached
+
+        messages = [
+            message async for message in Message.objects.filter(
+                conversation=conversation
+            ).order_by('-timestamp')[:max(limit, history_cache.max_messages)]
+        ]
+        messages.reverse()
+        if message_writes.enabled:
+            stored = {message.message_id for message in messages}
+            messages.extend(
+                message for message in message_writes.pending_for(conversation.pk)
+                if message.message_id not in stored
+            )
+            messages.sort(key=lambda message: message.timestamp)
+
+        history_cache.put(key, messages, version)
+        return messages[-limit:]
 
     @staticmethod
-    @sync_to_async
-    def _store_message(conversation, content, user_id, is_bot=False, message_id=None, processed=False):
-        """
-        Stores a message with transaction safety.
-        """
-        with transaction.atomic():
-            Message.objects.create(
-                conversation=conversation,
-                content=content,
-                user_id=user_id,
-                is_bot=is_bot,
-                message_id=message_id,
-                processed=processed,
-                timestamp=timezone.now()
+    async def _backfill_thread(workspace_client, conversation, events):
+        """
+        Stores thread replies up to the newest mention that did not mention the
+        bot. Backfill never delays the reply: its Slack calls do not wait for
+        rate limit tokens, and a page that would have to wait is left for the
+        next mention. Other backfill problems do not block the reply either; the
+        thread is simply answered from what is stored.
+        """
+        try:
+            with slack_wait_limit(0):
+                bot_user_id = await workspace_clients.get_bot_user_id(events[-1]["team"])
+                if not bot_user_id:
+                    return
+                stored = await backfill_thread(
+                    workspace_client,
+                    conversation,
+                    events[-1]["event_ts"],
+                    bot_user_id,
+                    page_size=settings.SLACK_BACKFILL_PAGE_SIZE,
+                    max_pages=settings.SLACK_BACKFILL_MAX_PAGES
+                )
+        except RateLimitTimeout:
+            logger.info(f"Rate limit reached, leaving the backfill of thread {conversation.thread_ts} for later")
+            return
+        except Exception as e:
+            logger.error(f"Error backfilling thread {conversation.thread_ts}: {str(e)}")
+            return
+        if stored:
+            # Backfilled replies fall between cached messages; reload the thread.
+            history_cache.invalidate((conversation.channel_id, conversation.thread_ts))
+
+    @staticmethod
+    async def _get_related_messages(conversation, history, text):
+        """
+        Looks up messages from other threads of the channel that are similar to
+        the new mentions. Retrieval problems never block the reply.
+        """
+        try:
+            ids = await retriever.search(
+                conversation.channel_id,
+                text,
+                limit=retriever.top_k * 2,
+                # Buffered messages have no primary key until they are written.
+                exclude=[message.pk for message in history if message.pk is not None]
             )
+            if not ids:
+                return []
+            found = {
+                message.pk: message async for message in Message.objects.filter(
+                    pk__in=ids
+                ).exclude(conversation=conversation)
+            }
+        except Exception as e:
+            logger.error(f"Error retrieving related messages: {str(e)}")
+            return []
+        related = [found[message_id] for message_id in ids if message_id in found][:retriever.top_k]
+        related.sort(key=lambda message: message.timestamp)
+        return related
 
     @staticmethod
-    @sync_to_async
-    def _mark_message_processed(conversation, message_id):
+    async def _index_messages(channel_id, messages):
         """
-        Marks a message as processed using a safe update operation.
+        Adds new messages to the channel's long-term memory index.
         """
-        with transaction.atomic():
-            Message.objects.filter(
-                conversation=conversation,
-                message_id=message_id
-            ).update(processed=True)
+        try:
+            if message_writes.enabled:
+                # Buffered messages get their primary keys when they are written.
+                await asyncio.wrap_future(message_writes.flushed())
+            await retriever.add(channel_id, messages)
+        except Exception as e:
+            logger.error(f"Error indexing messages: {str(e)}")
 
     @staticmethod
-    @sync_to_async
-    def _get_conversation_history(conversation):
+    async def _update_summary(conversation, older, team_id=None):
         """
-        Retrieves the last 5 messages from the conversation in chronological order.
+        Folds messages that no longer fit in the context window into the
+        conversation's rolling summary.
         """
-        messages = Message.objects.filter(
-            conversation=conversation
-        ).order_by('-timestamp')[:5]
-        
-        return list(reversed(messages))
+        pending = [
+            message for message in older
+            if conversation.summarized_until is None or message.timestamp > conversation.summarized_until
+        ]
+        if not pending:
+            return
+
+        async with llm_slot(team_id):
+            summary = await summarize(conversation.summary, pending)
+        if summary is None:
+            return
+
+        conversation.summary = summary
+        conversation.summarized_until = pending[-1].timestamp
+        await Conversation.objects.filter(pk=conversation.pk).aupdate(
+            summary=conversation.summary,
+            summarized_until=conversation.summarized_until
+        )
 
     @staticmethod
-    async def _get_llm_response(messages):
+    async def _get_llm_response(messages, team_id=None):
         """
-        Gets response from OpenAI's API.
+        Gets response from OpenAI's API, or from the response cache when the
+        same prompt was answered recently.
         """
+        route = llm_router.preferred(messages)
+        cache_key = SlackBot._cache_key(messages, team_id, route)
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        answered = []
         try:
-            response = await sync_to_async(client.chat.completions.create)(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500
-            )
-            return response.choices[0].message.content
+            async with llm_slot(team_id):
+                response = await llm_router.complete(
+                    messages, temperature=0.7, max_tokens=500, on_route=answered.append
+                )
+        except Exception as e:
+            return SlackBot._llm_error_message(e)
+
+        if cache_key and answered[-1] is route:
+            await response_cache.set(cache_key, response)
+        return response
+
+    @staticmethod
+    def _cache_key(messages, team_id, route):
+        """
+        Returns the response cache key for a prompt answered by `route`, or None
+        when caching is off for the workspace. Only answers from the route the
+        prompt prefers are cached; a hedge or fallback answer from another model
+        must not be served later as the preferred model's.
+        """
+        if not response_cache.enabled_for(team_id):
+            return None
+        return make_key(messages, route.name, 0.7, 500)
+
+    @staticmethod
+    async def _stream_llm_response(workspace_client, channel_id, thread_ts, messages, team_id=None):
+        """
+        Streams the response from OpenAI's API into a Slack thread message and
+        returns the final text. Cached responses are posted directly.
+        """
+        route = llm_router.preferred(messages)
+        cache_key = SlackBot._cache_key(messages, team_id, route)
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                await workspace_client.chat_postMessage(
+                    channel=channel_id,
+                    text=cached,
+                    thread_ts=thread_ts
+                )
+                return cached
+
+        writer = SlackStreamWriter(
+            workspace_client,
+            channel_id,
+            thread_ts,
+            interval=settings.SLACK_STREAM_UPDATE_INTERVAL,
+            min_chars=settings.SLACK_STREAM_MIN_CHARS
+        )
+        await writer.start()
 
+        answered = []
+        try:
+            async with llm_slot(team_id):
+                async for delta in llm_router.stream(messages, temperature=0.7, max_tokens=500,
+                                                     on_route=answered.append):
+                    await writer.append(delta)
         except Exception as e:
-            error_message = str(e)
-            logger.error(f"OpenAI API error: {error_message}")
-            
-            if "insufficient_quota" in error_message:
-                return "I apologize, but I'm currently unable to process requests due to API limitations. Please contact the system administrator to resolve this issue."
-            else:
-                return "I apologize, but I'm having trouble generating a response right now. Please try again."
+            error_message = SlackBot._llm_error_message(e)
+            return await writer.finish(f"{writer.text}\n\n{error_message}" if writer.text else error_message)
+
+        # An empty completion is replaced with an apology, which is not worth caching.
+        completed = bool(writer.text.strip())
+        response = await writer.finish()
+        if cache_key and completed and answered[-1] is route:
+            await response_cache.set(cache_key, response)
+        return response
+
+    @staticmethod
+    def _llm_error_message(e):
+        """
+        Logs an OpenAI API error and returns the apology shown to the user.
+        """
+        if isinstance(e, RateLimitTimeout):
+            logger.warning(f"LLM call not made: {str(e)}")
+            errors.inc(stage="rate_limit")
+            return BUSY_RETRY
+
+        error_message = str(e)
+        logger.error(f"OpenAI API error: {error_message}")
+        errors.inc(stage="openai")
+
+        if "insufficient_quota" in error_message:
+            return "I apologize, but I'm currently unable to process requests due to API limitations. Please contact the system administrator to resolve this issue."
+        else:
+            return "I apologize, but I'm having trouble generating a response right now. Please try again."
+
+async def _run_queued_mention(event):
+    """
+    Worker pool handler. With coalescing on, the queued event stands for its
+    thread's whole pending batch.
+    """
+    async with profile_mentions([event], "mention_pool"):
+        if coalescer.enabled:
+            outcome = await coalescer.run(thread_key(event), SlackBot.handle_mentions)
+        else:
+            outcome = await SlackBot.handle_mention(event, None)
+    if outcome == "deferred":
+        await defer_mention(event)
+
+async def defer_mention(event):
+    """
+    Queues a mention that admission control deferred on the worker pool, to be
+    tried again in ADMISSION_DEFER_INTERVAL seconds. The pool has its own loop,
+    so this outlives the request that deferred it. With coalescing on, the event
+    stands for its thread's batch, which stays open meanwhile. A mention that
+    cannot be queued is dropped with an apology.
+    """
+    if mention_pool.submit(event, delay=admission.defer_interval):
+        return
+    if coalescer.enabled:
+        coalescer.abandon(thread_key(event))
+    await SlackBot._shed(await workspace_clients.get_client(event["team"]), event)
+
+async def run_mention_jobs(events, last_attempt=True):
+    """
+    Job worker handler. A job can be a retry after a worker died mid-reply or
+    an attempt failed, so the user only hears about a failure on the last attempt.
+    """
+    async with profile_mentions(events, "mention_job"):
+        return await SlackBot.handle_mentions(events, resume=True, apologize=last_attempt)
 
-@slack_app.event("app_mention")
-async def handle_mention(event, say):
-    await SlackBot.handle_mention(event, say)
\ No newline at end of file
+mention_pool = MentionWorkerPool(
+    handler=_run_queued_mention,
+    workers=settings.MENTION_WORKERS,
+    max_queue_size=settings.MENTION_QUEUE_SIZE,
+    cleanup=close_loop_clients
+)
@@ -0,0 +1,91 @@
+import logging
+import time
+
+from aiohttp import ClientError
+from slack_sdk.errors import SlackApiError
+
+from .metrics import errors
+from .rate_limit import RateLimitTimeout
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = "_Thinking..._"
+
+
+class SlackStreamWriter:
+    """
+    Streams a reply into Slack by posting a placeholder message in the thread
+    and progressively editing it with chat.update.
+
+    Edits are coalesced: one is sent only when at least `interval` seconds have
+    passed since the previous edit and `min_chars` new characters have arrived,
+    which keeps a thread well below Slack's chat.update rate limit. A failed
+    intermediate edit is skipped (the next one carries its text); a failed
+    final edit raises. Slack rejects empty messages, so an empty reply is
+    replaced with `empty_text`.
+    """
+
+    def __init__(self, client, channel, thread_ts, interval=1.0, min_chars=20,
+                 placeholder=PLACEHOLDER,
+                 empty_text="I'm sorry, I couldn't come up with a response. Please try rephrasing your question."):
+        self.client = client
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.interval = interval
+        self.min_chars = min_chars
+        self.placeholder = placeholder
+        self.empty_text = empty_text
+        self.text = ""
+        self.message_ts = None
+        self._sent_text = ""
+        self._last_update = 0.0
+        self.updates = 0
+
+    async def start(self):
+        """
+        Posts the placeholder message that later edits replace.
+        """
+        response = await self.client.chat_postMessage(
+            channel=self.channel,
+            text=self.placeholder,
+            thread_ts=self.thread_ts
+        )
+        self.message_ts = response["ts"]
+        self._last_update = time.monotonic()
+
+    async def append(self, delta):
+        """
+        Adds streamed text and pushes an edit when the coalescing window allows it.
+        """
+        if not delta:
+            return
+        self.text += delta
+        now = time.monotonic()
+        if (now - self._last_update >= self.interval
+                and len(self.text) - len(self._sent_text) >= self.min_chars):
+            try:
+                await self._update(self.text, now)
+            except (SlackApiError, ClientError, RateLimitTimeout) as e:
+                logger.warning(f"Skipping streamed edit in {self.channel}: {e}")
+
+    async def finish(self, text=None):
+        """
+        Sends the final text, if it differs from the last edit, and returns it.
+        """
+        if text is not None:
+            self.text = text
+        if not self.text.strip():
+            self.text = self.empty_text
+        if self.message_ts and (self.text != self._sent_text or self.updates == 0):
+            await self._update(self.text, time.monotonic())
+        return self.text
+
+    async def _update(self, text, now):
+        try:
+            await self.client.chat_update(channel=self.channel, ts=self.message_ts, text=text)
+        except Exception:
+            errors.inc(stage="slack_update")
+            raise
+        self._sent_text = text
+        self._last_update = now
+        self.updates += 1
@@ -1,3 +1,1416 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import runpy
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from slack_sdk.web.async_client import AsyncWebClient
+
+from .admission import admission
+from .backfill import backfill_thread
+from .checks import check_database_pool, describe_database
+from .coalesce import ThreadCoalescer, thread_key
+from .bench.loadgen import build_report
+from .bench.replay import rebase_envelope
+from .bench.stubs import OpenAIStub, SlackStub, StubBehaviour, start_stub
+from .jobs import MentionJobWorker, claim_jobs
+from .management.commands.prune_conversations import Command as PruneCommand
+from .llm import llm_backend
+from .context import build_messages, pack_history
+from .dedup import seen_events
+from .history_cache import MESSAGE_OVERHEAD_BYTES, ThreadHistoryCache, history_cache
+from .models import Conversation, MentionJob, Message, WorkspaceToken
+from . import lifecycle, profiling
+from .profiling import PROFILE_MARK, profile_mentions
+from .retrieval import ChannelIndex, HashingEmbedder, MessageRetriever
+from .routing import LatencyTracker, LLMRouter, Route
+from .slack_bot import BUSY_FOLLOW_UP, DEFERRED_AT, SlackBot, mention_pool, run_mention_jobs
+from .streaming import SlackStreamWriter
+from .worker_pool import MentionWorkerPool
+from .write_buffer import MessageWriteBuffer, message_writes
+from .workspace_cache import WorkspaceClientCache, workspace_clients
+from .rate_limit import FairConcurrencyLimiter, RateLimiter, RateLimitTimeout, TokenBucket, slack_limiter
+
+
+class InternalEndpointTests(TestCase):
+    """
+    /metrics and /slack/queue_stats are only served with the metrics token.
+    """
+
+    @override_settings(METRICS_TOKEN="")
+    async def test_endpoints_are_off_without_a_token(self):
+        for path in ("/metrics", "/slack/queue_stats"):
+            response = await self.async_client.get(path, headers={"Authorization": "Bearer "})
+            self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_TOKEN="secret")
+    async def test_endpoints_require_the_token(self):
+        for path in ("/metrics", "/slack/queue_stats"):
+            self.assertEqual((await self.async_client.get(path)).status_code, 404)
+            response = await self.async_client.get(path, headers={"Authorization": "Bearer wrong"})
+            self.assertEqual(response.status_code, 404)
+            response = await self.async_client.get(path, headers={"Authorization": "Bearer secret"})
+            self.assertEqual(response.status_code, 200)
+
+
+class EventDedupTests(TestCase):
+    def setUp(self):
+        seen_events.discard("EvFailed")
+
+    def test_failed_event_is_not_remembered(self):
+        envelope = {
+            "type": "event_callback", "event_id": "EvFailed",
+            "event": {"type": "app_mention", "team": "T1", "channel": "C1", "user": "U1",
+                      "text": "hi", "ts": "1.000001", "event_ts": "1.000001"},
+        }
+        with mock.patch.object(SlackBot, "handle_mention", side_effect=RuntimeError("boom")) as handle, \
+                self.assertLogs("chat.views", "ERROR"):
+            response = self.client.post("/slack/events", envelope, content_type="application/json")
+            self.assertEqual(response.status_code, 500)
+            retry = self.client.post("/slack/events", envelope, content_type="application/json")
+            self.assertEqual(retry.status_code, 500)
+        self.assertEqual(handle.call_count, 2)
+
+
+class WorkerExitTests(SimpleTestCase):
+    def test_worker_exit_drains_queued_mentions(self):
+        handled = []
+
+        async def handler(event):
+            await asyncio.sleep(0.05)
+            handled.append(event["ts"])
+
+        pool = MentionWorkerPool(handler, workers=1)
+        pool.start()
+        for ts in ("1.1", "1.2", "1.3"):
+            self.assertTrue(pool.submit({"channel": "C1", "ts": ts}))
+
+        config = runpy.run_path(str(Path(settings.BASE_DIR) / "gunicorn.conf.py"))
+        with mock.patch("chat.slack_bot.mention_pool", pool):
+            config["worker_exit"](None, None)
+        self.assertEqual(handled, ["1.1", "1.2", "1.3"])
+
+
+class DescribeDatabaseTests(TestCase):
+    def test_in_memory_sqlite_is_described(self):
+        # The test database is in memory, where PRAGMA mmap_size returns no row.
+        self.assertRegex(describe_database(), r"^sqlite \(journal_mode=\w+, synchronous=\w+, mmap_size=off\)$")
+
+    def test_postgres_profile_reports_the_pool(self):
+        database = {"HOST": "db", "CONN_MAX_AGE": 0, "OPTIONS": {"pool": {"min_size": 2, "max_size": 10}}}
+        with override_settings(DATABASE_PROFILE="postgres"), \
+                mock.patch.dict(settings.DATABASES, {"default": database}):
+            self.assertEqual(describe_database(), "postgres at db (pool 2-10 connections)")
+            database["OPTIONS"] = {}
+            database["CONN_MAX_AGE"] = 600
+            self.assertEqual(describe_database(), "postgres at db (persistent connections, CONN_MAX_AGE=600)")
+
+
+class DatabasePoolCheckTests(SimpleTestCase):
+    def test_no_pool_needs_no_psycopg(self):
+        with mock.patch.dict(sys.modules, {"psycopg_pool": None}):
+            self.assertEqual(check_database_pool(None), [])
+
+    def test_pool_without_psycopg_pool_is_an_error(self):
+        pool = {"pool": {"min_size": 2, "max_size": 4, "timeout": 10}}
+        with mock.patch.dict(settings.DATABASES["default"]["OPTIONS"], pool), \
+                mock.patch.dict(sys.modules, {"psycopg_pool": None}):
+            errors = check_database_pool(None)
+        self.assertEqual([error.id for error in errors], ["chat.E002"])
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_paced_reservations(self):
+        bucket = TokenBucket(rate=2, burst=2)
+        now = bucket.updated
+        self.assertEqual(bucket.reserve(now), 0.0)
+        self.assertEqual(bucket.reserve(now), 0.0)
+        self.assertAlmostEqual(bucket.reserve(now), 0.5)
+        self.assertAlmostEqual(bucket.reserve(now), 1.0)
+
+    def test_reservation_over_max_wait_takes_no_token(self):
+        bucket = TokenBucket(rate=1, burst=1)
+        now = bucket.updated
+        bucket.reserve(now)
+        self.assertIsNone(bucket.reserve(now, max_wait=0.5))
+        self.assertAlmostEqual(bucket.reserve(now, max_wait=1.0), 1.0)
+
+    def test_block_delays_reservations(self):
+        bucket = TokenBucket(rate=10, burst=10)
+        now = bucket.updated
+        bucket.block(now + 3)
+        self.assertAlmostEqual(bucket.reserve(now), 3.0)
+        self.assertIsNone(bucket.reserve(now, max_wait=1))
+
+
+class RateLimiterTests(SimpleTestCase):
+    async def test_acquire_fails_fast_beyond_max_wait(self):
+        limiter = RateLimiter(max_wait=0.05)
+        await limiter.acquire("team", 1, 1)
+        with self.assertRaises(RateLimitTimeout):
+            await limiter.acquire("team", 1, 1)
+        self.assertEqual(limiter.timed_out, 1)
+        # Other keys have their own buckets.
+        await limiter.acquire("other", 1, 1)
+
+    async def test_acquire_can_refuse_to_wait(self):
+        limiter = RateLimiter(max_wait=10)
+        await limiter.acquire("team", 20, 1)
+        with self.assertRaises(RateLimitTimeout):
+            await limiter.acquire("team", 20, 1, max_wait=0)
+        await limiter.acquire("team", 20, 1)
+        self.assertEqual(limiter.throttled, 1)
+
+    async def test_acquire_waits_within_max_wait(self):
+        limiter = RateLimiter(max_wait=1)
+        await limiter.acquire("team", 20, 1)
+        await limiter.acquire("team", 20, 1)
+        self.assertEqual(limiter.throttled, 1)
+
+    def test_idle_buckets_are_evicted(self):
+        limiter = RateLimiter(max_buckets=2)
+        for key in ("a", "b", "c"):
+            limiter._bucket(key, 1, 1)
+        self.assertEqual(list(limiter._buckets), ["b", "c"])
+
+
+class FairConcurrencyLimiterTests(SimpleTestCase):
+    async def test_slots_are_shared_round_robin(self):
+        limiter = FairConcurrencyLimiter(1)
+        await limiter.acquire("busy")
+        order = []
+
+        async def call(team):
+            await limiter.acquire(team)
+            order.append(team)
+            limiter.release()
+
+        tasks = [asyncio.create_task(call(team)) for team in ("busy", "busy", "busy", "quiet")]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, ["busy", "quiet", "busy", "busy"])
+        self.assertEqual(limiter.stats(), {"in_flight": 0, "waiting": {}})
+
+    async def test_cancelled_waiter_does_not_leak_its_slot(self):
+        limiter = FairConcurrencyLimiter(1)
+        await limiter.acquire("a")
+        waiter = asyncio.create_task(limiter.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        limiter.release()
+        self.assertEqual(limiter.stats(), {"in_flight": 0, "waiting": {}})
+        await asyncio.wait_for(limiter.acquire("c"), 1)
+
+
+class FakeBackend:
+    """
+    Answers with a fixed reply after `latency` seconds, or raises `error`.
+    """
+
+    def __init__(self, name, latency=0.0, error=None):
+        self.base_url = name
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def complete(self, messages, model=None, temperature=0.7, max_tokens=500):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return f"reply from {self.base_url}"
+
+    async def stream(self, messages, model=None, temperature=0.7, max_tokens=500):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        for word in ("reply", "from", self.base_url):
+            yield word + " "
+
+
+class LLMRouterTests(SimpleTestCase):
+    messages = [{"role": "user", "content": "hello"}]
+
+    def router(self, primary, fallback=None, **kwargs):
+        return LLMRouter(
+            Route(primary, "primary"),
+            fallback=Route(fallback, "fallback") if fallback else None,
+            tracker=LatencyTracker(min_samples=1),
+            **kwargs
+        )
+
+    async def test_slow_call_is_hedged_and_the_faster_route_wins(self):
+        primary, fallback = FakeBackend("primary", latency=1.0), FakeBackend("fallback")
+        router = self.router(primary, fallback, hedge_percentile=95, hedge_min_delay=0.01)
+        router.tracker.observe(router.primary.name, 0.01)
+        answered = []
+        reply = await router.complete(self.messages, on_route=answered.append)
+        self.assertEqual(reply, "reply from fallback")
+        self.assertEqual(answered, [router.fallback])
+        await asyncio.sleep(0)
+        self.assertEqual(primary.cancelled, 1)
+
+    async def test_no_hedge_until_latency_is_known(self):
+        primary, fallback = FakeBackend("primary", latency=0.05), FakeBackend("fallback")
+        router = self.router(primary, fallback, hedge_percentile=95, hedge_min_delay=0.01)
+        self.assertEqual(await router.complete(self.messages), "reply from primary")
+        self.assertEqual(fallback.calls, 0)
+
+    async def test_failed_call_falls_back(self):
+        primary, fallback = FakeBackend("primary", error=RuntimeError("down")), FakeBackend("fallback")
+        router = self.router(primary, fallback)
+        answered = []
+        with self.assertLogs("chat.routing", "WARNING"):
+            reply = await router.complete(self.messages, on_route=answered.append)
+        self.assertEqual(reply, "reply from fallback")
+        self.assertEqual(answered, [router.fallback])
+        self.assertEqual(router.tracker.error_rate(router.primary.name), 1.0)
+
+    async def test_error_is_raised_when_every_route_fails(self):
+        error = RuntimeError("down")
+        router = self.router(FakeBackend("primary", error=error), FakeBackend("fallback", error=error))
+        with self.assertLogs("chat.routing", "WARNING"), self.assertRaises(RuntimeError):
+            await router.complete(self.messages)
+
+    async def test_unhealthy_primary_is_skipped(self):
+        primary, fallback = FakeBackend("primary"), FakeBackend("fallback")
+        router = self.router(primary, fallback)
+        router.tracker.observe(router.primary.name)
+        self.assertEqual(await router.complete(self.messages), "reply from fallback")
+        self.assertEqual(primary.calls, 0)
+        # Replies are cached only when the preferred route answered.
+        self.assertIs(router.preferred(self.messages), router.primary)
+
+    def test_short_prompts_prefer_the_small_route(self):
+        router = self.router(FakeBackend("primary"), small=Route(FakeBackend("small"), "small"),
+                             small_prompt_tokens=10)
+        self.assertIs(router.preferred(self.messages), router.small)
+        long_prompt = [{"role": "user", "content": "hello " * 50}]
+        self.assertIs(router.preferred(long_prompt), router.primary)
+
+    async def test_failed_stream_falls_back_before_the_first_delta(self):
+        primary, fallback = FakeBackend("primary", error=RuntimeError("down")), FakeBackend("fallback")
+        router = self.router(primary, fallback)
+        answered = []
+        with self.assertLogs("chat.routing", "WARNING"):
+            deltas = [delta async for delta in router.stream(self.messages, on_route=answered.append)]
+        self.assertEqual("".join(deltas), "reply from fallback ")
+        self.assertEqual(answered, [router.fallback])
+
+
+class MentionJobWorkerTests(TestCase):
+    def setUp(self):
+        self.jobs = [
+            MentionJob.objects.create(
+                team_id="T1", channel_id="C1", thread_ts="1.0",
+                event={"team": "T1", "channel": "C1", "ts": ts, "event_ts": ts, "user": "U1", "text": "hi"}
+            )
+            for ts in ("1.0", "2.0")
+        ]
+
+    async def _run_once(self, handler, max_attempts=3):
+        worker = MentionJobWorker(handler, retry_delay=60, max_attempts=max_attempts)
+        jobs = await sync_to_async(claim_jobs)(worker.owner, 10, max_attempts=max_attempts)
+        await worker._process(jobs)
+        return worker
+
+    async def test_answered_jobs_are_deleted(self):
+        calls = []
+
+        async def handler(events, last_attempt):
+            calls.append((len(events), last_attempt))
+            return "ok"
+
+        worker = await self._run_once(handler)
+        self.assertEqual(calls, [(2, False)])
+        self.assertEqual(worker.processed, 2)
+        self.assertFalse(await MentionJob.objects.aexists())
+
+    async def test_failed_jobs_are_kept_for_a_retry(self):
+        async def failing(events, last_attempt):
+            return "error"
+
+        async def raising(events, last_attempt):
+            raise RuntimeError("boom")
+
+        for handler in (failing, raising):
+            with self.assertLogs("chat.jobs", "WARNING"):
+                await self._run_once(handler)
+            jobs = [job async for job in MentionJob.objects.all()]
+            self.assertEqual(len(jobs), 2)
+            for job in jobs:
+                self.assertIsNone(job.leased_until)
+                self.assertGreater(job.available_at, timezone.now())
+            await MentionJob.objects.aupdate(available_at=timezone.now())
+
+    async def test_last_attempt_is_reported_and_then_failed(self):
+        seen = []
+
+        async def failing(events, last_attempt):
+            seen.append(last_attempt)
+            return "error"
+
+        with self.assertLogs("chat.jobs", "WARNING"):
+            for _ in range(2):
+                await self._run_once(failing, max_attempts=2)
+                await MentionJob.objects.aupdate(available_at=timezone.now())
+            self.assertEqual(await sync_to_async(claim_jobs)("w", 10, max_attempts=2), [])
+        self.assertEqual(seen, [False, True])
+        self.assertEqual(await MentionJob.objects.filter(failed=True).acount(), 2)
+
+    def test_threads_with_a_live_lease_are_skipped(self):
+        MentionJob.objects.create(
+            team_id="T1", channel_id="C2", thread_ts="5.0", event={}
+        )
+        first = claim_jobs("a", 1)
+        self.assertEqual([job.pk for job in first], [self.jobs[0].pk])
+        second = claim_jobs("b", 10)
+        self.assertEqual([job.channel_id for job in second], ["C2"])
+
+
+class StubServers:
+    """
+    Runs the bench Slack and OpenAI stubs on a thread of their own, so they
+    keep serving while a test blocks or runs on other event loops.
+    """
+
+    def __init__(self, openai_latency=0.0):
+        self.slack = SlackStub(StubBehaviour())
+        self.openai = OpenAIStub(StubBehaviour(latency=openai_latency), reply_tokens=5)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._runners = self._call(self._start())
+        slack_port, openai_port = (runner.addresses[0][1] for runner in self._runners)
+        self.slack_url = f"http://127.0.0.1:{slack_port}/api/"
+        self.openai_url = f"http://127.0.0.1:{openai_port}/v1"
+        return self
+
+    def stop(self):
+        for runner in self._runners:
+            self._call(runner.cleanup())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def posted(self, channel, thread_ts):
+        return [message["text"] for message in self.slack.threads.get((channel, thread_ts), [])]
+
+    async def _start(self):
+        return [
+            await start_stub(self.slack.app(), "127.0.0.1", 0),
+            await start_stub(self.openai.app(), "127.0.0.1", 0),
+        ]
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(10)
+
+
+class BenchReportTests(SimpleTestCase):
+    def test_streamed_reply_is_timed_to_its_final_edit(self):
+        stubs = StubServers().start()
+        self.addCleanup(stubs.stop)
+        stubs.slack.reply_text = stubs.openai.reply_text
+
+        async def stream():
+            client = AsyncWebClient(token="xoxb-test", base_url=stubs.slack_url)
+            writer = SlackStreamWriter(client, "C1", "1.000001", interval=0, min_chars=1)
+            await writer.start()
+            times = {"placeholder": time.monotonic()}
+            for word in stubs.openai.reply_text.split(" "):
+                await asyncio.sleep(0.01)
+                await writer.append(word if not writer.text else f" {word}")
+                times.setdefault("first_edit", time.monotonic())
+            await writer.finish()
+            times["finished"] = time.monotonic()
+            return times
+
+        sent = time.monotonic()
+        times = asyncio.run(stream())
+        generator = SimpleNamespace(
+            sent_at={"1.000001": sent, "2.000001": sent}, ack_latencies=[0.01], statuses={200: 1}
+        )
+        report = build_report(generator, 1.0, stubs.slack.replied_at, stubs.slack.first_token_at)
+
+        self.assertEqual(report["threads_answered"], 1)
+        first_token = report["first_token_latency"]["p50"]
+        reply = report["reply_latency"]["p50"]
+        self.assertGreater(first_token, times["placeholder"] - sent)
+        self.assertLessEqual(first_token, times["first_edit"] - sent)
+        self.assertGreater(reply, first_token + 0.03)
+        self.assertLessEqual(reply, times["finished"] - sent)
+
+
+class RebaseEnvelopeTests(SimpleTestCase):
+    def envelope(self, ts, thread_ts):
+        return json.dumps({
+            "type": "event_callback", "event_id": "Ev1",
+            "event": {"type": "app_mention", "ts": ts, "event_ts": ts, "thread_ts": thread_ts},
+        })
+
+    def test_timestamps_are_shifted_without_losing_microseconds(self):
+        envelope = rebase_envelope(self.envelope("8962158056.263804", "8962158056.000001"), "605944165.678462", "r1")
+        event = envelope["event"]
+        # Adding these as floats gives 9568102221.942265.
+        self.assertEqual(event["ts"], "9568102221.942266")
+        self.assertEqual(event["event_ts"], "9568102221.942266")
+        self.assertEqual(event["thread_ts"], "9568102221.678463")
+        self.assertEqual(envelope["event_id"], "Ev1-r1")
+
+    def test_retries_of_an_event_share_the_rebased_id(self):
+        body = self.envelope("1700000000.000001", "1700000000.000001")
+        first, retry = (rebase_envelope(body, 10.5, "r2") for _ in range(2))
+        self.assertEqual(first, retry)
+        self.assertEqual(first["event"]["ts"], "1700000010.500001")
+
+
+class StubTestMixin:
+    """
+    Points the Slack and OpenAI clients at the stubs and installs team T1.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.stubs = StubServers().start()
+        self.addCleanup(self.stubs.stop)
+        overridden = override_settings(SLACK_API_URL=self.stubs.slack_url)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        for patcher in (
+            mock.patch.object(llm_backend, "api_key", "sk-test"),
+            mock.patch.object(llm_backend, "base_url", self.stubs.openai_url),
+            mock.patch.object(llm_backend, "max_retries", 0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        WorkspaceToken.objects.create(team_id="T1", bot_token="xoxb-test")
+        workspace_clients.invalidate("T1")
+        self.addCleanup(workspace_clients.invalidate, "T1")
+
+    def mention(self, ts, text="<@UBOT> hello", thread_ts=None, channel="C1"):
+        event = {"type": "app_mention", "team": "T1", "channel": channel, "user": "U1",
+                 "text": text, "ts": ts, "event_ts": ts}
+        if thread_ts:
+            event["thread_ts"] = thread_ts
+        return event
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timed out waiting for the condition")
+            time.sleep(0.02)
+
+    def overload(self):
+        """
+        Makes admission control turn every mention away until the returned
+        function is called.
+        """
+        patchers = [
+            mock.patch.object(admission, "max_in_flight", 1),
+            mock.patch.object(admission, "in_flight", 1),
+            mock.patch.object(admission, "defer_interval", 0.05),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        def recover():
+            admission.in_flight = 0
+        return recover
+
+
+class DeferredMentionTests(StubTestMixin, TransactionTestCase):
+    def tearDown(self):
+        mention_pool.stop()
+        super().tearDown()
+
+    def test_inline_deferral_is_answered_after_the_request(self):
+        recover = self.overload()
+        now = f"{time.time():.6f}"
+        response = self.client.post(
+            "/slack/events",
+            {"type": "event_callback", "event_id": f"Ev{now}", "event": self.mention(now)},
+            content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stubs.posted("C1", now), [BUSY_FOLLOW_UP])
+        self.assertEqual(self.stubs.openai.calls, 0)
+
+        # Each test client request runs on its own event loop, which is gone by now.
+        recover()
+        self.wait_for(lambda: len(self.stubs.posted("C1", now)) == 2)
+        self.assertEqual(self.stubs.posted("C1", now)[1], "token0 token1 token2 token3 token4")
+        self.wait_for(lambda: Message.objects.filter(message_id=f"slack_{now}", processed=True).exists())
+
+    def test_deferral_gives_up_after_the_timeout(self):
+        self.overload()
+        now = f"{time.time():.6f}"
+        with mock.patch.object(admission, "defer_timeout", 0.2):
+            self.client.post(
+                "/slack/events",
+                {"type": "event_callback", "event_id": f"Ev{now}", "event": self.mention(now)},
+                content_type="application/json"
+            )
+            with self.assertLogs("chat.slack_bot", "WARNING"):
+                self.wait_for(lambda: len(self.stubs.posted("C1", now)) == 2)
+        self.assertEqual(self.stubs.openai.calls, 0)
+        self.assertFalse(Message.objects.filter(message_id=f"slack_{now}").exists())
+
+    def test_deferred_job_is_rescheduled_not_deleted(self):
+        recover = self.overload()
+        now = f"{time.time():.6f}"
+        event = self.mention(now)
+        MentionJob.objects.create(team_id="T1", channel_id="C1", thread_ts=now, event=event)
+        worker = MentionJobWorker(run_mention_jobs, defer_delay=0)
+
+        async def process():
+            jobs = await sync_to_async(claim_jobs)(worker.owner, 10)
+            await worker._process(jobs)
+            await workspace_clients.aclose()
+            await llm_backend.aclose()
+
+        asyncio.run(process())
+        job = MentionJob.objects.get()
+        self.assertEqual(job.attempts, 0)
+        self.assertIsNone(job.leased_until)
+        self.assertIn(DEFERRED_AT, job.event)
+        self.assertEqual(self.stubs.posted("C1", now), [BUSY_FOLLOW_UP])
+
+        recover()
+        asyncio.run(process())
+        self.assertFalse(MentionJob.objects.exists())
+        self.assertEqual(len(self.stubs.posted("C1", now)), 2)
+
+
+class ChannelIndexTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "C1.vec"
+
+    def vectors(self, ids, dim=4):
+        # Vector i points along axis i % dim, so each id matches exactly one axis.
+        vectors = [[0.0] * dim for _ in ids]
+        for row, message_id in enumerate(ids):
+            vectors[row][message_id % dim] = 2.0
+        return vectors
+
+    def test_search_returns_the_best_matches_first(self):
+        import numpy
+
+        index = ChannelIndex(self.path, 4)
+        index.add([1, 2, 3], self.vectors([1, 2, 3]))
+        query = numpy.array([0.0, 1.0, 0.5, 0.0], dtype=numpy.float32)
+        hits = index.search(query, k=2)
+        self.assertEqual([message_id for message_id, score in hits], [1, 2])
+        self.assertAlmostEqual(hits[0][1], 2 / 5 ** 0.5, places=5)
+        self.assertEqual([message_id for message_id, score in index.search(query, k=2, exclude=[1])], [2, 3])
+
+    def test_compaction_keeps_the_newest_vectors(self):
+        index = ChannelIndex(self.path, 4, max_vectors=4)
+        for message_id in range(1, 7):
+            index.add([message_id], self.vectors([message_id]))
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.missing(range(1, 8)), [1, 2, 7])
+
+    def test_indexes_sharing_a_file_append_and_compact_in_turn(self):
+        # Separate instances stand in for separate processes: only the file lock is shared.
+        indexes = [ChannelIndex(self.path, 4, max_vectors=50) for _ in range(4)]
+
+        def append(index, offset):
+            for n in range(100):
+                message_id = offset + n
+                index.add([message_id], self.vectors([message_id]))
+
+        threads = [threading.Thread(target=append, args=(index, n * 1000)) for n, index in enumerate(indexes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.path.stat().st_size % indexes[0].dtype.itemsize, 0)
+        self.assertLessEqual(len(indexes[0]), 50 * 1.25)
+
+
+class IndexMessagesCommandTests(TransactionTestCase):
+    def test_indexes_only_the_messages_missing_from_the_index(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        retriever = MessageRetriever(HashingEmbedder(), directory.name)
+        conversation = Conversation.objects.create(channel_id="C1", thread_ts="1.000001")
+        messages = [
+            Message.objects.create(
+                conversation=conversation, content=f"message {n}", user_id="U1",
+                message_id=f"slack_1.00000{n}", timestamp=timezone.now()
+            )
+            for n in range(5)
+        ]
+        asyncio.run(retriever.add("C1", messages[1:3]))
+
+        output = mock.Mock()
+        with mock.patch("chat.management.commands.index_messages.retriever", retriever), \
+                mock.patch.object(ChannelIndex, "BLOCK", 2):
+            call_command("index_messages", stdout=output)
+
+        self.assertIn("C1: 3 messages indexed", str(output.write.call_args_list))
+        index = retriever.index("C1")
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.missing([message.pk for message in messages]), [])
+
+
+class BufferedRetrievalTests(StubTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.retriever = MessageRetriever(HashingEmbedder(), directory.name, min_score=0.0)
+        for patcher in (
+            mock.patch("chat.slack_bot.retriever", self.retriever),
+            mock.patch.object(message_writes, "interval", 0.01),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(message_writes.stop)
+
+    def test_buffered_history_is_excluded_from_retrieval(self):
+        other = Conversation.objects.create(channel_id="C1", thread_ts="100.000001")
+        earlier = Message.objects.create(
+            conversation=other, content="The billing service deploys on Fridays", user_id="U2",
+            message_id="slack_100.000001", processed=True, timestamp=timezone.now()
+        )
+        asyncio.run(self.retriever.add("C1", [earlier]))
+
+        now = f"{time.time():.6f}"
+        with mock.patch("chat.slack_bot.build_messages", wraps=build_messages) as build, \
+                self.assertNoLogs("chat.slack_bot", "ERROR"):
+            outcome = asyncio.run(self._handle([self.mention(now, "<@UBOT> when does billing deploy?")]))
+
+        self.assertEqual(outcome, "ok")
+        related = build.call_args.args[3]
+        self.assertEqual([message.pk for message in related], [earlier.pk])
+        self.wait_for(lambda: Message.objects.filter(message_id=f"slack_{now}", processed=True).exists())
+
+    async def _handle(self, events):
+        try:
+            return await SlackBot.handle_mentions(events)
+        finally:
+            await workspace_clients.aclose()
+            await llm_backend.aclose()
+
+
+class MessageWriteBufferTests(TransactionTestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(channel_id="C1", thread_ts="1.0")
+        self.buffer = MessageWriteBuffer(interval=60, max_attempts=2)
+        self.addCleanup(self.buffer.stop)
+
+    def message(self, message_id, content="hello"):
+        return Message(
+            conversation=self.conversation, content=content, user_id="U1",
+            message_id=message_id, timestamp=timezone.now()
+        )
+
+    def test_failing_batch_is_written_row_by_row_after_retries(self):
+        for message in (self.message("a"), self.message("b", content=None), self.message("c")):
+            self.buffer.add(message)
+        self.buffer.mark_processed(["a"])
+
+        failing = mock.patch.object(Message.objects, "bulk_create", side_effect=DatabaseError("disk I/O error"))
+        with failing, self.assertLogs("chat.write_buffer", "ERROR") as logs:
+            self.buffer.flush()
+            self.assertFalse(self.buffer.flushed().done())
+            self.assertEqual(self.buffer.stats()["buffered"], 3)
+            self.buffer.flush()
+
+        self.assertIn("Dropping buffered message b", "\n".join(logs.output))
+        self.assertEqual(
+            sorted(Message.objects.values_list("message_id", "processed")), [("a", True), ("c", False)]
+        )
+        self.assertEqual(self.buffer.stats()["buffered"], 0)
+        self.assertEqual(self.buffer.dropped, 1)
+        self.assertFalse(self.buffer.contains("b"))
+
+    def test_add_refuses_a_message_that_is_already_buffered(self):
+        self.assertTrue(self.buffer.add(self.message("a")))
+        self.assertFalse(self.buffer.add(self.message("a", content="again")))
+        self.assertEqual(self.buffer.stats()["buffered"], 1)
+        self.buffer.flush()
+        self.assertEqual(list(Message.objects.values_list("content", flat=True)), ["hello"])
+
+    def test_concurrent_store_of_the_same_mention_buffers_it_once(self):
+        async def store_twice():
+            return await asyncio.gather(*(
+                SlackBot._store_message(self.conversation, "hello", "U1", message_id="slack_9.000001")
+                for _ in range(2)
+            ))
+
+        with mock.patch("chat.slack_bot.message_writes", self.buffer):
+            results = asyncio.run(store_twice())
+        self.assertEqual(sorted(results), [False, True])
+        self.assertEqual(self.buffer.stats()["buffered"], 1)
+
+    def test_duplicates_are_skipped_when_writing_row_by_row(self):
+        Message.objects.create(
+            conversation=self.conversation, content="hello", user_id="U1", message_id="a", timestamp=timezone.now()
+        )
+        self.buffer.add(self.message("a"))
+        with mock.patch.object(Message.objects, "bulk_create", side_effect=DatabaseError("locked")), \
+                self.assertLogs("chat.write_buffer", "ERROR"):
+            self.buffer.flush()
+            self.buffer.flush()
+        self.assertEqual(self.buffer.dropped, 0)
+        self.assertEqual(Message.objects.count(), 1)
+
+
+def busy_elsewhere(seconds):
+    time.sleep(seconds)
+
+
+def wait_for_profiles(directory, pattern, timeout=2.0):
+    # Profiles are written by the sampler thread after the session closes.
+    deadline = time.monotonic() + timeout
+    while True:
+        profiles = list(directory.glob(pattern))
+        if profiles or time.monotonic() > deadline:
+            return profiles
+        time.sleep(0.01)
+
+
+class StackSamplerTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.sampler = profiling.StackSampler(directory.name, interval=0.002)
+        self.addCleanup(self.sampler.totals.clear)
+
+    def test_stop_leaves_the_file_to_the_sampler_thread(self):
+        writers = []
+
+        def write_folded(path, samples):
+            writers.append(threading.current_thread().name)
+            original(path, samples)
+
+        original = profiling._write_folded
+        session = self.sampler.start("owner")
+        time.sleep(0.02)
+        with mock.patch("chat.profiling._write_folded", write_folded):
+            name = self.sampler.stop(session)
+            profiles = wait_for_profiles(self.directory / "requests", name)
+        self.assertEqual([profile.name for profile in profiles], [name])
+        self.assertEqual(set(writers), {"stack-sampler"})
+
+    def test_other_threads_are_not_attributed(self):
+        other = threading.Thread(target=busy_elsewhere, args=(0.2,), name="neighbour")
+        other.start()
+        session = self.sampler.start("owner")
+        time.sleep(0.1)
+        self.sampler.stop(session)
+        other.join()
+        stacks = list(session.samples)
+        self.assertIn("other;neighbour", stacks)
+        self.assertFalse(any("busy_elsewhere" in stack for stack in stacks))
+        self.assertTrue(any(stack.startswith("MainThread;") and "test_other_threads" in stack for stack in stacks))
+
+    def test_only_the_owning_task_is_recorded(self):
+        async def owner():
+            session = self.sampler.start("owner")
+            await asyncio.sleep(0.1)
+            self.sampler.stop(session)
+            return session
+
+        async def neighbour():
+            await asyncio.sleep(0.01)
+            busy_elsewhere(0.05)
+
+        async def main():
+            session, _ = await asyncio.gather(owner(), neighbour())
+            return session
+
+        stacks = list(asyncio.run(main()).samples)
+        self.assertIn("MainThread;chat.tests:owner;asyncio.tasks:sleep", stacks)
+        self.assertIn("other;MainThread", stacks)
+        self.assertFalse(any("busy_elsewhere" in stack for stack in stacks))
+
+
+class QueuedProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = mock.patch("chat.profiling._shared_sampler", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The sampler writes its totals at exit; the directory is gone by then.
+        self.addCleanup(lambda: profiling._shared_sampler and profiling._shared_sampler.totals.clear())
+
+    def test_profiled_request_profiles_its_queued_mention(self):
+        event = {"type": "app_mention", "team": "T1", "channel": "C1", "user": "U1",
+                 "text": "hi", "ts": "7.000001", "event_ts": "7.000001"}
+        with override_settings(PROFILE_TOKEN="secret", PROFILE_DIR=self.directory, SLACK_EVENT_MODE="queue"), \
+                mock.patch.object(mention_pool, "submit", return_value=True) as submit:
+            response = self.client.post(
+                "/slack/events", {"type": "event_callback", "event_id": "EvProfiled", "event": event},
+                content_type="application/json", headers={"X-Profile-Token": "secret"}
+            )
+            self.assertIn("X-Profile-Id", response)
+            queued = submit.call_args.args[0]
+            self.assertTrue(queued[PROFILE_MARK])
+
+            async def handle():
+                async with profile_mentions([queued], "mention_pool"):
+                    await asyncio.sleep(0.02)
+
+            with self.assertLogs("chat.profiling", "INFO") as logs:
+                asyncio.run(handle())
+        self.assertIn("mention_pool", logs.output[0])
+        profiles = wait_for_profiles(Path(self.directory) / "requests", "*mention_pool.folded")
+        self.assertEqual(len(profiles), 1)
+
+
+class ThreadHistoryCacheTests(SimpleTestCase):
+    def message(self, pk, content="x" * 100):
+        return SimpleNamespace(pk=pk, content=content)
+
+    def test_least_recently_used_thread_is_evicted_over_the_byte_budget(self):
+        per_thread = 2 * (100 + MESSAGE_OVERHEAD_BYTES)
+        cache = ThreadHistoryCache(max_bytes=2 * per_thread)
+        for key in ("a", "b"):
+            cache.put(key, [self.message(1), self.message(2)])
+        cache.get("a", 10)
+        cache.put("c", [self.message(1), self.message(2)])
+        self.assertIsNone(cache.get("b", 10))
+        self.assertEqual(len(cache.get("a", 10)), 2)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.stats()["bytes"], 2 * per_thread)
+
+    def test_threads_expire_after_the_ttl(self):
+        cache = ThreadHistoryCache(ttl=60)
+        cache.put("a", [self.message(1)])
+        with mock.patch("chat.history_cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get("a", 10))
+        self.assertEqual(cache.stats()["threads"], 0)
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_append_keeps_the_newest_messages_and_their_size(self):
+        cache = ThreadHistoryCache(max_messages=2)
+        cache.put("a", [self.message(1), self.message(2)])
+        cache.append("a", self.message(3, content="y"))
+        self.assertEqual([message.pk for message in cache.get("a", 10)], [2, 3])
+        self.assertEqual(cache.stats()["bytes"], 100 + 1 + 2 * MESSAGE_OVERHEAD_BYTES)
+        cache.append("uncached", self.message(4))
+        self.assertIsNone(cache.get("uncached", 10))
+
+
+class HistoryCacheVersionTests(TestCase):
+    def setUp(self):
+        history_cache.clear()
+        self.addCleanup(history_cache.clear)
+
+    async def test_writes_by_other_processes_reload_the_thread(self):
+        conversation = await Conversation.objects.acreate(channel_id="C1", thread_ts="800.000001")
+        await SlackBot._store_message(conversation, "first", "U1", message_id="slack_800.000001")
+        self.assertEqual([m.content for m in await SlackBot._get_conversation_history(conversation)], ["first"])
+
+        # Written through this process: served from the cache.
+        await SlackBot._store_message(conversation, "second", "U1", message_id="slack_800.000002")
+        hits = history_cache.hits
+        history = await SlackBot._get_conversation_history(conversation)
+        self.assertEqual([m.content for m in history], ["first", "second"])
+        self.assertEqual(history_cache.hits, hits + 1)
+
+        # Written by another process: the cached copy is stale.
+        await Message.objects.acreate(
+            conversation=conversation, content="third", user_id="U2", message_id="slack_800.000003"
+        )
+        history = await SlackBot._get_conversation_history(conversation)
+        self.assertEqual([m.content for m in history], ["first", "second", "third"])
+        self.assertEqual(history_cache.stale, 1)
+
+
+class RepliesClient:
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def conversations_replies(self, **kwargs):
+        return {"ok": True, "messages": self.messages, "has_more": False}
+
+
+class BackfillThreadTests(TestCase):
+    async def test_counts_only_inserted_replies(self):
+        conversation = await Conversation.objects.acreate(channel_id="C1", thread_ts="700.000001")
+        await Message.objects.acreate(
+            conversation=conversation, content="We deploy on Fridays", user_id="U2",
+            message_id="slack_700.000001", processed=True
+        )
+        client = RepliesClient([
+            {"type": "message", "ts": "700.000001", "user": "U2", "text": "We deploy on Fridays"},
+            {"type": "message", "ts": "700.000002", "user": "U3", "text": "Ask <@U2> first"},
+            {"type": "message", "ts": "700.000003", "user": "U1", "text": "<@UBOT> is that right?"},
+        ])
+
+        self.assertEqual(await backfill_thread(client, conversation, "700.000003", "UBOT"), 1)
+        self.assertEqual(conversation.replies_cursor, "700.000003")
+        self.assertEqual(await backfill_thread(client, conversation, "700.000003", "UBOT"), 0)
+        self.assertEqual(await Message.objects.acount(), 2)
+
+
+@override_settings(SLACK_BACKFILL=True)
+class BackfillTests(StubTestMixin, TransactionTestCase):
+    def test_backfill_leaves_unanswered_mentions_to_their_events(self):
+        thread = "500.000001"
+        earlier_mention = self.mention("500.000003", "<@UBOT> and what about staging?", thread)
+        current = self.mention("500.000004", "<@UBOT> summarize this for <@U2>", thread)
+        self.stubs.slack.threads[("C1", thread)] = [
+            {"type": "message", "ts": thread, "user": "U2", "text": "We deploy on Fridays"},
+            {"type": "message", "ts": "500.000002", "user": "U3", "text": "Only after <@U2> approves"},
+            {"type": "message", "ts": "500.000003", "user": "U1", "text": earlier_mention["text"]},
+            {"type": "message", "ts": "500.000004", "user": "U1", "text": current["text"]},
+        ]
+
+        async def handle(events):
+            try:
+                return await SlackBot.handle_mentions(events)
+            finally:
+                await workspace_clients.aclose()
+                await llm_backend.aclose()
+
+        self.assertEqual(asyncio.run(handle([current])), "ok")
+        conversation = Conversation.objects.get(channel_id="C1", thread_ts=thread)
+        self.assertEqual(conversation.replies_cursor, "500.000004")
+        self.assertEqual(
+            sorted(Message.objects.filter(is_bot=False).values_list("message_id", "processed")),
+            [("slack_500.000001", True), ("slack_500.000002", True), ("slack_500.000004", True)]
+        )
+
+        # The earlier mention's event arrives late and is still answered.
+        self.assertEqual(asyncio.run(handle([earlier_mention])), "ok")
+        self.assertTrue(Message.objects.get(message_id="slack_500.000003").processed)
+        self.assertEqual(self.stubs.slack.calls["auth.test"], 1)
+        self.assertEqual(self.stubs.openai.calls, 2)
+
+    def test_rate_limited_backfill_does_not_delay_the_reply(self):
+        thread = "600.000001"
+        self.stubs.slack.threads[("C1", thread)] = [
+            {"type": "message", "ts": thread, "user": "U2", "text": "We deploy on Fridays"},
+        ]
+        workspace_clients.set_bot_user_id("T1", "UBOT")
+        buckets = mock.patch.object(slack_limiter, "_buckets", OrderedDict())
+        buckets.start()
+        self.addCleanup(buckets.stop)
+        slack_limiter._bucket(("T1", "conversations.replies"), 0.01, 1).block(time.monotonic() + 60)
+
+        async def handle(events):
+            try:
+                return await SlackBot.handle_mentions(events)
+            finally:
+                await workspace_clients.aclose()
+                await llm_backend.aclose()
+
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(handle([self.mention("600.000002", "<@UBOT> hi", thread)])), "ok")
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(self.stubs.slack.calls["conversations.replies"], 0)
+        self.assertFalse(Conversation.objects.get(thread_ts=thread).replies_cursor)
+
+        # Once the limit clears, the next mention catches up from the cursor.
+        slack_limiter._buckets.clear()
+        self.assertEqual(asyncio.run(handle([self.mention("600.000003", "<@UBOT> again", thread)])), "ok")
+        self.assertTrue(Message.objects.filter(message_id=f"slack_{thread}").exists())
+
+
+class PruneConversationsTests(TestCase):
+    def conversation(self, thread_ts, age_days, messages=1):
+        conversation = Conversation.objects.create(channel_id="C1", thread_ts=thread_ts)
+        Conversation.objects.filter(pk=conversation.pk).update(created_at=timezone.now() - timedelta(days=age_days))
+        for n in range(messages):
+            Message.objects.create(
+                conversation=conversation, content="hello", user_id="U1", message_id=f"slack_{thread_ts}_{n}",
+                timestamp=timezone.now() - timedelta(days=age_days)
+            )
+        return conversation
+
+    def prune(self, **options):
+        output = mock.Mock()
+        call_command("prune_conversations", older_than=30, chunk_size=2, stdout=output, **options)
+        return str(output.write.call_args_list)
+
+    def test_dry_run_reports_without_deleting(self):
+        self.conversation("1.000001", age_days=40, messages=3)
+        self.conversation("2.000001", age_days=1)
+        output = self.prune(dry_run=True)
+        self.assertIn("Would reclaim 1 conversations and 3 messages", output)
+        self.assertEqual(Conversation.objects.count(), 2)
+        self.assertEqual(Message.objects.count(), 4)
+
+    def test_inactive_conversations_are_archived_then_deleted(self):
+        expired = [self.conversation(f"{n}.000001", age_days=40, messages=n) for n in range(1, 4)]
+        empty = self.conversation("4.000001", age_days=40, messages=0)
+        active = self.conversation("5.000001", age_days=1)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        output = self.prune(archive_dir=directory.name)
+
+        self.assertIn("Reclaimed 4 conversations and 6 messages", output)
+        self.assertEqual(list(Conversation.objects.values_list("pk", flat=True)), [active.pk])
+        self.assertEqual(Message.objects.count(), 1)
+        archived = {}
+        for kind in ("conversations", "messages"):
+            [path] = Path(directory.name).glob(f"{kind}-*.jsonl.gz")
+            with gzip.open(path, "rt") as handle:
+                archived[kind] = [json.loads(line) for line in handle]
+        self.assertEqual(
+            sorted(row["id"] for row in archived["conversations"]),
+            [conversation.pk for conversation in expired + [empty]]
+        )
+        self.assertEqual(len(archived["messages"]), 6)
+        self.assertEqual({row["conversation_id"] for row in archived["messages"]}, {c.pk for c in expired})
+
+    def test_cutoff_must_be_at_least_a_day(self):
+        with self.assertRaises(CommandError):
+            call_command("prune_conversations", older_than=0)
+
+    def test_conversation_revived_during_the_run_keeps_its_history(self):
+        revived = self.conversation("1.000001", age_days=40, messages=3)
+        expired = self.conversation("2.000001", age_days=40)
+        archive = PruneCommand._archive
+
+        def archive_then_reply(command, conversation_ids, handles):
+            archive(command, conversation_ids, handles)
+            Message.objects.create(
+                conversation=revived, content="still here", user_id="U1", message_id="slack_1.000009",
+                timestamp=timezone.now()
+            )
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with mock.patch.object(PruneCommand, "_archive", archive_then_reply):
+            call_command("prune_conversations", older_than=30, archive_dir=directory.name, stdout=mock.Mock())
+
+        self.assertFalse(Conversation.objects.filter(pk=expired.pk).exists())
+        self.assertEqual(Message.objects.filter(conversation=revived).count(), 4)
+
+
+class WorkspaceClientCacheTests(TestCase):
+    def setUp(self):
+        self.loads = []
+
+        async def loader(team_id):
+            self.loads.append(team_id)
+            return f"xoxb-{team_id}-{len(self.loads)}"
+        self.cache = WorkspaceClientCache(loader, ttl=60, max_size=2)
+
+    async def test_tokens_are_loaded_once_until_they_expire(self):
+        self.assertEqual(await self.cache.get_token("T1"), "xoxb-T1-1")
+        self.assertEqual(await self.cache.get_token("T1"), "xoxb-T1-1")
+        self.assertEqual(self.loads, ["T1"])
+
+        self.cache._entries["T1"].expires_at = time.monotonic() - 1
+        self.assertEqual(await self.cache.get_token("T1"), "xoxb-T1-2")
+        self.assertEqual(self.cache.stats(), {"size": 1, "hits": 1, "misses": 2})
+
+    async def test_least_recently_used_workspace_is_evicted(self):
+        for team_id in ("T1", "T2", "T1", "T3"):
+            await self.cache.get_token(team_id)
+        self.assertEqual(list(self.cache._entries), ["T1", "T3"])
+
+    async def test_invalidate_reloads_the_token_and_bot_user(self):
+        await self.cache.get_token("T1")
+        self.cache.set_bot_user_id("T1", "UBOT")
+        self.cache.invalidate("T1")
+        self.assertEqual(await self.cache.get_token("T1"), "xoxb-T1-2")
+        self.assertNotIn("T1", self.cache._bot_users)
+
+    async def test_clients_are_reused_and_share_one_session_per_loop(self):
+        first = await self.cache.get_client("T1")
+        self.assertIs(await self.cache.get_client("T1"), first)
+        second = await self.cache.get_client("T2")
+        self.assertIs(second.session, first.session)
+        await self.cache.aclose()
+        self.assertTrue(first.session.closed)
+        self.assertIsNot(await self.cache.get_client("T1"), first)
+        await self.cache.aclose()
+
+    async def test_saving_a_workspace_token_invalidates_it(self):
+        workspace_clients.put("T9", "xoxb-old")
+        self.addCleanup(workspace_clients.invalidate, "T9")
+        await WorkspaceToken.objects.acreate(team_id="T9", bot_token="xoxb-new")
+        self.assertEqual(await workspace_clients.get_token("T9"), "xoxb-new")
+
+
+class ConversationUpsertTests(TestCase):
+    async def test_existing_thread_is_returned(self):
+        existing = await Conversation.objects.acreate(channel_id="C1", thread_ts="1.000001")
+        conversation = await SlackBot._get_or_create_conversation("C1", "1.000001")
+        self.assertEqual(conversation.pk, existing.pk)
+
+    async def test_thread_created_after_the_lookup_is_upserted(self):
+        existing = await Conversation.objects.acreate(channel_id="C1", thread_ts="1.000001")
+        # Another worker creates the thread between the lookup and the insert.
+        with mock.patch("django.db.models.query.QuerySet.afirst", return_value=None):
+            conversation = await SlackBot._get_or_create_conversation("C1", "1.000001")
+        self.assertEqual(conversation.pk, existing.pk)
+        self.assertEqual(await Conversation.objects.acount(), 1)
+
+
+class MessageStoreTests(TransactionTestCase):
+    # The bot stores messages outside a transaction; inside one, the failed duplicate insert would break it.
+    async def test_duplicate_message_is_not_stored_or_cached(self):
+        history_cache.clear()
+        self.addCleanup(history_cache.clear)
+        conversation = await SlackBot._get_or_create_conversation("C1", "1.000001")
+        self.assertTrue(await SlackBot._store_message(conversation, "hi", "U1", message_id="slack_1.000001"))
+        self.assertFalse(await SlackBot._store_message(conversation, "hi", "U1", message_id="slack_1.000001"))
+        self.assertEqual(await Message.objects.acount(), 1)
+        history = await SlackBot._get_conversation_history(conversation)
+        self.assertEqual([message.content for message in history], ["hi"])
+
+
+class DuplicateMentionTests(StubTestMixin, TransactionTestCase):
+    def test_redelivered_mention_is_not_answered_twice(self):
+        async def handle(events):
+            try:
+                return await SlackBot.handle_mentions(events)
+            finally:
+                await workspace_clients.aclose()
+                await llm_backend.aclose()
+
+        now = f"{time.time():.6f}"
+        self.assertEqual(asyncio.run(handle([self.mention(now)])), "ok")
+        self.assertEqual(asyncio.run(handle([self.mention(now)])), "duplicate")
+        self.assertEqual(self.stubs.openai.calls, 1)
+        self.assertEqual(len(self.stubs.posted("C1", now)), 1)
+
+
+class ContextWindowTests(SimpleTestCase):
+    def message(self, tokens, content="text", is_bot=False):
+        return SimpleNamespace(content=content, token_count=tokens, is_bot=is_bot)
+
+    def test_history_is_packed_newest_first_within_the_budget(self):
+        history = [self.message(40), self.message(30), self.message(20), self.message(10)]
+        older, recent = pack_history(history, 59)
+        self.assertEqual(older, history[:2])
+        self.assertEqual(recent, history[2:])
+        self.assertEqual(pack_history(history, 60), (history[:1], history[1:]))
+        self.assertEqual(pack_history(history, 100), ([], history))
+
+    def test_newest_message_is_kept_over_the_budget(self):
+        history = [self.message(10), self.message(500)]
+        self.assertEqual(pack_history(history, 100), (history[:1], history[1:]))
+
+    def test_summary_precedes_the_recent_messages(self):
+        messages = build_messages("system", "earlier", [self.message(1, "hi"), self.message(1, "hello", is_bot=True)])
+        self.assertEqual([message["role"] for message in messages], ["system", "system", "user", "assistant"])
+        self.assertIn("earlier", messages[1]["content"])
+
+
+class RollingSummaryTests(TestCase):
+    async def messages(self, conversation, count):
+        started = timezone.now() - timedelta(minutes=count)
+        return [
+            await Message.objects.acreate(
+                conversation=conversation, content=f"message {n}", user_id="U1",
+                message_id=f"slack_{n}", timestamp=started + timedelta(minutes=n)
+            )
+            for n in range(count)
+        ]
+
+    async def test_only_messages_after_summarized_until_are_folded_in(self):
+        conversation = await Conversation.objects.acreate(channel_id="C1", thread_ts="1.000001")
+        older = await self.messages(conversation, 4)
+        with mock.patch("chat.slack_bot.summarize", mock.AsyncMock(return_value="first")) as summarize:
+            await SlackBot._update_summary(conversation, older[:2])
+            await SlackBot._update_summary(conversation, older)
+            await SlackBot._update_summary(conversation, older)
+
+        self.assertEqual(summarize.await_count, 2)
+        self.assertEqual(summarize.await_args_list[1].args, ("first", older[2:]))
+        stored = await Conversation.objects.aget(pk=conversation.pk)
+        self.assertEqual(stored.summarized_until, older[-1].timestamp)
+        self.assertEqual(stored.summary, "first")
+
+    async def test_failed_summary_leaves_the_conversation_unchanged(self):
+        conversation = await Conversation.objects.acreate(channel_id="C1", thread_ts="1.000001")
+        older = await self.messages(conversation, 2)
+        with mock.patch("chat.slack_bot.summarize", mock.AsyncMock(return_value=None)):
+            await SlackBot._update_summary(conversation, older)
+        stored = await Conversation.objects.aget(pk=conversation.pk)
+        self.assertIsNone(stored.summarized_until)
+        self.assertFalse(stored.summary)
+
+
+class LifespanTests(TransactionTestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(lifecycle, "_server_loop", None),
+            mock.patch.object(mention_pool, "start"),
+            mock.patch.object(mention_pool, "stop"),
+            mock.patch.object(llm_backend, "client"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(workspace_clients.clear)
+
+    def run_lifespan(self, *messages):
+        from slackbot.asgi import application
+
+        async def lifespan():
+            received = asyncio.Queue()
+            for message in messages:
+                received.put_nowait({"type": message})
+            sent = []
+
+            async def send(message):
+                sent.append(message["type"])
+
+            await application({"type": "lifespan"}, received.get, send)
+            return sent
+
+        return asyncio.run(lifespan())
+
+    def test_startup_warms_the_process_and_shutdown_drains_it(self):
+        WorkspaceToken.objects.create(team_id="T1", bot_token="xoxb-test")
+        with override_settings(SLACK_EVENT_MODE="queue", LAZY_STARTUP=False), \
+                mock.patch.object(message_writes, "stop") as flush:
+            sent = self.run_lifespan("lifespan.startup", "lifespan.shutdown")
+
+        self.assertEqual(sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        mention_pool.start.assert_called_once_with()
+        llm_backend.client.assert_called_once_with()
+        self.assertEqual(workspace_clients.stats()["size"], 1)
+        mention_pool.stop.assert_called_once_with()
+        flush.assert_called_once_with()
+
+    def test_lazy_startup_leaves_clients_to_the_first_mention(self):
+        WorkspaceToken.objects.create(team_id="T1", bot_token="xoxb-test")
+        with override_settings(SLACK_EVENT_MODE="inline", LAZY_STARTUP=True):
+            sent = self.run_lifespan("lifespan.startup", "lifespan.shutdown")
+        self.assertEqual(sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        mention_pool.start.assert_not_called()
+        llm_backend.client.assert_not_called()
+        self.assertEqual(workspace_clients.stats()["size"], 0)
+
+    def test_failed_startup_is_reported_to_the_server(self):
+        with mock.patch.object(lifecycle, "describe_database", side_effect=RuntimeError("no database")), \
+                self.assertLogs("slackbot.asgi", "ERROR"):
+            sent = self.run_lifespan("lifespan.startup")
+        self.assertEqual(sent, ["lifespan.startup.failed"])
+
+    def test_server_loop_keeps_its_clients_between_requests(self):
+        async def request():
+            lifecycle._server_loop = asyncio.get_running_loop()
+            with mock.patch.object(lifecycle, "close_loop_clients") as close:
+                await lifecycle.close_request_clients()
+                lifecycle._server_loop = None
+                await lifecycle.close_request_clients()
+            return close.await_count
+
+        self.assertEqual(asyncio.run(request()), 1)
+
+
+class ThreadCoalescerTests(SimpleTestCase):
+    def event(self, ts, thread_ts="1.000001", channel="C1"):
+        return {"channel": channel, "ts": ts, "thread_ts": thread_ts}
+
+    async def test_burst_in_the_window_is_answered_once(self):
+        coalescer = ThreadCoalescer(window=0.05)
+        batches = []
+
+        async def handler(events):
+            batches.append([event["ts"] for event in events])
+            return "ok"
+
+        outcomes = await asyncio.gather(
+            coalescer.submit(self.event("1.1"), handler),
+            coalescer.submit(self.event("1.2"), handler),
+            coalescer.submit(self.event("2.1", thread_ts="2.000001"), handler),
+        )
+        self.assertEqual(outcomes, ["ok", None, "ok"])
+        self.assertEqual(sorted(batches), [["1.1", "1.2"], ["2.1"]])
+        self.assertEqual(coalescer.coalesced, 1)
+
+    async def test_mentions_during_a_completion_get_one_follow_up(self):
+        coalescer = ThreadCoalescer(window=0.01)
+        batches = []
+
+        async def handler(events):
+            batches.append([event["ts"] for event in events])
+            if len(batches) == 1:
+                for ts in ("1.2", "1.3"):
+                    self.assertFalse(coalescer.add(self.event(ts)))
+            return "ok"
+
+        self.assertEqual(await coalescer.submit(self.event("1.1"), handler), "ok")
+        self.assertEqual(batches, [["1.1"], ["1.2", "1.3"]])
+        self.assertTrue(coalescer.add(self.event("1.4")))
+
+    async def test_deferred_batch_stays_open_with_its_mentions(self):
+        coalescer = ThreadCoalescer(window=0.01)
+        outcomes = iter(["deferred", "ok"])
+        batches = []
+
+        async def handler(events):
+            batches.append([event["ts"] for event in events])
+            return next(outcomes)
+
+        self.assertTrue(coalescer.add(self.event("1.1")))
+        self.assertEqual(await coalescer.run(thread_key(self.event("1.1")), handler), "deferred")
+        self.assertFalse(coalescer.add(self.event("1.2")))
+        self.assertEqual(await coalescer.run(thread_key(self.event("1.1")), handler), "ok")
+        self.assertEqual(batches, [["1.1"], ["1.1", "1.2"]])
+
+    async def test_failed_batch_is_closed(self):
+        coalescer = ThreadCoalescer(window=0.01)
+
+        async def handler(events):
+            raise RuntimeError("boom")
+
+        with self.assertLogs("chat.coalesce", "ERROR"):
+            self.assertEqual(await coalescer.submit(self.event("1.1"), handler), "error")
+        self.assertTrue(coalescer.add(self.event("1.2")))
+
+
+class CoalescedMentionTests(StubTestMixin, TransactionTestCase):
+    def test_batched_mentions_share_one_completion(self):
+        async def handle(events):
+            try:
+                return await SlackBot.handle_mentions(events)
+            finally:
+                await workspace_clients.aclose()
+                await llm_backend.aclose()
+
+        thread = f"{time.time():.6f}"
+        later = f"{float(thread) + 1:.6f}"
+        mentions = [self.mention(thread, "<@UBOT> first"), self.mention(later, "<@UBOT> second", thread)]
+        self.assertEqual(asyncio.run(handle(mentions)), "ok")
+        self.assertEqual(self.stubs.openai.calls, 1)
+        self.assertEqual(len(self.stubs.posted("C1", thread)), 1)
+        self.assertEqual(
+            sorted(Message.objects.filter(is_bot=False).values_list("content", "processed")),
+            [("<@UBOT> first", True), ("<@UBOT> second", True)]
+        )
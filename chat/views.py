@@ -1,9 +1,22 @@
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
+import hmac
 import json
-import requests
-from .slack_bot import slack_app, SlackBot
+from .slack_bot import SlackBot, defer_mention, mention_pool
+from .capture import trace_writer
+from .admission import admission
+from .coalesce import coalescer, thread_key
+from .dedup import seen_events
+from .jobs import enqueue_mention
+from .lifecycle import close_request_clients
+from .history_cache import history_cache
+from .metrics import duplicates, registry
+from .profiling import PROFILE_MARK
+from .response_cache import response_cache
+from .workspace_cache import workspace_clients
+from .write_buffer import message_writes
+from .rate_limit import llm_concurrency, llm_team_limiter, slack_limiter
 import logging
 from .models import WorkspaceToken
 from asgiref.sync import sync_to_async
@@ -16,6 +29,19 @@ async def slack_events(request):
     """
     Handles incoming Slack events and verifications.
     """
+    try:
+        return await _handle_slack_event(request)
+    finally:
+        await close_request_clients()
+
+async def _handle_slack_event(request):
+    if trace_writer is not None:
+        _capture(request)
+
+    if _is_timeout_retry(request):
+        return HttpResponse(status=200)
+
+    dedup_key = None
     try:
         body = json.loads(request.body.decode('utf-8'))
         
@@ -26,7 +52,32 @@ async def slack_events(request):
             event = body.get("event", {})
             
             if event.get("type") == "app_mention":
-                await SlackBot.handle_mention(event, slack_app.client)
+                dedup_key = body.get("event_id") or f"{event.get('channel')}:{event.get('event_ts')}"
+                if not seen_events.add(dedup_key):
+                    logger.info(f"Duplicate delivery of event {dedup_key}, skipping")
+                    duplicates.inc(source="event_id")
+                    return HttpResponse(status=200)
+
+                if settings.SLACK_BACKFILL:
+                    _remember_bot_user(body)
+                if getattr(request, "profiled", False) and settings.SLACK_EVENT_MODE in ("jobs", "queue"):
+                    event[PROFILE_MARK] = True
+                if settings.SLACK_EVENT_MODE == "jobs":
+                    response = await _enqueue_job(event)
+                    if response.status_code != 200:
+                        seen_events.discard(dedup_key)
+                    return response
+                if settings.SLACK_EVENT_MODE == "queue":
+                    response = _enqueue_mention(event)
+                    if response.status_code != 200:
+                        seen_events.discard(dedup_key)
+                    return response
+                if coalescer.enabled:
+                    outcome = await coalescer.submit(event, SlackBot.handle_mentions)
+                else:
+                    outcome = await SlackBot.handle_mention(event, None)
+                if outcome == "deferred":
+                    await defer_mention(event)
                 return HttpResponse(status=200)
                 
         logger.warning(f"Received unknown event type: {body.get('type')}")
@@ -37,8 +88,169 @@ async def slack_events(request):
         return HttpResponse(status=400)
     except Exception as e:
         logger.error(f"Error processing slack event: {str(e)}")
+        if dedup_key:
+            # Slack retries after a 500; let the retry through.
+            seen_events.discard(dedup_key)
         return HttpResponse(status=500)
 
+def _capture(request):
+    """
+    Appends the raw envelope to the replay trace. Capture problems never fail the request.
+    """
+    try:
+        trace_writer.write(request)
+    except Exception as e:
+        logger.error(f"Error capturing Slack event: {str(e)}")
+
+def _is_timeout_retry(request):
+    """
+    Slack retries an event it already delivered when the first attempt was not
+    acknowledged in time. That attempt is still being processed, so the retry
+    can be acknowledged without even parsing the body. Retries caused by errors
+    fall through to the event_id check and the database backstop.
+    """
+    if not request.headers.get("X-Slack-Retry-Num"):
+        return False
+    if request.headers.get("X-Slack-Retry-Reason") != "http_timeout":
+        return False
+    seen_events.record_duplicate()
+    duplicates.inc(source="retry_header")
+    logger.info(f"Skipping Slack retry {request.headers['X-Slack-Retry-Num']} after http_timeout")
+    return True
+
+REQUIRED_EVENT_FIELDS = ("team", "channel", "ts", "user", "text", "event_ts")
+
+def _remember_bot_user(body):
+    """
+    Notes the bot's user ID from the envelope's authorizations, which saves the
+    thread backfill an auth.test call.
+    """
+    for authorization in body.get("authorizations") or []:
+        if authorization.get("is_bot") and authorization.get("team_id") and authorization.get("user_id"):
+            workspace_clients.set_bot_user_id(authorization["team_id"], authorization["user_id"])
+
+def _enqueue_mention(event):
+    """
+    Validates a mention event and hands it to the background worker pool.
+    """
+    missing = [key for key in REQUIRED_EVENT_FIELDS if key not in event]
+    if missing:
+        logger.error(f"Mention event missing fields {missing}, dropping")
+        return HttpResponse(status=200)
+
+    if coalescer.enabled:
+        if not coalescer.add(event):
+            # A batch for this thread is already scheduled and will answer it.
+            return HttpResponse(status=200)
+        if not mention_pool.submit(event, delay=coalescer.window):
+            coalescer.abandon(thread_key(event))
+            logger.error("Mention queue is full, asking Slack to retry later")
+            return HttpResponse(status=503)
+        return HttpResponse(status=200)
+
+    if not mention_pool.submit(event):
+        logger.error("Mention queue is full, asking Slack to retry later")
+        return HttpResponse(status=503)
+
+    return HttpResponse(status=200)
+
+async def _enqueue_job(event):
+    """
+    Validates a mention event and stores it as a job for the `process_mentions`
+    workers. Jobs of one thread that fall due together are answered together,
+    so the coalescing window is applied as a delay.
+    """
+    missing = [key for key in REQUIRED_EVENT_FIELDS if key not in event]
+    if missing:
+        logger.error(f"Mention event missing fields {missing}, dropping")
+        return HttpResponse(status=200)
+
+    try:
+        await enqueue_mention(event, delay=coalescer.window)
+    except Exception as e:
+        logger.error(f"Could not store mention job, asking Slack to retry later: {str(e)}")
+        return HttpResponse(status=503)
+    return HttpResponse(status=200)
+
+def _internal_request_allowed(request):
+    """
+    Checks the bearer token of a request for an internal endpoint. Without a
+    METRICS_TOKEN the endpoints are off.
+    """
+    if not settings.METRICS_TOKEN:
+        return False
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+
+async def worker_pool_stats(request):
+    """
+    Reports queue depth and queue wait times of the mention worker pool, and
+    the admission controller's view of the load.
+    """
+    if not _internal_request_allowed(request):
+        return HttpResponse(status=404)
+    return JsonResponse({**mention_pool.stats(), "admission": admission.stats()})
+
+registry.register_collector(
+    "slackbot_queue_depth", "Mentions waiting for a worker.",
+    lambda: [({}, mention_pool.stats()["queue_depth"])]
+)
+registry.register_collector(
+    "slackbot_queue_wait_seconds", "Queue wait time of mentions (avg, max, last).",
+    lambda: [({"stat": stat}, mention_pool.stats()[f"wait_{stat}"]) for stat in ("avg", "max", "last")]
+)
+registry.register_collector(
+    "slackbot_cache_events_total", "Hits and misses of the in-process caches.",
+    lambda: [
+        ({"cache": name, "event": event}, stats[event])
+        for name, stats in (
+            ("workspace", workspace_clients.stats()),
+            ("history", history_cache.stats()),
+            ("response", response_cache.stats()),
+        )
+        for event in ("hits", "misses")
+    ],
+    kind="counter"
+)
+
+registry.register_collector(
+    "slackbot_llm_in_flight", "LLM calls holding a concurrency slot.",
+    lambda: [({}, llm_concurrency.stats()["in_flight"])]
+)
+registry.register_collector(
+    "slackbot_llm_waiting", "LLM calls waiting for a concurrency slot, by team.",
+    lambda: [({"team": team}, count) for team, count in llm_concurrency.stats()["waiting"].items()]
+)
+registry.register_collector(
+    "slackbot_throttled_total", "Calls delayed by a rate limit bucket.",
+    lambda: [({"limiter": "slack"}, slack_limiter.throttled), ({"limiter": "llm"}, llm_team_limiter.throttled)],
+    kind="counter"
+)
+registry.register_collector(
+    "slackbot_rate_limit_timeouts_total", "Calls failed because their rate limit wait was over the maximum.",
+    lambda: [({"limiter": "slack"}, slack_limiter.timed_out), ({"limiter": "llm"}, llm_team_limiter.timed_out)],
+    kind="counter"
+)
+
+registry.register_collector(
+    "slackbot_coalesced_mentions_total", "Mentions answered as part of another mention's batch.",
+    lambda: [({}, coalescer.coalesced)],
+    kind="counter"
+)
+
+registry.register_collector(
+    "slackbot_buffered_messages", "Message writes waiting for the next write-behind flush.",
+    lambda: [({}, message_writes.stats()["buffered"])]
+)
+
+async def metrics(request):
+    """
+    Exposes the process's metrics in the Prometheus text format.
+    """
+    if not _internal_request_allowed(request):
+        return HttpResponse(status=404)
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 async def slack_oauth_redirect(request):
     """Handle the OAuth redirect from Slack"""
     code = request.GET.get('code')
@@ -49,7 +261,7 @@ async def slack_oauth_redirect(request):
     try:
         async with aiohttp.ClientSession() as session:
             async with session.post(
-                'https://slack.com/api/oauth.v2.access',
+                f"{settings.SLACK_API_URL}oauth.v2.access",
                 data={
                     'client_id': settings.SLACK_CLIENT_ID,
                     'client_secret': settings.SLACK_CLIENT_SECRET,
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class MentionWorkerPool:
+    """
+    Fixed-size pool of asyncio workers that drains queued Slack mentions in the
+    background so the events endpoint can acknowledge Slack immediately.
+
+    The pool runs its own event loop on a daemon thread, so it keeps working
+    whether the view was served by a WSGI or an ASGI worker. Every event is
+    routed to a worker by hashing its (channel_id, thread_ts), which keeps
+    messages of the same thread in arrival order. `cleanup()`, if given, runs
+    on the pool's loop after draining, to close clients bound to that loop.
+    """
+
+    def __init__(self, handler, workers=4, max_queue_size=1000, cleanup=None):
+        self.handler = handler
+        self.cleanup = cleanup
+        self.workers = max(1, workers)
+        self.max_queue_size = max_queue_size
+        self._loop = None
+        self._thread = None
+        self._queues = []
+        self._tasks = []
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._processed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+
+    def start(self):
+        """
+        Starts the background loop and the workers. Safe to call more than once.
+        """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._started.clear()
+            self._thread = threading.Thread(
+                target=self._run_loop, name="mention-worker-pool", daemon=True
+            )
+            self._thread.start()
+        self._started.wait()
+
+    def stop(self, timeout=10):
+        """
+        Lets the workers drain what is already queued, then stops the loop.
+        """
+        if not self._loop or not self._thread:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._drain(), self._loop)
+        try:
+            future.result(timeout=timeout)
+        except Exception as e:
+            logger.warning(f"Worker pool did not drain cleanly: {str(e)}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def submit(self, event, delay=0):
+        """
+        Enqueues a mention event, optionally only after `delay` seconds.
+        Returns False when the pool is at capacity.
+        """
+        self.start()
+        with self._lock:
+            if self._depth >= self.max_queue_size:
+                self._rejected += 1
+                return False
+            self._depth += 1
+
+        queue = self._queues[self._shard(event)]
+        item = (time.monotonic() + delay, event)
+        if delay:
+            self._loop.call_soon_threadsafe(self._loop.call_later, delay, queue.put_nowait, item)
+        else:
+            self._loop.call_soon_threadsafe(queue.put_nowait, item)
+        return True
+
+    def stats(self):
+        """
+        Returns a snapshot of queue depth and queue wait time in seconds.
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self._depth,
+                "max_queue_size": self.max_queue_size,
+                "processed": self._processed,
+                "rejected": self._rejected,
+                "wait_avg": self._wait_total / self._processed if self._processed else 0.0,
+                "wait_max": self._wait_max,
+                "wait_last": self._wait_last,
+            }
+
+    def _shard(self, event):
+        key = f"{event.get('channel')}:{event.get('thread_ts', event.get('ts'))}"
+        return zlib.crc32(key.encode("utf-8")) % self.workers
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [
+            self._loop.create_task(self._worker(queue)) for queue in self._queues
+        ]
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            self._loop.run_until_complete(
+                asyncio.gather(*self._tasks, return_exceptions=True)
+            )
+            self._loop.close()
+
+    async def _worker(self, queue):
+        while True:
+            enqueued_at, event = await queue.get()
+            waited = time.monotonic() - enqueued_at
+            with self._lock:
+                self._depth -= 1
+                self._processed += 1
+                self._wait_total += waited
+                self._wait_last = waited
+                self._wait_max = max(self._wait_max, waited)
+            try:
+                await self.handler(event)
+            except Exception as e:
+                logger.error(f"Error in mention worker: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def _drain(self):
+        # Delayed submissions only reach a queue once their timer fires.
+        while self.stats()["queue_depth"]:
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+        if self.cleanup is not None:
+            await self.cleanup()
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import aiohttp
+from django.conf import settings
+
+from .models import WorkspaceToken
+from .rate_limit import RateLimitedWebClient
+
+logger = logging.getLogger(__name__)
+
+# Slack errors that mean the cached token is no longer usable.
+TOKEN_ERRORS = ("invalid_auth", "token_revoked", "account_inactive", "not_authed")
+
+
+class _Entry:
+    __slots__ = ("token", "client", "loop", "expires_at")
+
+    def __init__(self, token, expires_at):
+        self.token = token
+        self.client = None
+        self.loop = None
+        self.expires_at = expires_at
+
+
+class WorkspaceClientCache:
+    """
+    Process-wide cache of workspace bot tokens and long-lived Slack web clients,
+    keyed by team_id with TTL and LRU eviction.
+
+    aiohttp sessions are bound to an event loop, so one shared session (and its
+    connection pool) is kept per loop and every team's client reuses it. The
+    owner of a loop must call `aclose` on it before the loop closes; a session
+    cannot be closed once its loop is gone.
+    """
+
+    def __init__(self, loader, ttl=300, max_size=1000):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._bot_users = OrderedDict()
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def get_token(self, team_id):
+        """
+        Returns the bot token for a workspace, loading it on a cache miss.
+        """
+        entry = await self._get_entry(team_id)
+        return entry.token if entry else None
+
+    async def get_client(self, team_id):
+        """
+        Returns a warm, rate-limited Slack web client for a workspace, or None if it is not installed.
+        """
+        entry = await self._get_entry(team_id)
+        if not entry:
+            return None
+
+        loop = asyncio.get_running_loop()
+        if entry.client is None or entry.loop is not loop:
+            entry.client = RateLimitedWebClient(
+                token=entry.token,
+                base_url=settings.SLACK_API_URL,
+                session=self._session_for(loop),
+                rate_limit_team=team_id
+            )
+            entry.loop = loop
+        return entry.client
+
+    async def get_bot_user_id(self, team_id):
+        """
+        Returns the bot's user ID in a workspace. It is taken from event
+        envelopes when they carry it (see `set_bot_user_id`); otherwise one
+        auth.test call looks it up. It is kept until the workspace is invalidated.
+        """
+        with self._lock:
+            user_id = self._bot_users.get(team_id)
+        if user_id:
+            return user_id
+
+        client = await self.get_client(team_id)
+        if not client:
+            return None
+        user_id = (await client.auth_test()).get("user_id")
+        if user_id:
+            self.set_bot_user_id(team_id, user_id)
+        return user_id
+
+    def set_bot_user_id(self, team_id, user_id):
+        with self._lock:
+            self._bot_users[team_id] = user_id
+            self._bot_users.move_to_end(team_id)
+            while len(self._bot_users) > self.max_size:
+                self._bot_users.popitem(last=False)
+
+    def put(self, team_id, token):
+        """
+        Caches a token without a lookup, e.g. when preloading at startup.
+        """
+        entry = _Entry(token, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[team_id] = entry
+            self._entries.move_to_end(team_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, team_id):
+        """
+        Drops a workspace from the cache so the next lookup reloads its token.
+        """
+        with self._lock:
+            self._entries.pop(team_id, None)
+            self._bot_users.pop(team_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bot_users.clear()
+
+    async def aclose(self):
+        """
+        Closes the shared HTTP session of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._sessions.pop(loop, None)
+            for entry in self._entries.values():
+                if entry.loop is loop:
+                    entry.client = None
+                    entry.loop = None
+        if session and not session.closed:
+            await session.close()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    async def _get_entry(self, team_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(team_id)
+            if entry and entry.expires_at > now:
+                self._entries.move_to_end(team_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        token = await self.loader(team_id)
+        if not token:
+            return None
+
+        return self.put(team_id, token)
+
+    def _session_for(self, loop):
+        with self._lock:
+            for stale in [l for l in self._sessions if l.is_closed()]:
+                if not self._sessions.pop(stale).closed:
+                    logger.warning("Dropping a Slack HTTP session whose event loop closed before the session")
+            session = self._sessions.get(loop)
+            if session is None or session.closed:
+                session = aiohttp.ClientSession()
+                self._sessions[loop] = session
+            return session
+
+
+async def _load_bot_token(team_id):
+    """
+    Retrieves the bot token for a specific workspace.
+    """
+    return await WorkspaceToken.objects.filter(
+        team_id=team_id
+    ).values_list('bot_token', flat=True).afirst()
+
+
+workspace_clients = WorkspaceClientCache(
+    loader=_load_bot_token,
+    ttl=settings.WORKSPACE_CACHE_TTL,
+    max_size=settings.WORKSPACE_CACHE_SIZE
+)
+
+
+def invalidate_workspace(sender, instance, **kwargs):
+    """
+    Signal receiver that evicts a workspace whenever its WorkspaceToken row changes.
+    """
+    workspace_clients.invalidate(instance.team_id)
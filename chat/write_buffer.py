@@ -0,0 +1,221 @@
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """
+    Write-behind buffer for Message rows. Inserts and processed-flag updates are
+    collected in memory and written by a background thread every `interval`
+    seconds, or as soon as `max_rows` inserts are waiting, with one bulk insert
+    and one update per flush. That turns one commit (and on SQLite one fsync)
+    per message into one per batch.
+
+    Buffered messages stay visible through `contains()` and `pending_for()` until
+    they are committed. A crash loses at most the last interval's writes; the
+    buffer is flushed on shutdown and at interpreter exit. A batch that fails
+    `max_attempts` flushes in a row is written one row at a time, and rows that
+    still fail are logged and dropped, so one bad row cannot block the rest.
+    """
+
+    def __init__(self, interval=0.0, max_rows=100, max_attempts=3):
+        self.interval = interval
+        self.max_rows = max_rows
+        self.max_attempts = max_attempts
+        self._failures = 0
+        self._inserts = []
+        self._processed = set()
+        self._pending = {}
+        self._in_flight = set()
+        self._future = Future()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self.flushes = 0
+        self.rows = 0
+        self.dropped = 0
+        atexit.register(self.stop)
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def add(self, message):
+        """
+        Buffers an unsaved Message for insertion. Returns False, and buffers
+        nothing, when a message with the same message_id is already waiting.
+        """
+        self._start()
+        with self._lock:
+            if message.message_id in self._pending:
+                return False
+            self._inserts.append(message)
+            self._pending[message.message_id] = message
+            if len(self._inserts) >= self.max_rows:
+                self._wake.set()
+            return True
+
+    def mark_processed(self, message_ids):
+        """
+        Buffers setting processed=True on messages, folding it into the insert of
+        messages that are still waiting to be written.
+        """
+        self._start()
+        with self._lock:
+            for message_id in message_ids:
+                message = self._pending.get(message_id)
+                if message is not None and message_id not in self._in_flight:
+                    message.processed = True
+                else:
+                    self._processed.add(message_id)
+
+    def contains(self, message_id):
+        with self._lock:
+            return message_id in self._pending
+
+    def pending_for(self, conversation_id):
+        """
+        Returns the buffered messages of a conversation that are not committed yet.
+        """
+        with self._lock:
+            return [
+                message for message in self._pending.values()
+                if message.conversation_id == conversation_id
+            ]
+
+    def flushed(self):
+        """
+        Returns a concurrent.futures.Future that resolves once everything buffered
+        so far is written or dropped (True) or the write failed and was requeued (False).
+        """
+        with self._lock:
+            return self._future
+
+    def flush(self):
+        """
+        Writes the buffered inserts and updates in one transaction.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, processed, future = self._inserts, self._processed, self._future
+                self._inserts, self._processed, self._future = [], set(), Future()
+                self._in_flight = {message.message_id for message in batch}
+
+            ok = True
+            if batch or processed:
+                try:
+                    close_old_connections()
+                    with transaction.atomic():
+                        try:
+                            with transaction.atomic():
+                                Message.objects.bulk_create(batch)
+                        except IntegrityError:
+                            # Another process stored one of these messages first.
+                            Message.objects.bulk_create(batch, ignore_conflicts=True)
+                        if processed:
+                            Message.objects.filter(message_id__in=processed).update(processed=True)
+                except Exception as e:
+                    self._failures += 1
+                    if self._failures < self.max_attempts:
+                        logger.error(f"Error flushing {len(batch)} buffered messages, will retry: {str(e)}")
+                        ok = False
+                    else:
+                        logger.error(
+                            f"Error flushing {len(batch)} buffered messages {self._failures} times, "
+                            f"writing them one at a time: {str(e)}"
+                        )
+                        self._write_each(batch, processed)
+                if ok:
+                    self._failures = 0
+
+            with self._lock:
+                if ok:
+                    for message in batch:
+                        self._pending.pop(message.message_id, None)
+                    self.flushes += 1
+                    self.rows += len(batch)
+                else:
+                    self._inserts[:0] = batch
+                    self._processed |= processed
+                self._in_flight = set()
+            future.set_result(ok)
+
+    def _write_each(self, batch, processed):
+        """
+        Writes a batch row by row, dropping (and logging) the rows that fail.
+        """
+        for message in batch:
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+            except IntegrityError as e:
+                if Message.objects.filter(message_id=message.message_id).exists():
+                    # Another process stored this message first.
+                    continue
+                logger.error(f"Dropping buffered message {message.message_id}: {str(e)}")
+                self.dropped += 1
+            except Exception as e:
+                logger.error(f"Dropping buffered message {message.message_id}: {str(e)}")
+                self.dropped += 1
+        for message_id in processed:
+            try:
+                Message.objects.filter(message_id=message_id).update(processed=True)
+            except Exception as e:
+                logger.error(f"Dropping processed flag of message {message_id}: {str(e)}")
+                self.dropped += 1
+
+    def stop(self):
+        """
+        Stops the background thread and writes whatever is still buffered.
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        thread.join()
+        self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered": len(self._inserts),
+                "pending_updates": len(self._processed),
+                "flushes": self.flushes,
+                "rows": self.rows,
+                "dropped": self.dropped,
+            }
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="message-write-buffer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._stopping:
+                self.flush()
+
+
+message_writes = MessageWriteBuffer(
+    interval=settings.MESSAGE_FLUSH_INTERVAL,
+    max_rows=settings.MESSAGE_FLUSH_ROWS
+)
@@ -1,3 +1,24 @@
-bind = "0.0.0.0:8000"
-workers = 2
-timeout = 120
\ No newline at end of file
+import os
+import sys
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+# SERVER_INTERFACE=asgi serves slackbot.asgi with one long-lived event loop per
+# worker (start gunicorn without an app argument). The default keeps the WSGI app.
+if os.getenv("SERVER_INTERFACE", "wsgi") == "asgi":
+    wsgi_app = "slackbot.asgi:application"
+    worker_class = "slackbot.workers.SlackbotUvicornWorker"
+
+
+def worker_exit(server, worker):
+    # WSGI workers have no lifespan shutdown, so queued mentions and buffered
+    # writes are drained here. Under ASGI this finds them already stopped.
+    lifecycle = sys.modules.get("chat.lifecycle")
+    if lifecycle is not None:
+        lifecycle.stop_background_work()
@@ -2,15 +2,51 @@
 ASGI config for slackbot project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides HTTP, the callable answers the ASGI lifespan protocol, so the server's
+long-lived event loop runs chat.lifecycle's startup and shutdown hooks.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
+import logging
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'slackbot.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from chat import lifecycle  # noqa: E402  (needs the app registry loaded above)
+
+logger = logging.getLogger(__name__)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await lifecycle.startup()
+            except Exception as e:
+                logger.exception("Startup failed")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            try:
+                await lifecycle.shutdown()
+            except Exception as e:
+                logger.exception("Shutdown failed")
+                await send({'type': 'lifespan.shutdown.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    await django_application(scope, receive, send)
@@ -21,5 +21,7 @@ from chat import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('slack/events', views.slack_events, name='slack_events'),
+    path('slack/queue_stats', views.worker_pool_stats, name='worker_pool_stats'),
+    path('metrics', views.metrics, name='metrics'),
     path('slack/oauth_redirect', views.slack_oauth_redirect, name='slack_oauth_redirect'),
 ]
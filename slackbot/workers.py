@@ -0,0 +1,23 @@
+"""
+Gunicorn worker classes for serving slackbot.asgi.application, built on the
+uvicorn-worker package (uvicorn's own uvicorn.workers module is deprecated).
+"""
+
+import os
+
+from uvicorn_worker import UvicornWorker
+
+
+class SlackbotUvicornWorker(UvicornWorker):
+    """
+    Uvicorn worker with the lifespan protocol required, so a worker that fails
+    its startup hooks never takes traffic, and an optional cap on concurrent
+    connections per worker.
+    """
+
+    CONFIG_KWARGS = {
+        'loop': 'auto',
+        'http': 'auto',
+        'lifespan': 'on',
+        'limit_concurrency': int(os.getenv('WORKER_CONCURRENCY', '0')) or None,
+    }